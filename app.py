@@ -1,14 +1,35 @@
 from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+import atexit
+import itertools
 import json
 import os
-from ollama_client import ollama_client
+import threading
+import time
+import uuid
+from ollama_client import get_ollama_client
+from catalog_retrieval import CatalogRetriever
+from recommendation_blurbs import BlurbCache, cohort_key
+from recommender import RecommendationEngine
+from course_index import CourseMaterialsIndex
+from similar_items import SimilarItemsIndex
+from suggest_index import SuggestIndex
+from facets import FacetIndex, FACETS
+from semantic_search import SemanticSearchIndex, LocalEmbedder, OllamaEmbedder
+from ollama_config import SEMANTIC_EMBEDDER, EMBEDDING_MODEL
+from storage import JsonStore, DEFAULT_COMMIT_WINDOW
+from oplog import LoggedJsonStore
+from user_store import UserStore, migrate_users_file
+from catalog_snapshot import CatalogSnapshot
+from session_store import ServerSideSessionInterface, make_session_store, SESSION_TTL
+from cache_store import get_cache
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key'  # Change this to a random secret key
 
 # File paths
-DATA_DIR = 'data'
-USERS_FILE = os.path.join(DATA_DIR, 'users.json')
+DATA_DIR = os.environ.get('STUDYHUB_DATA_DIR', 'data')
+USERS_FILE = os.path.join(DATA_DIR, 'users.json')   # pre-sharding users, split into USERS_DIR on startup
+USERS_DIR = os.path.join(DATA_DIR, 'users')
 LIBRARY_BOOKS_FILE = os.path.join(DATA_DIR, 'library_books.json')
 EBOOKS_FILE = os.path.join(DATA_DIR, 'ebooks.json')
 INTERNAL_MATERIALS_FILE = os.path.join(DATA_DIR, 'internal_materials.json')
@@ -17,23 +38,103 @@ SPECIAL_ROOMS_FILE = os.path.join(DATA_DIR, 'special_rooms.json')
 DEVICES_FILE = os.path.join(DATA_DIR, 'devices.json')
 WORKSHOPS_FILE = os.path.join(DATA_DIR, 'workshops.json')
 BOOKINGS_FILE = os.path.join(DATA_DIR, 'bookings.json')
+BLURBS_FILE = os.path.join(DATA_DIR, 'recommendation_blurbs.json')
+EMBEDDINGS_DIR = os.path.join(DATA_DIR, 'embeddings')
+OPLOG_FILE = os.path.join(DATA_DIR, 'oplog.jsonl')
+CATALOG_SNAPSHOT_FILE = os.path.join(DATA_DIR, 'catalog.snapshot')
+
+# Catalog sources, keyed by file, with the bookType used by the library API
+CATALOG_FILES = {
+    LIBRARY_BOOKS_FILE: 'physical',
+    EBOOKS_FILE: 'ebook',
+    INTERNAL_MATERIALS_FILE: 'internal'
+}
+
+# Callbacks run with (book_type, records, changes) whenever a catalog file is saved;
+# changes is {id: record or None when deleted} for the records a commit touched, and
+# records is then None; a full pass (records given, changes None) applies the whole file
+catalog_listeners = []
+
+def on_catalog_change(listener):
+    catalog_listeners.append(listener)
+    return listener
+
+# Atomic, coalesced JSON writes; STUDYHUB_DURABILITY is sync, group or async.
+# By default saves append changed records to an operation log that is compacted
+# into the data files in the background; STUDYHUB_STORAGE=files rewrites files directly.
+if os.environ.get('STUDYHUB_STORAGE', 'oplog') == 'files':
+    json_store = JsonStore(
+        os.environ.get('STUDYHUB_DURABILITY', 'group'),
+        window=float(os.environ.get('STUDYHUB_COMMIT_WINDOW', DEFAULT_COMMIT_WINDOW))
+    )
+else:
+    os.makedirs(DATA_DIR, exist_ok=True)
+    json_store = LoggedJsonStore(
+        OPLOG_FILE,
+        os.environ.get('STUDYHUB_DURABILITY', 'group'),
+        window=float(os.environ.get('STUDYHUB_COMMIT_WINDOW', DEFAULT_COMMIT_WINDOW))
+    )
+atexit.register(json_store.flush)
 
 # Helper functions for data management
 def load_json(file_path):
-    if os.path.exists(file_path):
-        with open(file_path, 'r') as f:
-            return json.load(f)
-    return {}
+    return json_store.load(file_path)
 
 def save_json(file_path, data):
-    with open(file_path, 'w') as f:
-        json.dump(data, f, indent=2)
+    json_store.save(file_path, data)
+
+def update_json(file_paths, mutate):
+    """Read-check-write of several files committed together.
+
+    mutate(*data) edits the loaded data in place and returns the result; it
+    is re-run on fresh data if another worker commits to the files first, so
+    side effects belong after update_json returns. Raises TimeoutError when
+    the files stay contended.
+    """
+    result, _ = json_store.transact(file_paths, mutate)
+    return result
+
+def notify_catalog(file_path, data, changes=None):
+    # Keep in-memory catalog indexes in step with the files
+    if file_path in CATALOG_FILES:
+        for listener in catalog_listeners:
+            listener(CATALOG_FILES[file_path], data, changes)
+
+# The store reports every catalog commit with the records it changed, including
+# commits other worker processes make under the operation log
+json_store.listen(notify_catalog, CATALOG_FILES)
+
+def follow_catalog():
+    """Deliver catalog commits other workers made since this one last read, e.g. to an idle worker"""
+    for file_path in CATALOG_FILES:
+        json_store.version(file_path)
+
+# Users are sharded by username hash; a request loads and saves only its user's shard
+migrate_users_file(USERS_FILE, json_store, USERS_DIR)
+user_store = UserStore(json_store, USERS_DIR)
 
 def get_users():
-    return load_json(USERS_FILE)
+    """Every user; per-request code uses get_user_shard instead"""
+    return user_store.all()
 
-def save_users(users_data):
-    save_json(USERS_FILE, users_data)
+# Cache for computed results, used by every caching layer; STUDYHUB_CACHE_BACKEND is memory
+# (per process), shared (serve.py's workers on one host) or kv (a server all nodes share)
+cache = get_cache()
+
+# Sessions live on the server and the cookie holds only their id; STUDYHUB_SESSION_BACKEND is
+# memory, file or sqlite (shared by serve.py's workers), or cache (in the cache above, for several nodes)
+session_store = make_session_store(
+    os.environ.get('STUDYHUB_SESSION_BACKEND', 'sqlite'),
+    DATA_DIR,
+    ttl=float(os.environ.get('STUDYHUB_SESSION_TTL', SESSION_TTL)),
+    cache=cache
+)
+app.session_interface = ServerSideSessionInterface(session_store)
+
+def get_user_shard(username):
+    """{username: record, ...} for the shard holding username; changes go through
+    update_json([user_store.path_for(username)], ...) so concurrent ones are not lost"""
+    return user_store.shard(username)
 
 def get_library_books():
     return load_json(LIBRARY_BOOKS_FILE)
@@ -44,6 +145,127 @@ def get_ebooks():
 def get_internal_materials():
     return load_json(INTERNAL_MATERIALS_FILE)
 
+# Read-only catalog shared by all workers through one memory-mapped file;
+# records are lazy views, so use the get_* functions above for anything that edits them
+catalog_snapshot = CatalogSnapshot(CATALOG_SNAPSHOT_FILE, {
+    book_type: file_path for file_path, book_type in CATALOG_FILES.items()
+}, json_store)
+
+def read_library_books():
+    return catalog_snapshot.records('physical')
+
+def read_ebooks():
+    return catalog_snapshot.records('ebook')
+
+def read_internal_materials():
+    return catalog_snapshot.records('internal')
+
+# Catalog index used to ground chatbot answers in real records
+catalog_retriever = CatalogRetriever({
+    'physical': read_library_books,
+    'ebook': read_ebooks,
+    'internal': read_internal_materials
+})
+on_catalog_change(catalog_retriever.sync)
+
+# Course code -> ranked materials for the course section of the recommendations page
+course_index = CourseMaterialsIndex({
+    'physical': read_library_books,
+    'ebook': read_ebooks,
+    'internal': read_internal_materials
+})
+on_catalog_change(course_index.sync)
+
+# Precomputed "more like this" neighbours for the library modal
+similar_items = SimilarItemsIndex({
+    'physical': read_library_books,
+    'ebook': read_ebooks,
+    'internal': read_internal_materials
+})
+on_catalog_change(similar_items.sync)
+
+# AI-written recommendation reasons, pre-generated by recommendation_blurbs.py
+blurb_cache = BlurbCache(BLURBS_FILE)
+
+# Collaborative filtering model; pages read its precomputed top-N lists
+recommendation_engine = RecommendationEngine(
+    get_users,
+    lambda: read_library_books() + read_ebooks() + read_internal_materials()
+)
+
+# Typo-tolerant search-box suggestions, ranked with reader counts from the recommendation model
+suggest_index = SuggestIndex({
+    'physical': read_library_books,
+    'ebook': read_ebooks,
+    'internal': read_internal_materials
+}, popularity=recommendation_engine.readers)
+on_catalog_change(suggest_index.sync)
+
+# Facet bitsets for library filters; borrow/return saves flip availability in place
+facet_index = FacetIndex({
+    'physical': read_library_books,
+    'ebook': read_ebooks,
+    'internal': read_internal_materials
+})
+on_catalog_change(facet_index.sync)
+
+# Embedding search by meaning; the local embedder needs no Ollama connection
+semantic_embedder = (OllamaEmbedder(get_ollama_client, EMBEDDING_MODEL)
+                     if os.environ.get('STUDYHUB_EMBEDDER', SEMANTIC_EMBEDDER) == 'ollama' else LocalEmbedder())
+semantic_index = SemanticSearchIndex({
+    'physical': read_library_books,
+    'ebook': read_ebooks,
+    'internal': read_internal_materials
+}, semantic_embedder, EMBEDDINGS_DIR, poll=follow_catalog)
+on_catalog_change(semantic_index.sync)
+
+# Results shared through the cache: a cohort's top-10 list, which trails new
+# interactions by at most its TTL, and semantic search results. A catalog change
+# to what they show or rank by retires both on every worker and node.
+cohort_rankings = cache.namespace('cohort_rankings', 60)
+search_results = cache.namespace('semantic_search', 600)
+
+# Record fields the cached results show or are ranked by; a borrow or return changes
+# none of them, and neither do edits to copies, location or due dates
+CACHED_RESULT_FIELDS = ('title', 'author', 'img', 'subject', 'level', 'description')
+cached_result_hashes = {}   # (book_type, id) -> hash of the record's CACHED_RESULT_FIELDS
+
+def result_hash(record):
+    return hash(tuple(str(record.get(field)) for field in CACHED_RESULT_FIELDS))
+
+def seed_cached_result_hashes():
+    """Remember the catalog the cached results were built from; ids never seen count as changed"""
+    for book_type, read in (('physical', read_library_books), ('ebook', read_ebooks),
+                            ('internal', read_internal_materials)):
+        for record in read():
+            cached_result_hashes.setdefault((book_type, record['id']), result_hash(record))
+
+@on_catalog_change
+def invalidate_cached_results(book_type, records, changes):
+    if changes is None:
+        changed = True
+        for record in records:
+            cached_result_hashes[(book_type, record['id'])] = result_hash(record)
+    else:
+        changed = False
+        for item_id, record in changes.items():
+            if record is None:
+                cached_result_hashes.pop((book_type, item_id), None)
+                changed = True
+                continue
+            digest = result_hash(record)
+            if cached_result_hashes.get((book_type, item_id)) != digest:
+                cached_result_hashes[(book_type, item_id)] = digest
+                changed = True
+    if changed:
+        cohort_rankings.invalidate()
+        search_results.invalidate()
+
+def record_interaction(username, user_data, book_id, field, added):
+    """Feed a favorite/borrow/reserve change to the recommendation updater"""
+    recommendation_engine.record(username, book_id, field, added,
+                                 user_data.get('major', ''), user_data.get('year', ''))
+
 # Booking system helper functions
 def get_study_rooms():
     return load_json(STUDY_ROOMS_FILE)
@@ -97,15 +319,14 @@ def register_page():
     major = request.form.get('major', '')
     
     # Validate the form data
-    users = get_users()
-    if username in users:
+    if user_store.exists(username):
         return render_template('register.html', error='Username already exists')
     
     if password != confirm_password:
         return render_template('register.html', error='Passwords do not match')
     
     # Create new user
-    users[username] = {
+    new_user = {
         'password': password,
         'name': name,
         'username': username,
@@ -120,12 +341,13 @@ def register_page():
         'avatar': 'profile_avatar.png'  # Default avatar
     }
     
-    # Save updated users data
-    save_users(users)
+    # Save updated users data; a name taken meanwhile by another request loses
+    if not user_store.create(username, new_user):
+        return render_template('register.html', error='Username already exists')
     
-    # Automatically log in the new user
+    # Automatically log in the new user, under a session id nobody could have seen before
+    session.regenerate()
     session['username'] = username
-    session['favorites'] = []
     
     return redirect(url_for('dashboard'))
 
@@ -134,26 +356,22 @@ def login():
     username = request.form['username']
     password = request.form['password']
     
-    users = get_users()
+    users = get_user_shard(username)
     if username in users and users[username]['password'] == password:
+        # A fresh id on login, so a session id planted before it is not logged in with it
+        session.regenerate()
         session['username'] = username
-        # Initialize favorites from the user's data
-        session['favorites'] = users[username].get('favorites', [])
         return redirect(url_for('dashboard'))
     return render_template('index.html', error='Invalid username or password')
 
 @app.route('/logout')
 def logout():
-    # Save favorites to user data before logging out
-    if 'username' in session and 'favorites' in session:
-        username = session['username']
-        users = get_users()
-        if username in users:
-            users[username]['favorites'] = session.get('favorites', [])
-            save_users(users)
+    # Forget this session's chatbot conversation
+    if 'chat_id' in session:
+        get_ollama_client().conversations.drop(session['chat_id'])
     
     session.pop('username', None)
-    session.pop('favorites', None)
+    session.pop('chat_id', None)
     return redirect(url_for('index'))
 
 @app.route('/dashboard')
@@ -279,7 +497,7 @@ def dashboard():
     upcoming_events.sort(key=event_sort_key)
     
     # Get current user data
-    users = get_users()
+    users = get_user_shard(username)
     current_user = users.get(username, {})
     user_name = current_user.get('name', username)
     
@@ -323,77 +541,40 @@ def recommendations():
         return redirect(url_for('index'))
     
     username = session['username']
-    users = get_users()
+    users = get_user_shard(username)
     current_user = users.get(username, {})
     
-    # Get all books
-    library_books = get_library_books()
-    ebooks = get_ebooks()
-    internal_materials = get_internal_materials()
-    all_books = library_books + ebooks + internal_materials
-    
-    # Create book lookup dictionary
-    book_lookup = {book['id']: book for book in all_books}
+    # Catalog records are looked up by id in the snapshot rather than indexed here
+    catalog_order = ('physical', 'ebook', 'internal')
+    book_lookup = {}
     
     # Generate Top 10 recommendations for same major/cohort
     user_major = current_user.get('major', '')
     user_year = current_user.get('year', '')
     
-    # Find users with same major and year
-    same_cohort_users = []
-    for user_id, user_data in users.items():
-        if (user_data.get('major') == user_major and 
-            user_data.get('year') == user_year and 
-            user_id != username):
-            same_cohort_users.append(user_data)
-    
-    # Get popular books among cohort (using real data from JSON files)
-    top_10_books = []
-    
-    # Create a list of all books with their real titles and images
-    book_candidates = []
-    
-    # Add library books
-    for book in library_books:
-        book_candidates.append({
-            'id': book['id'],
-            'title': book['title'],
-            'img': book['img'],
-            'subject': book.get('subject', ''),
-            'level': book.get('level', '')
-        })
-    
-    # Add ebooks
-    for book in ebooks:
-        book_candidates.append({
-            'id': book['id'],
-            'title': book['title'],
-            'img': book['img'],
-            'subject': book.get('subject', ''),
-            'level': book.get('level', '')
-        })
-    
-    # Add internal materials
-    for book in internal_materials:
-        book_candidates.append({
-            'id': book['id'],
-            'title': book['title'],
-            'img': book['img'],
-            'subject': book.get('subject', ''),
-            'course': book.get('course', '')
-        })
-    
-    # Select top 10 books (prioritize by subject relevance and level)
-    ranked_books = []
-    for i, book in enumerate(book_candidates[:10]):  # Take first 10 books
-        ranked_books.append({
-            'id': book['id'],
-            'title': book['title'],
-            'img': book['img'],
-            'rank': i + 1
-        })
-    
-    top_10_books = ranked_books
+    # Popular within the cohort first, then across all users, then catalog order for thin data;
+    # the list is the same for the whole cohort, so it is built once and shared through the cache
+    user_cohort = cohort_key(user_major, user_year)
+    top_10_books = cohort_rankings.get(user_cohort)
+    if top_10_books is None:
+        top_10_books = []
+        candidate_ids = [item_id for item_id, _ in recommendation_engine.for_cohort(user_major, user_year)]
+        candidate_ids += recommendation_engine.popular()
+        book_lookup.update(catalog_snapshot.lookup(candidate_ids))
+        candidates = [book_lookup[item_id] for item_id in candidate_ids if item_id in book_lookup]
+        candidates = itertools.chain(candidates, *(catalog_snapshot.records(book_type) for book_type in catalog_order))
+        for book in candidates:
+            if len(top_10_books) >= 10:
+                break
+            if any(ranked['id'] == book['id'] for ranked in top_10_books):
+                continue
+            top_10_books.append({
+                'id': book['id'],
+                'title': book['title'],
+                'img': book['img'],
+                'rank': len(top_10_books) + 1
+            })
+        cohort_rankings.set(user_cohort, top_10_books)
     
     # Generate personalized suggestions based on GPA/performance (using real data)
     user_gpa = current_user.get('gpa', 3.0)  # Default GPA
@@ -403,24 +584,53 @@ def recommendations():
     # Create a list of books user already has to avoid recommending them again
     already_has_books = set(user_favorites + user_borrowed)
     
-    # Generate personalized recommendations based on user's major and performance
+    # Collaborative filtering picks come first: items read by people who read what this user did
     personalized_books = []
-    
-    # Filter books by subject matching user's major
-    relevant_books = []
-    for book in all_books:
-        # Skip books user already has
-        if book['id'] in already_has_books:
+    user_picks = recommendation_engine.for_user(username)
+    book_lookup.update(catalog_snapshot.lookup(
+        [item_id for item_id, _, _ in user_picks] + [anchor_id for _, anchor_id, _ in user_picks]))
+    for item_id, anchor_id, _ in user_picks:
+        if len(personalized_books) >= 3:
+            break
+        book = book_lookup.get(item_id)
+        anchor = book_lookup.get(anchor_id)
+        if book is None or item_id in already_has_books:
             continue
-            
-        book_subject = book.get('subject', '').lower()
-        user_major_lower = user_major.lower()
-        
-        # Match books to user's major
-        if ('computer science' in user_major_lower and 'computer science' in book_subject) or \
-           ('mathematics' in user_major_lower and 'mathematics' in book_subject) or \
-           ('engineering' in user_major_lower and ('computer science' in book_subject or 'mathematics' in book_subject)):
-            relevant_books.append(book)
+        personalized_books.append({
+            'id': book['id'],
+            'title': book['title'],
+            'reason': f"Students who read {anchor['title']} also chose this" if anchor else 'Popular with readers like you'
+        })
+    picked_ids = {book['id'] for book in personalized_books}
+    
+    # Fill any remaining slots based on user's major and performance
+    # Subjects matching the user's major; the filter runs over the subject column
+    user_major_lower = user_major.lower()
+    major_subjects = []
+    if 'computer science' in user_major_lower or 'engineering' in user_major_lower:
+        major_subjects.append('computer science')
+    if 'mathematics' in user_major_lower or 'engineering' in user_major_lower:
+        major_subjects.append('mathematics')
+    
+    def subject_matches(subjects, exact=False):
+        def match(subject):
+            subject = str(subject).lower()
+            return any(subject == s if exact else s in subject for s in subjects)
+        return match
+    
+    def select_books(subjects, exact=False):
+        """Catalog books in subjects, skipping ones the user has or that were already picked above"""
+        if not subjects:
+            return []
+        skip = already_has_books | picked_ids
+        selected = []
+        for book_type in catalog_order:
+            for book in catalog_snapshot.where(book_type, {'subject': subject_matches(subjects, exact)}):
+                if book['id'] not in skip:
+                    selected.append(book)
+        return selected
+    
+    relevant_books = select_books(major_subjects)
     
     # Sort by level/difficulty based on GPA
     if user_gpa >= 3.7:  # High performers - recommend advanced books
@@ -446,7 +656,7 @@ def recommendations():
         ]
     
     # Select personalized books
-    books_added = 0
+    books_added = len(personalized_books)
     for target_level in target_levels:
         if books_added >= 3:  # Limit to 3 recommendations
             break
@@ -466,9 +676,7 @@ def recommendations():
     
     # If we don't have enough major-specific books, add some general study materials
     if books_added < 3:
-        general_books = [book for book in all_books 
-                        if book['id'] not in already_has_books and 
-                        book.get('subject', '').lower() in ['study skills', 'general']]
+        general_books = select_books(['study skills', 'general'], exact=True)
         
         for book in general_books[:3-books_added]:
             personalized_books.append({
@@ -481,29 +689,10 @@ def recommendations():
     registered_courses = current_user.get('registered_courses', [])
     course_books = []
     
-    # Find course-related materials from internal_materials
+    # Best match per course is a lookup in the prebuilt course index
     for course in registered_courses:
-        course_materials = []
-        for book in internal_materials:
-            if book.get('course', '') == course and book['id'] not in already_has_books:
-                course_materials.append(book)
-        
-        # Also check library books and ebooks for course-related content
-        for book in library_books + ebooks:
-            if book['id'] not in already_has_books:
-                book_title_lower = book.get('title', '').lower()
-                course_lower = course.lower()
-                
-                # Match course code in title or if it's a relevant subject
-                if (course_lower in book_title_lower or 
-                    (course.startswith('CS') and book.get('subject', '').lower() == 'computer science') or
-                    (course.startswith('MATH') and book.get('subject', '').lower() == 'mathematics')):
-                    course_materials.append(book)
-        
-        # Add the best match for each course
-        if course_materials:
-            best_match = course_materials[0]  # Take the first match
-            
+        best_match = course_index.best(course, exclude=already_has_books)
+        if best_match:
             # Generate reason based on book type
             if best_match.get('documentType'):
                 reason = f"Essential {best_match.get('documentType', 'material')} for {course}"
@@ -531,10 +720,8 @@ def recommendations():
                 default_courses = ['CS201']
         
         for course in default_courses:
-            course_materials = [book for book in internal_materials 
-                              if book.get('course', '') == course and book['id'] not in already_has_books]
-            if course_materials:
-                book = course_materials[0]
+            book = course_index.best(course, exclude=already_has_books, tagged_only=True)
+            if book:
                 course_books.append({
                     'id': book['id'],
                     'title': book['title'],
@@ -567,6 +754,16 @@ def recommendations():
         }
     ]
     
+    # Swap canned reasons for pre-generated AI blurbs where the batch job has written one
+    blurb_cache.refresh()
+    book_lookup.update(catalog_snapshot.lookup(
+        [r['id'] for r in personalized_books + course_books if r['id'] not in book_lookup]))
+    for recommendation in personalized_books + course_books:
+        book = book_lookup.get(recommendation['id'])
+        blurb = blurb_cache.lookup(book, user_cohort) if book else None
+        if blurb:
+            recommendation['reason'] = blurb
+    
     # Debug: Print recommendation details
     print(f"=== RECOMMENDATIONS DEBUG for {username} ===")
     print(f"User GPA: {user_gpa}")
@@ -599,43 +796,44 @@ def get_library_data():
         return jsonify({'status': 'error', 'message': 'User not logged in'}), 401
         
     username = session['username']
-    users = get_users()
-    
-    # Get all book sources
-    library_books = get_library_books()
-    ebooks = get_ebooks()
-    internal_materials = get_internal_materials()
+    users = get_user_shard(username)
     
     # Get user favorites, borrowed books and reserved books
     user_favorites = users.get(username, {}).get('favorites', [])
     borrowed_books = users.get(username, {}).get('borrowed_books', [])
     reserved_books = users.get(username, {}).get('reserved_books', [])
-    
-    # Mark books that are borrowed or reserved by this user and add book type
-    for book in library_books:
-        book['isBorrowedByUser'] = book['id'] in borrowed_books
-        book['isReservedByUser'] = book['id'] in reserved_books
-        book['bookType'] = 'physical'
-        
-    for book in ebooks:
-        book['isReservedByUser'] = book['id'] in reserved_books
-        book['bookType'] = 'ebook'
-        
-    for book in internal_materials:
-        book['isReservedByUser'] = book['id'] in reserved_books
-        book['bookType'] = 'internal'
+    borrowed_ids, reserved_ids = set(borrowed_books), set(reserved_books)
+    
+    # Mark books that are borrowed or reserved by this user and add book type,
+    # on copies of the snapshot views
+    library_books = [dict(book, isBorrowedByUser=book['id'] in borrowed_ids,
+                          isReservedByUser=book['id'] in reserved_ids, bookType='physical')
+                     for book in read_library_books()]
+    ebooks = [dict(book, isReservedByUser=book['id'] in reserved_ids, bookType='ebook')
+              for book in read_ebooks()]
+    internal_materials = [dict(book, isReservedByUser=book['id'] in reserved_ids, bookType='internal')
+                          for book in read_internal_materials()]
     
     # For backward compatibility
-    if 'my_bookshelf' in users.get(username, {}) and not borrowed_books:
+    migrate_bookshelf = 'my_bookshelf' in users.get(username, {}) and not borrowed_books
+    if migrate_bookshelf:
         borrowed_books = users[username]['my_bookshelf']
-        # Migrate data structure
-        users[username]['borrowed_books'] = borrowed_books
-        save_users(users)
-        
-    # Initialize reserved_books if it doesn't exist
-    if 'reserved_books' not in users.get(username, {}):
-        users[username]['reserved_books'] = []
-        save_users(users)
+    
+    # Migrate the data structure and initialize reserved_books, against the current
+    # record so nothing another worker saved since the read above is lost
+    def migrate(users):
+        if username not in users:
+            return
+        if migrate_bookshelf and not users[username].get('borrowed_books'):
+            users[username]['borrowed_books'] = users[username].get('my_bookshelf', [])
+        if 'reserved_books' not in users[username]:
+            users[username]['reserved_books'] = []
+    
+    if migrate_bookshelf or 'reserved_books' not in users.get(username, {}):
+        try:
+            update_json([user_store.path_for(username)], migrate)
+        except TimeoutError:
+            pass   # tried again on the next page load
     
     return jsonify({
         'status': 'success',
@@ -655,60 +853,122 @@ def get_book_details(book_id):
         return jsonify({'status': 'error', 'message': 'User not logged in'}), 401
     
     username = session['username']
-    users = get_users()
-    
-    # Get all book sources
-    library_books = get_library_books()
-    ebooks = get_ebooks()
-    internal_materials = get_internal_materials()
+    users = get_user_shard(username)
     
-    # Search for the book in all sources
-    all_books = library_books + ebooks + internal_materials
+    # Look the book up by id in the shared catalog snapshot
+    found = catalog_snapshot.find(book_id)
     
-    for book in all_books:
-        if book['id'] == book_id:
-            # Check if this book is borrowed by the current user
-            is_borrowed_by_user = False
-            if username in users and 'borrowed_books' in users[username]:
-                is_borrowed_by_user = book_id in users[username]['borrowed_books']
-            
-            book_info = dict(book)  # Make a copy to avoid modifying the original
-            book_info['isBorrowedByUser'] = is_borrowed_by_user
-            
-            return jsonify({
-                'status': 'success',
-                'book': book_info
-            })
+    if found:
+        book = found[1]
+        # Check if this book is borrowed by the current user
+        is_borrowed_by_user = False
+        if username in users and 'borrowed_books' in users[username]:
+            is_borrowed_by_user = book_id in users[username]['borrowed_books']
+        
+        book_info = dict(book)  # Make a copy to avoid modifying the original
+        book_info['isBorrowedByUser'] = is_borrowed_by_user
+        
+        return jsonify({
+            'status': 'success',
+            'book': book_info
+        })
     
     return jsonify({
         'status': 'error',
         'message': f'Book with ID {book_id} not found'
     }), 404
 
+@app.route('/api/book/<int:book_id>/similar')
+def get_similar_books(book_id):
+    if 'username' not in session:
+        return jsonify({'status': 'error', 'message': 'User not logged in'}), 401
+    
+    limit = request.args.get('limit', 5, type=int)
+    similar = similar_items.similar(book_id, limit=max(1, min(limit, similar_items.k)))
+    if similar is None:
+        return jsonify({
+            'status': 'error',
+            'message': f'Book with ID {book_id} not found'
+        }), 404
+    
+    return jsonify({
+        'status': 'success',
+        'book_id': book_id,
+        'similar': similar
+    })
+
+@app.route('/api/suggest')
+def suggest():
+    if 'username' not in session:
+        return jsonify({'status': 'error', 'message': 'User not logged in'}), 401
+    
+    query = request.args.get('q', '')[:100]
+    limit = max(1, min(request.args.get('limit', 8, type=int), 20))
+    return jsonify({
+        'status': 'success',
+        'query': query,
+        'suggestions': suggest_index.suggest(query, limit=limit)
+    })
+
+@app.route('/api/search/semantic')
+def semantic_search():
+    if 'username' not in session:
+        return jsonify({'status': 'error', 'message': 'User not logged in'}), 401
+    
+    query = request.args.get('q', '').strip()[:200]
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    if not query:
+        return jsonify({'status': 'success', 'query': query, 'results': []})
+    # A repeated query skips embedding it, which with the Ollama embedder is a round trip to the model
+    cache_key = f'{limit}:{query}'
+    results = search_results.get(cache_key)
+    cached = results is not None
+    mode = 'semantic'
+    if not cached:
+        results = semantic_index.search(query, limit=limit)
+        if results is None:
+            # Not embedded yet, or the embedding model is unreachable: match on words instead
+            mode = 'keyword'
+            results = [{
+                'id': record['id'],
+                'title': record['title'],
+                'author': record['author'],
+                'subject': record['subject'],
+                'bookType': record['book_type'],
+                'score': record['score']
+            } for record in catalog_retriever.search(query, top_k=limit)]
+    pending = semantic_index.stats()['pending']
+    # While records are still being embedded the same query may soon find more
+    if mode == 'semantic' and not cached and not pending:
+        search_results.set(cache_key, results)
+    return jsonify({
+        'status': 'success',
+        'query': query,
+        'results': results,
+        'mode': mode,
+        'pending': pending
+    })
+
+@app.route('/api/library/facets')
+def library_facets():
+    if 'username' not in session:
+        return jsonify({'status': 'error', 'message': 'User not logged in'}), 401
+    
+    # Repeat a parameter to OR values within a facet, e.g. ?level=Beginner&level=Intermediate
+    filters = {facet: request.args.getlist(facet) for facet in FACETS if request.args.getlist(facet)}
+    limit = max(1, min(request.args.get('limit', 1000, type=int), 5000))
+    offset = max(0, request.args.get('offset', 0, type=int))
+    result = facet_index.query(filters, limit=limit, offset=offset)
+    result['status'] = 'success'
+    return jsonify(result)
+
 @app.route('/resource')
 def resource():
     if 'username' not in session:
         return redirect(url_for('index'))
         
-    # Ensure favorites are synced from user data
-    username = session['username']
-    users = get_users()
-    if username in users and 'favorites' in users[username]:
-        session['favorites'] = users[username]['favorites']
-        session.modified = True
-
     username = session['username']
-    users = get_users()
-    
-    # Get all book sources
-    library_books = get_library_books()
-    ebooks = get_ebooks()
-    internal_materials = get_internal_materials()
-    
-    # Combine all books for lookup by ID
-    all_books = {}
-    for book in library_books + ebooks + internal_materials:
-        all_books[book['id']] = book
+    users = get_user_shard(username)
     
     # Get bookshelf IDs and favorites, then combine them
     bookshelf_ids = users[username].get('my_bookshelf', [])
@@ -717,17 +977,19 @@ def resource():
     # Combine bookshelf and favorites (using a set to avoid duplicates)
     combined_ids = list(set(bookshelf_ids + favorites_ids))
     
-    # Convert to book objects
+    # Convert to book objects, looked up by id in the snapshot
+    all_books = catalog_snapshot.lookup(combined_ids)
     my_bookshelf = [all_books[book_id] for book_id in combined_ids if book_id in all_books]
     
+    # The template only reads the records, so the snapshot views are passed as they are
     books = {
         'my_bookshelf': my_bookshelf,
-        'library_books': library_books,
-        'ebooks': ebooks,
-        'internal_materials': internal_materials
+        'library_books': read_library_books(),
+        'ebooks': read_ebooks(),
+        'internal_materials': read_internal_materials()
     }
     
-    return render_template('resource.html', books=books, favorites=session.get('favorites', []))
+    return render_template('resource.html', books=books, favorites=favorites_ids)
 
 @app.route('/add_favorite', methods=['POST'])
 def add_favorite():
@@ -751,87 +1013,74 @@ def add_favorite():
         pass
 
     if book_id:
-        if 'favorites' not in session:
-            session['favorites'] = []
-            
         username = session['username']
-        users = get_users()
         
         # Get book details for the response
-        library_books = get_library_books()
-        ebooks = get_ebooks()
-        internal_materials = get_internal_materials()
+        found = catalog_snapshot.find(book_id)
+        book_details = dict(found[1]) if found else None
         
-        all_books = {}
-        for book in library_books + ebooks + internal_materials:
-            all_books[book['id']] = book
-        
-        book_details = all_books.get(book_id)
+        # Standardize image path if needed
+        if book_details and 'img' in book_details:
+            if book_details['img'].startswith('./'):
+                book_details['img'] = book_details['img'][2:]
         
-        # Toggle favorite status
-        print(f"Current favorites: {session.get('favorites', [])}") 
         print(f"Book ID to toggle: {book_id} (Type: {type(book_id).__name__})")
-        
-        # Check if the book is already in favorites, handling both string and int IDs
         book_id_str = str(book_id)
-        is_favorite = False
         
-        for fav_id in session.get('favorites', []):
-            if str(fav_id) == book_id_str:
-                is_favorite = True
-                break
-                
-        if not is_favorite:
-            # Add to favorites
-            print(f"Adding book {book_id} to favorites")
-            session['favorites'] = session.get('favorites', [])
-            session['favorites'].append(book_id)
-            session.modified = True
+        # The toggle reads and writes the favourites in one commit, so a borrow or
+        # settings change made meanwhile in another worker is kept; returns
+        # (response, the user's record or None, whether the book was added)
+        def toggle(users):
+            favorites = users.get(username, {}).get('favorites', [])
             
-            # Update user data
-            if username in users:
-                # Initialize favorites array if needed
-                if 'favorites' not in users[username]:
-                    users[username]['favorites'] = []
-                
-                users[username]['favorites'] = session['favorites']
-                save_users(users)
-                print(f"Updated user favorites: {users[username]['favorites']}")
+            # Check if the book is already in favorites, handling both string and int IDs
+            is_favorite = False
+            for fav_id in favorites:
+                if str(fav_id) == book_id_str:
+                    is_favorite = True
+                    break
             
-            # Standardize image path if needed
-            if book_details and 'img' in book_details:
-                if book_details['img'].startswith('./'):
-                    book_details['img'] = book_details['img'][2:]
+            if not is_favorite:
+                # Only catalog items can be favourited; a stale id may still be removed below
+                if not book_details:
+                    return (jsonify({'status': 'error', 'message': f'Book with ID {book_id} not found'}), 404), None, True
+                
+                # Add to favorites
+                if username in users:
+                    users[username]['favorites'] = favorites + [book_id]
+                
+                return jsonify({
+                    'status': 'success', 
+                    'message': f'Book {book_id} added to favorites.',
+                    'added_to_favorites': True,
+                    'book': book_details
+                }), users.get(username), True
             
-            return jsonify({
-                'status': 'success', 
-                'message': f'Book {book_id} added to favorites.',
-                'added_to_favorites': True,
-                'book': book_details
-            })
-        else:
             # Remove from favorites - find the exact item to remove
-            print(f"Removing book {book_id} from favorites")
             new_favorites = []
-            for fav_id in session.get('favorites', []):
+            for fav_id in favorites:
                 if str(fav_id) != book_id_str:
                     new_favorites.append(fav_id)
             
-            session['favorites'] = new_favorites
-            session.modified = True
-            
-            # Update user data
             if username in users:
-                users[username]['favorites'] = session['favorites']
-                save_users(users)
-                print(f"Updated user favorites after removal: {users[username]['favorites']}")
+                users[username]['favorites'] = new_favorites
             
             return jsonify({
                 'status': 'success', 
                 'message': f'Book {book_id} removed from favorites.',
                 'removed_from_favorites': True,
                 'book_id': book_id
-            })
+            }), users.get(username), False
+        
+        try:
+            response, user, added = update_json([user_store.path_for(username)], toggle)
+        except TimeoutError:
+            return jsonify({'status': 'error', 'message': 'The library is busy, please try again'}), 503
+        
+        if user is not None:
+            record_interaction(username, user, book_id, 'favorites', added)
+            print(f"Updated user favorites: {user['favorites']}")
+        return response
 
     return jsonify({'status': 'error', 'message': 'Invalid request'}), 400
 
@@ -847,76 +1096,80 @@ def borrow_book():
         return jsonify({'status': 'error', 'message': 'No book ID provided'}), 400
     
     username = session['username']
-    users = get_users()
-    
-    # Get book details
-    library_books = get_library_books()
     ebooks = get_ebooks()
     internal_materials = get_internal_materials()
     
-    all_books = {}
-    for book in library_books + ebooks + internal_materials:
-        all_books[book['id']] = book
-    
-    book_details = all_books.get(book_id)
-    
-    if not book_details:
-        return jsonify({'status': 'error', 'message': f'Book with ID {book_id} not found'}), 404
-    
-    # Check if book is available (for physical books)
-    if book_id in [book['id'] for book in library_books]:
-        # Check availability
-        if book_details.get('availableCopies', 0) <= 0:
-            return jsonify({
-                'status': 'error', 
-                'message': f'Book {book_id} is not available for borrowing'
-            }), 400
-    
-    # Update user's borrowed books
-    if username in users:
+    # The availability check and the decrement commit together, so two workers
+    # cannot both hand out the last copy; returns (response, borrower or None)
+    def borrow(users, library_books):
+        all_books = {}
+        for book in library_books + ebooks + internal_materials:
+            all_books[book['id']] = book
+        
+        book_details = all_books.get(book_id)
+        
+        if not book_details:
+            return (jsonify({'status': 'error', 'message': f'Book with ID {book_id} not found'}), 404), None
+        
+        # Check if book is available (for physical books)
+        if book_id in [book['id'] for book in library_books]:
+            # Check availability
+            if book_details.get('availableCopies', 0) <= 0:
+                return (jsonify({
+                    'status': 'error', 
+                    'message': f'Book {book_id} is not available for borrowing'
+                }), 400), None
+        
+        if username not in users:
+            return (jsonify({'status': 'error', 'message': 'Invalid request'}), 400), None
+        
+        # Update user's borrowed books
         if 'borrowed_books' not in users[username]:
             users[username]['borrowed_books'] = []
         
-        if book_id not in users[username]['borrowed_books']:
-            # Add to user's borrowed books
-            users[username]['borrowed_books'].append(book_id)
-            
-            # Calculate due date (30 days from now)
-            from datetime import datetime, timedelta
-            due_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
-            
-            # Update available copies and set due date for physical books
-            if book_id in [book['id'] for book in library_books]:
-                for book in library_books:
-                    if book['id'] == book_id and 'availableCopies' in book:
-                        book['availableCopies'] -= 1
-                        book['dueDate'] = due_date
-                        if book['availableCopies'] <= 0:
-                            book['status'] = 'unavailable'
-                save_json(LIBRARY_BOOKS_FILE, library_books)
-            
-            save_users(users)
-            
-            # Standardize image path if needed
-            if book_details and 'img' in book_details:
-                if book_details['img'].startswith('./'):
-                    book_details['img'] = book_details['img'][2:]
-            
-            # Include due date in the response
-            return jsonify({
-                'status': 'success',
-                'message': f'Book {book_id} borrowed successfully.',
-                'borrowed': True,
-                'book': book_details,
-                'dueDate': book_details.get('dueDate')
-            })
-        else:
+        if book_id in users[username]['borrowed_books']:
             return jsonify({
                 'status': 'error',
                 'message': f'Book {book_id} is already borrowed by you.'
-            })
+            }), None
+        
+        # Add to user's borrowed books
+        users[username]['borrowed_books'].append(book_id)
+        
+        # Calculate due date (30 days from now)
+        from datetime import datetime, timedelta
+        due_date = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
+        
+        # Update available copies and set due date for physical books
+        for book in library_books:
+            if book['id'] == book_id and 'availableCopies' in book:
+                book['availableCopies'] -= 1
+                book['dueDate'] = due_date
+                if book['availableCopies'] <= 0:
+                    book['status'] = 'unavailable'
+        
+        # Standardize image path if needed
+        book_details = dict(book_details)
+        if 'img' in book_details and book_details['img'].startswith('./'):
+            book_details['img'] = book_details['img'][2:]
+        
+        # Include due date in the response
+        return jsonify({
+            'status': 'success',
+            'message': f'Book {book_id} borrowed successfully.',
+            'borrowed': True,
+            'book': book_details,
+            'dueDate': book_details.get('dueDate')
+        }), users[username]
     
-    return jsonify({'status': 'error', 'message': 'Invalid request'}), 400
+    try:
+        response, borrower = update_json([user_store.path_for(username), LIBRARY_BOOKS_FILE], borrow)
+    except TimeoutError:
+        return jsonify({'status': 'error', 'message': 'The library is busy, please try again'}), 503
+    
+    if borrower is not None:
+        record_interaction(username, borrower, book_id, 'borrowed_books', True)
+    return response
     
 @app.route('/reserve_book', methods=['POST'])
 def reserve_book():
@@ -930,24 +1183,16 @@ def reserve_book():
         return jsonify({'status': 'error', 'message': 'No book ID provided'}), 400
     
     username = session['username']
-    users = get_users()
     
     # Get book details
-    library_books = get_library_books()
-    ebooks = get_ebooks()
-    internal_materials = get_internal_materials()
-    
-    all_books = {}
-    for book in library_books + ebooks + internal_materials:
-        all_books[book['id']] = book
+    found = catalog_snapshot.find(book_id)
     
-    book_details = all_books.get(book_id)
-    
-    if not book_details:
+    if not found:
         return jsonify({'status': 'error', 'message': f'Book with ID {book_id} not found'}), 404
+    book_type, book_details = found[0], dict(found[1])
     
     # Check if book is unavailable (for physical books)
-    if book_id in [book['id'] for book in library_books]:
+    if book_type == 'physical':
         # Check availability - we can only reserve books that are unavailable
         if book_details.get('availableCopies', 0) > 0 and book_details.get('status') != 'unavailable':
             return jsonify({
@@ -955,35 +1200,43 @@ def reserve_book():
                 'message': f'Book {book_id} is available for borrowing, no need to reserve'
             }), 400
     
-    # Update user's reserved books
-    if username in users:
+    # Standardize image path if needed
+    if 'img' in book_details and book_details['img'].startswith('./'):
+        book_details['img'] = book_details['img'][2:]
+    
+    # Committed like a borrow, so the user's other changes in flight are kept;
+    # returns (response, reserver or None)
+    def reserve(users):
+        if username not in users:
+            return (jsonify({'status': 'error', 'message': 'Invalid request'}), 400), None
+        
         # Initialize reserved_books array if it doesn't exist
         if 'reserved_books' not in users[username]:
             users[username]['reserved_books'] = []
         
         # Check if book is already reserved by the user
-        if book_id not in users[username]['reserved_books']:
-            users[username]['reserved_books'].append(book_id)
-            save_users(users)
-            
-            # Standardize image path if needed
-            if book_details and 'img' in book_details:
-                if book_details['img'].startswith('./'):
-                    book_details['img'] = book_details['img'][2:]
-            
-            return jsonify({
-                'status': 'success',
-                'message': f'Book {book_id} reserved successfully.',
-                'reserved': True,
-                'book': book_details
-            })
-        else:
+        if book_id in users[username]['reserved_books']:
             return jsonify({
                 'status': 'error',
                 'message': f'Book {book_id} is already reserved by you.'
-            })
+            }), None
+        
+        users[username]['reserved_books'].append(book_id)
+        return jsonify({
+            'status': 'success',
+            'message': f'Book {book_id} reserved successfully.',
+            'reserved': True,
+            'book': book_details
+        }), users[username]
     
-    return jsonify({'status': 'error', 'message': 'Invalid request'}), 400
+    try:
+        response, reserver = update_json([user_store.path_for(username)], reserve)
+    except TimeoutError:
+        return jsonify({'status': 'error', 'message': 'The library is busy, please try again'}), 503
+    
+    if reserver is not None:
+        record_interaction(username, reserver, book_id, 'reserved_books', True)
+    return response
 
 @app.route('/unreserve_book', methods=['POST'])
 def unreserve_book():
@@ -997,42 +1250,42 @@ def unreserve_book():
         return jsonify({'status': 'error', 'message': 'No book ID provided'}), 400
     
     username = session['username']
-    users = get_users()
     
     # Get book details
-    library_books = get_library_books()
-    ebooks = get_ebooks()
-    internal_materials = get_internal_materials()
+    found = catalog_snapshot.find(book_id)
     
-    all_books = {}
-    for book in library_books + ebooks + internal_materials:
-        all_books[book['id']] = book
-    
-    book_details = all_books.get(book_id)
-    
-    if not book_details:
+    if not found:
         return jsonify({'status': 'error', 'message': f'Book with ID {book_id} not found'}), 404
+    book_details = dict(found[1])
     
-    # Update user's reserved books
-    if username in users and 'reserved_books' in users[username]:
+    # Returns (response, the user whose reservation was cancelled, or None)
+    def unreserve(users):
+        if username not in users or 'reserved_books' not in users[username]:
+            return (jsonify({'status': 'error', 'message': 'Invalid request'}), 400), None
+        
         # Check if book is reserved by the user
-        if book_id in users[username]['reserved_books']:
-            users[username]['reserved_books'].remove(book_id)
-            save_users(users)
-            
-            return jsonify({
-                'status': 'success',
-                'message': f'Book {book_id} reservation cancelled successfully.',
-                'reserved': False,
-                'book': book_details
-            })
-        else:
+        if book_id not in users[username]['reserved_books']:
             return jsonify({
                 'status': 'error',
                 'message': f'Book {book_id} is not reserved by you.'
-            })
+            }), None
+        
+        users[username]['reserved_books'].remove(book_id)
+        return jsonify({
+            'status': 'success',
+            'message': f'Book {book_id} reservation cancelled successfully.',
+            'reserved': False,
+            'book': book_details
+        }), users[username]
     
-    return jsonify({'status': 'error', 'message': 'Invalid request'}), 400
+    try:
+        response, unreserver = update_json([user_store.path_for(username)], unreserve)
+    except TimeoutError:
+        return jsonify({'status': 'error', 'message': 'The library is busy, please try again'}), 503
+    
+    if unreserver is not None:
+        record_interaction(username, unreserver, book_id, 'reserved_books', False)
+    return response
 
 @app.route('/return_book', methods=['POST'])
 def return_book():
@@ -1046,36 +1299,41 @@ def return_book():
         return jsonify({'status': 'error', 'message': 'No book ID provided'}), 400
     
     username = session['username']
-    users = get_users()
     
-    # Update user's borrowed books
-    if username in users and 'borrowed_books' in users[username]:
-        if book_id in users[username]['borrowed_books']:
-            users[username]['borrowed_books'].remove(book_id)
-            
-            # Update available copies for physical books
-            library_books = get_library_books()
-            if book_id in [book['id'] for book in library_books]:
-                for book in library_books:
-                    if book['id'] == book_id and 'availableCopies' in book:
-                        book['availableCopies'] += 1
-                        book['status'] = 'available'
-                save_json(LIBRARY_BOOKS_FILE, library_books)
-            
-            save_users(users)
-            
-            return jsonify({
-                'status': 'success',
-                'message': f'Book {book_id} returned successfully.',
-                'book_id': book_id
-            })
-        else:
+    # The loan and the copy it frees commit together, like a borrow, so a borrow
+    # of the same book in another worker is never lost; returns (response, returner or None)
+    def give_back(users, library_books):
+        if username not in users or 'borrowed_books' not in users[username]:
+            return (jsonify({'status': 'error', 'message': 'Invalid request'}), 400), None
+        
+        if book_id not in users[username]['borrowed_books']:
             return jsonify({
                 'status': 'error',
                 'message': f'Book {book_id} is not borrowed by you.'
-            })
+            }), None
+        
+        users[username]['borrowed_books'].remove(book_id)
+        
+        # Update available copies for physical books
+        for book in library_books:
+            if book['id'] == book_id and 'availableCopies' in book:
+                book['availableCopies'] += 1
+                book['status'] = 'available'
+        
+        return jsonify({
+            'status': 'success',
+            'message': f'Book {book_id} returned successfully.',
+            'book_id': book_id
+        }), users[username]
     
-    return jsonify({'status': 'error', 'message': 'Invalid request'}), 400
+    try:
+        response, returner = update_json([user_store.path_for(username), LIBRARY_BOOKS_FILE], give_back)
+    except TimeoutError:
+        return jsonify({'status': 'error', 'message': 'The library is busy, please try again'}), 503
+    
+    if returner is not None:
+        record_interaction(username, returner, book_id, 'borrowed_books', False)
+    return response
 
 @app.route('/profile')
 def profile():
@@ -1083,8 +1341,7 @@ def profile():
         return redirect(url_for('index'))
         
     username = session['username']
-    users = get_users()
-    library_books = get_library_books()
+    users = get_user_shard(username)
     bookings_data = get_bookings()
     devices_data = get_devices()
     workshops_data = get_workshops()
@@ -1123,12 +1380,9 @@ def profile():
     if username in users:
         # Get borrowed books details
         borrowed_book_ids = users[username].get('borrowed_books', [])
-        borrowed_books_details = []
-        for book_id in borrowed_book_ids:
-            for book in library_books:
-                if book['id'] == book_id:
-                    borrowed_books_details.append(book)
-                    break
+        # Loans are of physical books; the views are only read by the template
+        borrowed = {book['id']: book for book in catalog_snapshot.where('physical', {'id': borrowed_book_ids})}
+        borrowed_books_details = [borrowed[book_id] for book_id in borrowed_book_ids if book_id in borrowed]
         
         user_data = {
             'name': users[username].get('name', username),
@@ -1182,7 +1436,7 @@ def settings():
         return redirect(url_for('index'))
     
     username = session['username']
-    users = get_users()
+    users = get_user_shard(username)
     bookings_data = get_bookings()
     
     # Calculate user statistics
@@ -1271,43 +1525,46 @@ def update_settings():
         return jsonify({'status': 'error', 'message': 'Not logged in'}), 401
     
     username = session['username']
-    users = get_users()
-    
-    if username not in users:
-        return jsonify({'status': 'error', 'message': 'User not found'}), 404
-    
     data = request.get_json()
     
-    # Update user profile information
-    if 'name' in data:
-        users[username]['name'] = data['name']
-    if 'email' in data:
-        users[username]['email'] = data['email']
-    if 'phone' in data:
-        users[username]['phone'] = data['phone']
-    if 'bio' in data:
-        users[username]['bio'] = data['bio']
-    
-    # Update preferences
-    if 'preferences' in data:
-        if 'preferences' not in users[username]:
-            users[username]['preferences'] = {}
-        
-        # Handle nested preference updates
-        for key, value in data['preferences'].items():
-            if isinstance(value, dict):
-                # Handle nested objects like email_notifications, push_notifications, privacy
-                if key not in users[username]['preferences']:
-                    users[username]['preferences'][key] = {}
-                users[username]['preferences'][key].update(value)
-            else:
-                # Handle direct preference updates
-                users[username]['preferences'][key] = value
-    
-    # Save updated user data
-    save_users(users)
+    # Applied to the user's current record in one commit, so a borrow or favourite
+    # saved meanwhile by another worker is kept
+    def apply_settings(users):
+        if username not in users:
+            return jsonify({'status': 'error', 'message': 'User not found'}), 404
+        
+        # Update user profile information
+        if 'name' in data:
+            users[username]['name'] = data['name']
+        if 'email' in data:
+            users[username]['email'] = data['email']
+        if 'phone' in data:
+            users[username]['phone'] = data['phone']
+        if 'bio' in data:
+            users[username]['bio'] = data['bio']
+        
+        # Update preferences
+        if 'preferences' in data:
+            if 'preferences' not in users[username]:
+                users[username]['preferences'] = {}
+            
+            # Handle nested preference updates
+            for key, value in data['preferences'].items():
+                if isinstance(value, dict):
+                    # Handle nested objects like email_notifications, push_notifications, privacy
+                    if key not in users[username]['preferences']:
+                        users[username]['preferences'][key] = {}
+                    users[username]['preferences'][key].update(value)
+                else:
+                    # Handle direct preference updates
+                    users[username]['preferences'][key] = value
+        
+        return jsonify({'status': 'success', 'message': 'Settings updated successfully'})
     
-    return jsonify({'status': 'success', 'message': 'Settings updated successfully'})
+    try:
+        return update_json([user_store.path_for(username)], apply_settings)
+    except TimeoutError:
+        return jsonify({'status': 'error', 'message': 'The library is busy, please try again'}), 503
 
 @app.route('/api/update-password', methods=['POST'])
 def update_password():
@@ -1315,26 +1572,27 @@ def update_password():
         return jsonify({'status': 'error', 'message': 'Not logged in'}), 401
     
     username = session['username']
-    users = get_users()
-    
-    if username not in users:
-        return jsonify({'status': 'error', 'message': 'User not found'}), 404
-    
     data = request.get_json()
     current_password = data.get('current_password')
     new_password = data.get('new_password')
     
-    # Verify current password
-    if users[username]['password'] != current_password:
-        return jsonify({'status': 'error', 'message': 'Current password is incorrect'}), 400
-    
-    # Update password
-    users[username]['password'] = new_password
-    
-    # Save updated user data
-    save_users(users)
+    # The check and the change commit together, against the user's current record
+    def change_password(users):
+        if username not in users:
+            return jsonify({'status': 'error', 'message': 'User not found'}), 404
+        
+        # Verify current password
+        if users[username]['password'] != current_password:
+            return jsonify({'status': 'error', 'message': 'Current password is incorrect'}), 400
+        
+        # Update password
+        users[username]['password'] = new_password
+        return jsonify({'status': 'success', 'message': 'Password updated successfully'})
     
-    return jsonify({'status': 'success', 'message': 'Password updated successfully'})
+    try:
+        return update_json([user_store.path_for(username)], change_password)
+    except TimeoutError:
+        return jsonify({'status': 'error', 'message': 'The library is busy, please try again'}), 503
 
 
 # Booking API Routes
@@ -1352,26 +1610,31 @@ def book_resource():
     
     username = session['username']
     
-    # Load bookings
-    bookings_data = get_bookings()
-    if 'bookings' not in bookings_data:
-        bookings_data['bookings'] = []
-    
-    # Create new booking
-    new_booking = {
-        'id': f"booking_{len(bookings_data['bookings']) + 1}",
-        'user_id': username,
-        'resource_id': resource_id,
-        'resource_type': resource_type,
-        'date': booking_date,
-        'start_time': start_time,
-        'end_time': end_time,
-        'status': 'confirmed',
-        'created_at': '2025-09-08'
-    }
+    # Numbered inside the commit, so concurrent bookings never share an id
+    def book(bookings_data):
+        if 'bookings' not in bookings_data:
+            bookings_data['bookings'] = []
+        
+        # Create new booking
+        new_booking = {
+            'id': f"booking_{len(bookings_data['bookings']) + 1}",
+            'user_id': username,
+            'resource_id': resource_id,
+            'resource_type': resource_type,
+            'date': booking_date,
+            'start_time': start_time,
+            'end_time': end_time,
+            'status': 'confirmed',
+            'created_at': '2025-09-08'
+        }
+        
+        bookings_data['bookings'].append(new_booking)
+        return new_booking
     
-    bookings_data['bookings'].append(new_booking)
-    save_bookings(bookings_data)
+    try:
+        new_booking = update_json([BOOKINGS_FILE], book)
+    except TimeoutError:
+        return jsonify({'success': False, 'message': 'Booking is busy, please try again'}), 503
     
     return jsonify({'success': True, 'message': 'Resource booked successfully', 'booking': new_booking})
 
@@ -1444,45 +1707,48 @@ def register_workshop():
     workshop_id = data.get('workshop_id')
     username = session['username']
     
-    # Load workshops
-    workshops_data = get_workshops()
-    workshops = workshops_data.get('workshops', [])
-    
-    # Find the workshop
-    workshop = None
-    for w in workshops:
-        if w['id'] == workshop_id:
-            workshop = w
-            break
-    
-    if not workshop:
-        return jsonify({'success': False, 'message': 'Workshop not found'}), 404
-    
-    # Check if user is already registered
-    if any(reg['user_id'] == username for reg in workshop.get('registrations', [])):
-        return jsonify({'success': False, 'message': 'Already registered for this workshop'}), 400
-    
-    # Check availability
-    if workshop['available_spots'] <= 0:
-        return jsonify({'success': False, 'message': 'Workshop is full'}), 400
-    
-    # Register user
-    if 'registrations' not in workshop:
-        workshop['registrations'] = []
-    
-    workshop['registrations'].append({
-        'user_id': username,
-        'registration_date': '2025-09-08'
-    })
-    
-    workshop['available_spots'] -= 1
-    
-    if workshop['available_spots'] <= 0:
-        workshop['availability'] = 'registration_closed'
-    
-    save_workshops(workshops_data)
+    # The free-spot check and the registration commit together, so a workshop is never overbooked
+    def register(workshops_data):
+        workshops = workshops_data.get('workshops', [])
+        
+        # Find the workshop
+        workshop = None
+        for w in workshops:
+            if w['id'] == workshop_id:
+                workshop = w
+                break
+        
+        if not workshop:
+            return jsonify({'success': False, 'message': 'Workshop not found'}), 404
+        
+        # Check if user is already registered
+        if any(reg['user_id'] == username for reg in workshop.get('registrations', [])):
+            return jsonify({'success': False, 'message': 'Already registered for this workshop'}), 400
+        
+        # Check availability
+        if workshop['available_spots'] <= 0:
+            return jsonify({'success': False, 'message': 'Workshop is full'}), 400
+        
+        # Register user
+        if 'registrations' not in workshop:
+            workshop['registrations'] = []
+        
+        workshop['registrations'].append({
+            'user_id': username,
+            'registration_date': '2025-09-08'
+        })
+        
+        workshop['available_spots'] -= 1
+        
+        if workshop['available_spots'] <= 0:
+            workshop['availability'] = 'registration_closed'
+        
+        return jsonify({'success': True, 'message': 'Workshop registration successful'})
     
-    return jsonify({'success': True, 'message': 'Workshop registration successful'})
+    try:
+        return update_json([WORKSHOPS_FILE], register)
+    except TimeoutError:
+        return jsonify({'success': False, 'message': 'Registration is busy, please try again'}), 503
 
 @app.route('/api/deregister-workshop', methods=['POST'])
 def deregister_workshop():
@@ -1493,41 +1759,45 @@ def deregister_workshop():
     workshop_id = data.get('workshop_id')
     username = session['username']
     
-    # Load workshops
-    workshops_data = get_workshops()
-    workshops = workshops_data.get('workshops', [])
-    
-    # Find the workshop
-    workshop = None
-    for w in workshops:
-        if w['id'] == workshop_id:
-            workshop = w
-            break
-    
-    if not workshop:
-        return jsonify({'success': False, 'message': 'Workshop not found'}), 404
-    
-    # Check if user is registered
-    user_registration = None
-    for i, reg in enumerate(workshop.get('registrations', [])):
-        if reg['user_id'] == username:
-            user_registration = i
-            break
-    
-    if user_registration is None:
-        return jsonify({'success': False, 'message': 'You are not registered for this workshop'}), 400
-    
-    # Remove user registration
-    workshop['registrations'].pop(user_registration)
-    workshop['available_spots'] += 1
-    
-    # Update availability if spots are now available
-    if workshop['available_spots'] > 0 and workshop['availability'] == 'registration_closed':
-        workshop['availability'] = 'registration_open'
-    
-    save_workshops(workshops_data)
+    # The freed spot commits with the registration it came from, so a concurrent
+    # registration cannot overwrite the spot count
+    def deregister(workshops_data):
+        workshops = workshops_data.get('workshops', [])
+        
+        # Find the workshop
+        workshop = None
+        for w in workshops:
+            if w['id'] == workshop_id:
+                workshop = w
+                break
+        
+        if not workshop:
+            return jsonify({'success': False, 'message': 'Workshop not found'}), 404
+        
+        # Check if user is registered
+        user_registration = None
+        for i, reg in enumerate(workshop.get('registrations', [])):
+            if reg['user_id'] == username:
+                user_registration = i
+                break
+        
+        if user_registration is None:
+            return jsonify({'success': False, 'message': 'You are not registered for this workshop'}), 400
+        
+        # Remove user registration
+        workshop['registrations'].pop(user_registration)
+        workshop['available_spots'] += 1
+        
+        # Update availability if spots are now available
+        if workshop['available_spots'] > 0 and workshop['availability'] == 'registration_closed':
+            workshop['availability'] = 'registration_open'
+        
+        return jsonify({'success': True, 'message': 'Workshop deregistration successful'})
     
-    return jsonify({'success': True, 'message': 'Workshop deregistration successful'})
+    try:
+        return update_json([WORKSHOPS_FILE], deregister)
+    except TimeoutError:
+        return jsonify({'success': False, 'message': 'Registration is busy, please try again'}), 503
 
 @app.route('/api/join-waitlist', methods=['POST'])
 def join_waitlist():
@@ -1538,26 +1808,30 @@ def join_waitlist():
     resource_id = data.get('resource_id')
     username = session['username']
     
-    # Load bookings
-    bookings_data = get_bookings()
-    if 'waitlists' not in bookings_data:
-        bookings_data['waitlists'] = []
-    
-    # Check if already on waitlist
-    if any(w['user_id'] == username and w['resource_id'] == resource_id for w in bookings_data['waitlists']):
-        return jsonify({'success': False, 'message': 'Already on waitlist'}), 400
-    
-    # Add to waitlist
-    waitlist_entry = {
-        'user_id': username,
-        'resource_id': resource_id,
-        'joined_date': '2025-09-08'
-    }
-    
-    bookings_data['waitlists'].append(waitlist_entry)
-    save_bookings(bookings_data)
+    # Checked and appended in one commit, so concurrent joins neither duplicate nor drop entries
+    def join(bookings_data):
+        if 'waitlists' not in bookings_data:
+            bookings_data['waitlists'] = []
+        
+        # Check if already on waitlist
+        if any(w['user_id'] == username and w['resource_id'] == resource_id for w in bookings_data['waitlists']):
+            return jsonify({'success': False, 'message': 'Already on waitlist'}), 400
+        
+        # Add to waitlist
+        waitlist_entry = {
+            'user_id': username,
+            'resource_id': resource_id,
+            'joined_date': '2025-09-08'
+        }
+        
+        bookings_data['waitlists'].append(waitlist_entry)
+        
+        return jsonify({'success': True, 'message': 'Added to waitlist successfully'})
     
-    return jsonify({'success': True, 'message': 'Added to waitlist successfully'})
+    try:
+        return update_json([BOOKINGS_FILE], join)
+    except TimeoutError:
+        return jsonify({'success': False, 'message': 'The waitlist is busy, please try again'}), 503
 
 @app.route('/api/get-resource-details/<resource_id>')
 def get_resource_details(resource_id):
@@ -1593,7 +1867,7 @@ def ollama_connect():
         return jsonify({'success': False, 'message': 'Please log in first'}), 401
     
     try:
-        result = ollama_client.connect()
+        result = get_ollama_client().connect()
         return jsonify(result)
         
     except Exception as e:
@@ -1609,7 +1883,7 @@ def ollama_disconnect():
         return jsonify({'success': False, 'message': 'Please log in first'}), 401
     
     try:
-        result = ollama_client.disconnect()
+        result = get_ollama_client().disconnect()
         return jsonify(result)
         
     except Exception as e:
@@ -1634,7 +1908,17 @@ def ollama_chat():
                 'message': 'No message provided'
             }), 400
         
-        result = ollama_client.chat(message)
+        # Key the conversation by session so each user keeps their own history
+        if 'chat_id' not in session:
+            session['chat_id'] = uuid.uuid4().hex
+        
+        # Ground the answer in the top matching catalog records
+        retrieval = catalog_retriever.retrieve(message)
+        prompt = catalog_retriever.build_prompt(message, retrieval['context'])
+        
+        # An explicit model overrides the router's choice
+        result = get_ollama_client().chat(message, model=data.get('model'), session_id=session['chat_id'], prompt=prompt)
+        result['retrieval_ms'] = retrieval['latency_ms']
         return jsonify(result)
         
     except Exception as e:
@@ -1650,7 +1934,13 @@ def ollama_status():
         return jsonify({'connected': False, 'message': 'Please log in first'}), 401
     
     try:
-        status = ollama_client.get_status()
+        status = get_ollama_client().get_status()
+        status['retrieval'] = catalog_retriever.stats()
+        status['semantic_search'] = semantic_index.stats()
+        status['storage'] = json_store.stats()
+        status['catalog_snapshot'] = catalog_snapshot.stats()
+        status['sessions'] = session_store.stats()
+        status['caches'] = cache.stats()
         return jsonify(status)
         
     except Exception as e:
@@ -1666,7 +1956,7 @@ def ollama_models():
         return jsonify({'success': False, 'message': 'Please log in first'}), 401
     
     try:
-        result = ollama_client.get_available_models()
+        result = get_ollama_client().get_available_models()
         return jsonify(result)
         
     except Exception as e:
@@ -1675,7 +1965,50 @@ def ollama_models():
             'message': f'Models error: {str(e)}'
         }), 500
 
+def start_background_services():
+    """Start warm-up work that should not block the first request"""
+    if os.environ.get('OLLAMA_WARMUP', '1') != '0':
+        get_ollama_client().start_background()
+    # Maps the shared catalog, writing it first if it is missing or behind the data files
+    threading.Thread(target=catalog_snapshot.warm, daemon=True).start()
+    # Neighbour lists take seconds to build; each worker builds its own off the request path
+    threading.Thread(target=similar_items.warm, daemon=True).start()
+    # Embeds only records that are new or changed since the last run
+    threading.Thread(target=semantic_index.warm, daemon=True).start()
+    if not cached_result_hashes:
+        threading.Thread(target=seed_cached_result_hashes, daemon=True).start()
+
+def preload():
+    """Load the catalog and build the indexes in the current process.
+
+    serve.py calls this in the master before forking, so every worker starts
+    with the indexes built and shares their memory pages copy-on-write. The
+    similar-items neighbours are left to the workers' background threads so
+    the master binds without waiting for them.
+    """
+    start = time.perf_counter()
+    os.makedirs(DATA_DIR, exist_ok=True)
+    catalog_snapshot.build()
+    for index in (catalog_retriever, course_index, suggest_index, facet_index):
+        index.warm()
+    seed_cached_result_hashes()
+    recommendation_engine.build()
+    json_store.flush()
+    print(f"Preloaded catalog and indexes in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+def refresh_catalog():
+    """Bring preloaded indexes up to date with the catalog files, e.g. before forking new workers"""
+    for file_path in CATALOG_FILES:
+        notify_catalog(file_path, json_store.load(file_path, []))
+    catalog_snapshot.build()
+    recommendation_engine.build()
+    json_store.flush()
+
 if __name__ == '__main__':
+    # Development server; run serve.py in production
     # Ensure data directory exists
     os.makedirs(DATA_DIR, exist_ok=True)
+    # With the debug reloader only the serving child process should connect
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,570 @@
+"""Cache for computed results, private to a process or shared by workers and nodes.
+
+Each caching layer (chat responses, semantic search results, cohort
+rankings, and optionally sessions) keeps its entries in a namespace of one
+Cache. STUDYHUB_CACHE_BACKEND picks where the entries live:
+
+* ``memory`` - an LRU in this process (default); every worker caches alone
+* ``shared`` - a SQLite table on tmpfs, shared by the workers on one host
+* ``kv``     - a Redis-compatible key-value server at STUDYHUB_CACHE_URL,
+  shared by every node behind the load balancer; tools/fake_cache_server.py
+  stands in for it locally
+
+Keys are versioned: every key of a namespace carries the namespace's
+generation, and invalidating the namespace increments it, so all processes
+stop reading the old entries at once and those age out with their TTL. A
+``kv`` client also keeps the generation and a near copy of the entries it
+read, and hears of invalidations on a pub/sub channel; should a message be
+lost, it re-reads the generation after GENERATION_CHECK_INTERVAL anyway.
+Values are treated as fixed within a generation: to change them, invalidate.
+
+A cache failure never fails a request. A backend error counts as a miss, and
+a kv server that stopped answering is skipped for CACHE_RETRY_INTERVAL.
+"""
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from typing import Dict, Any, Callable, List, Optional
+
+CACHE_BACKENDS = ('memory', 'shared', 'kv')
+
+# Entries and bytes a namespace keeps in the process: all of it for memory, the near copy for kv
+CACHE_MAX_ENTRIES = 1024
+CACHE_MAX_BYTES = 4 * 1024 * 1024
+
+# Seconds a kv client trusts its copy of a generation without hearing from the channel
+GENERATION_CHECK_INTERVAL = 5.0
+
+# Seconds an unreachable kv server is skipped before the next attempt
+CACHE_RETRY_INTERVAL = 2.0
+
+# A cache slower than this is no use; kv commands give up after it
+CACHE_SOCKET_TIMEOUT = 0.25
+
+# Seconds between sweeps for expired entries in the shared table
+CACHE_PURGE_INTERVAL = 60
+
+# Entries the shared table holds before those closest to expiry are dropped
+SHARED_MAX_ENTRIES = 100000
+
+
+class LocalLRUCache:
+    """Entries in an OrderedDict bounded by count and size; counters are kept apart and never evicted"""
+
+    remote = False
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> (value, expires, size)
+        self._counters: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.time():
+                del self._entries[key]
+                self._bytes -= entry[2]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value: str, ttl: float):
+        size = len(key) + len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._entries[key] = (value, time.time() + ttl, size)
+            self._bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+
+    def counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {'entries': len(self._entries), 'bytes': self._bytes, 'evictions': self.evictions}
+
+
+class SharedCache:
+    """Entries in one SQLite table, normally on tmpfs so it stays in memory; shared by the processes of a host"""
+
+    remote = False
+
+    def __init__(self, path: str, max_entries: int = SHARED_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._purge_lock = threading.Lock()
+        self._next_purge = time.time() + CACHE_PURGE_INTERVAL
+        db = self._db()
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)')
+        db.execute('CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+        db.execute('CREATE TABLE IF NOT EXISTS counters (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def _db(self) -> sqlite3.Connection:
+        """A connection per thread; a forked worker opens its own"""
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.db = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            # Losing the cache in a crash costs nothing but misses
+            self._local.db.execute('PRAGMA synchronous=OFF')
+            self._local.pid = os.getpid()
+        return self._local.db
+
+    def get(self, key: str) -> Optional[str]:
+        row = self._db().execute('SELECT value FROM cache WHERE key = ? AND expires >= ?',
+                                 (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, value: str, ttl: float):
+        now = time.time()
+        self._db().execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)', (key, value, now + ttl))
+        self._maybe_purge(now)
+
+    def delete(self, key: str):
+        self._db().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def counter(self, key: str) -> int:
+        row = self._db().execute('SELECT value FROM counters WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, key: str) -> int:
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('INSERT OR IGNORE INTO counters (key, value) VALUES (?, 0)', (key,))
+            db.execute('UPDATE counters SET value = value + 1 WHERE key = ?', (key,))
+            value = db.execute('SELECT value FROM counters WHERE key = ?', (key,)).fetchone()[0]
+            db.execute('COMMIT')
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.execute('ROLLBACK')
+            raise
+        return value
+
+    def _maybe_purge(self, now: float):
+        with self._purge_lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + CACHE_PURGE_INTERVAL
+        db = self._db()
+        db.execute('DELETE FROM cache WHERE expires < ?', (now,))
+        excess = db.execute('SELECT COUNT(*) FROM cache').fetchone()[0] - self.max_entries
+        if excess > 0:
+            db.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires LIMIT ?)', (excess,))
+
+    def stats(self) -> Dict[str, Any]:
+        return {'path': self.path, 'entries': self._db().execute('SELECT COUNT(*) FROM cache').fetchone()[0]}
+
+
+def _encode(args) -> bytes:
+    """A command as a RESP array of bulk strings"""
+    out = [b'*%d\r\n' % len(args)]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode('utf-8')
+        out.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    return b''.join(out)
+
+
+def _read_reply(reader):
+    line = reader.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('cache server closed the connection')
+    kind, body = line[:1], line[1:-2]
+    if kind == b'+':
+        return body.decode('utf-8')
+    if kind == b'-':
+        raise ConnectionError(f"cache server error: {body.decode('utf-8', 'replace')}")
+    if kind == b':':
+        return int(body)
+    if kind == b'$':
+        length = int(body)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        if len(data) != length + 2:
+            raise ConnectionError('cache server closed the connection')
+        return data[:-2]
+    if kind == b'*':
+        length = int(body)
+        return None if length < 0 else [_read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"unexpected reply from cache server: {line[:40]!r}")
+
+
+class KeyValueCache:
+    """Client for a Redis-compatible key-value server, e.g. redis://:password@cache.internal:6379/0"""
+
+    remote = True
+
+    def __init__(self, url: str, timeout: float = CACHE_SOCKET_TIMEOUT):
+        parsed = urllib.parse.urlsplit(url if '//' in url else '//' + url)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.strip('/') or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._down_until = 0.0
+        self._failing = False
+        self._handlers: Dict[str, List[Callable[[Optional[str]], None]]] = {}
+        self._listener_pid = None
+        self._listener_lock = threading.Lock()
+
+    def _connect(self, timeout: Optional[float]):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(timeout)
+        reader = sock.makefile('rb')
+        if self.password:
+            sock.sendall(_encode(['AUTH', self.password]))
+            _read_reply(reader)
+        if self.db:
+            sock.sendall(_encode(['SELECT', self.db]))
+            _read_reply(reader)
+        return sock, reader
+
+    def _connection(self):
+        """A connection per thread; a forked worker opens its own"""
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.conn = None
+            self._local.pid = os.getpid()
+        if self._local.conn is None:
+            self._local.conn = self._connect(self.timeout)
+        return self._local.conn
+
+    def _drop(self):
+        conn = getattr(self._local, 'conn', None)
+        self._local.conn = None
+        if conn is not None and getattr(self._local, 'pid', None) == os.getpid():
+            conn[0].close()
+
+    def command(self, *args):
+        if time.monotonic() < self._down_until:
+            raise ConnectionError('cache server unavailable')
+        try:
+            try:
+                reused = getattr(self._local, 'conn', None) is not None and self._local.pid == os.getpid()
+                sock, reader = self._connection()
+                sock.sendall(_encode(args))
+                reply = _read_reply(reader)
+            except OSError:
+                if not reused:
+                    raise
+                # An idle connection may have been closed by a server restart; try once on a new one
+                self._drop()
+                sock, reader = self._connection()
+                sock.sendall(_encode(args))
+                reply = _read_reply(reader)
+        except OSError as e:
+            self._drop()
+            self._down_until = time.monotonic() + CACHE_RETRY_INTERVAL
+            if not self._failing:
+                self._failing = True
+                print(f"Cache server {self.host}:{self.port} unavailable, serving without it: {e}")
+            raise
+        if self._failing:
+            self._failing = False
+            print(f"Cache server {self.host}:{self.port} reachable again")
+        return reply
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.command('GET', key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key: str, value: str, ttl: float):
+        self.command('SET', key, value, 'PX', max(1, int(ttl * 1000)))
+
+    def delete(self, key: str):
+        self.command('DEL', key)
+
+    def counter(self, key: str) -> int:
+        return int(self.command('GET', key) or 0)
+
+    def incr(self, key: str) -> int:
+        return self.command('INCR', key)
+
+    def publish(self, channel: str, message: str):
+        self.command('PUBLISH', channel, message)
+
+    def subscribe(self, channel: str, handler: Callable[[Optional[str]], None]):
+        """handler(message) runs on the listener thread; None means messages may have been missed"""
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def listen(self):
+        """Start this process's listener thread for the subscribed channels, if it is not running"""
+        if self._listener_pid == os.getpid() or not self._handlers:
+            return
+        with self._listener_lock:
+            if self._listener_pid == os.getpid():
+                return
+            self._listener_pid = os.getpid()
+            threading.Thread(target=self._listen, name='cache-listener', daemon=True).start()
+
+    def _listen(self):
+        delay = CACHE_RETRY_INTERVAL
+        while True:
+            try:
+                sock, reader = self._connect(None)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                sock.sendall(_encode(['SUBSCRIBE'] + list(self._handlers)))
+                delay = CACHE_RETRY_INTERVAL
+                # Anything published while we were not subscribed is lost
+                self._dispatch(None, None)
+                while True:
+                    reply = _read_reply(reader)
+                    if isinstance(reply, list) and len(reply) == 3 and reply[0] == b'message':
+                        self._dispatch(reply[1].decode('utf-8'), reply[2].decode('utf-8'))
+            except (OSError, ValueError) as e:
+                print(f"Cache invalidation channel lost, retrying in {delay:.0f}s: {e}")
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    def _dispatch(self, channel: Optional[str], message: Optional[str]):
+        for name, handlers in self._handlers.items():
+            if channel is None or channel == name:
+                for handler in handlers:
+                    handler(message)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'server': f'{self.host}:{self.port}', 'available': time.monotonic() >= self._down_until}
+
+
+class CacheNamespace:
+    """The entries of one caching layer, under keys of the form prefix:name:generation:key"""
+
+    def __init__(self, cache: 'Cache', name: str, ttl: float,
+                 max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES, near: bool = True):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        # The memory backend is a private LRU per namespace, so one layer cannot crowd out another
+        self.private = cache.backend is None
+        self.backend = LocalLRUCache(max_entries, max_bytes) if self.private else cache.backend
+        # kv: copies of entries read from the server, valid as long as their generation is
+        self.near = LocalLRUCache(max_entries, max_bytes) if self.backend.remote and near else None
+        self._generation_key = f'{cache.prefix}:{name}:generation'
+        self._generation = None
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.invalidations = 0
+
+    def generation(self) -> int:
+        if not self.backend.remote:
+            return self.backend.counter(self._generation_key)
+        now = time.monotonic()
+        if self._generation is None or now - self._checked > GENERATION_CHECK_INTERVAL:
+            self.cache.listen()
+            self._seen(self.backend.counter(self._generation_key), exact=True)
+            self._checked = now
+        return self._generation
+
+    def _seen(self, generation: int, exact: bool = False):
+        """Adopt a newer generation; exact also follows one that went back, e.g. after a server restart"""
+        with self._lock:
+            if self._generation is None or generation > self._generation or (exact and generation != self._generation):
+                self._generation = generation
+                if self.near is not None:
+                    self.near.clear()
+
+    def _recheck(self):
+        self._checked = float('-inf')
+
+    def _key(self, key: str) -> str:
+        return f'{self.cache.prefix}:{self.name}:{self.generation()}:{key}'
+
+    def get(self, key: str) -> Any:
+        """The cached value, or None on a miss"""
+        try:
+            full_key = self._key(key)
+            value = self.near.get(full_key) if self.near is not None else None
+            if value is not None:
+                self.near_hits += 1
+                return json.loads(value)
+            value = self.backend.get(full_key)
+        except (OSError, sqlite3.Error):
+            self.errors += 1
+            return None
+        if value is None:
+            self.misses += 1
+            return None
+        if self.near is not None:
+            self.near.set(full_key, value, self.ttl)
+        self.hits += 1
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: float = None):
+        text = json.dumps(value)
+        try:
+            full_key = self._key(key)
+            self.backend.set(full_key, text, ttl or self.ttl)
+            if self.near is not None:
+                self.near.set(full_key, text, ttl or self.ttl)
+        except (OSError, sqlite3.Error):
+            self.errors += 1
+
+    def delete(self, key: str):
+        try:
+            full_key = self._key(key)
+            self.backend.delete(full_key)
+            if self.near is not None:
+                self.near.delete(full_key)
+        except (OSError, sqlite3.Error):
+            self.errors += 1
+
+    def invalidate(self):
+        """Retire every entry of the namespace, in all processes and on all nodes"""
+        try:
+            generation = self.backend.incr(self._generation_key)
+            if self.backend.remote:
+                self.backend.publish(self.cache.channel, f'{self.name} {generation}')
+        except (OSError, sqlite3.Error) as e:
+            self.errors += 1
+            print(f"Error invalidating cache namespace {self.name}: {e}")
+            return
+        self._seen(generation)
+        if self.private:
+            self.backend.clear()
+        self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.near_hits + self.misses
+        stats = {
+            'generation': self._generation if self.backend.remote else self.backend.counter(self._generation_key),
+            'hits': self.hits,
+            'near_hits': self.near_hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'invalidations': self.invalidations,
+            'hit_rate': round((self.hits + self.near_hits) / lookups, 3) if lookups else 0.0
+        }
+        if self.private:
+            stats.update(self.backend.stats())
+        elif self.near is not None:
+            stats['near'] = self.near.stats()
+        return stats
+
+
+class Cache:
+    """Namespaces over one backend; None means each namespace keeps a private in-process LRU"""
+
+    def __init__(self, backend=None, prefix: str = 'studyhub'):
+        self.backend = backend
+        self.prefix = prefix
+        self.channel = f'{prefix}:invalidate'
+        self.namespaces: Dict[str, CacheNamespace] = {}
+        self._lock = threading.Lock()
+        if backend is not None and backend.remote:
+            backend.subscribe(self.channel, self._on_message)
+
+    @property
+    def kind(self) -> str:
+        if self.backend is None:
+            return 'memory'
+        return 'kv' if self.backend.remote else 'shared'
+
+    def namespace(self, name: str, ttl: float, **options) -> CacheNamespace:
+        with self._lock:
+            if name not in self.namespaces:
+                self.namespaces[name] = CacheNamespace(self, name, ttl, **options)
+            return self.namespaces[name]
+
+    def listen(self):
+        # Started on first read in each process, never in serve.py's master before it forks
+        if self.backend is not None and self.backend.remote:
+            self.backend.listen()
+
+    def _on_message(self, message: Optional[str]):
+        if message is None:
+            for namespace in list(self.namespaces.values()):
+                namespace._recheck()
+            return
+        name, _, generation = message.partition(' ')
+        namespace = self.namespaces.get(name)
+        if namespace is not None and generation.isdigit():
+            namespace._seen(int(generation))
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {'backend': self.kind}
+        if self.backend is not None:
+            try:
+                stats.update(self.backend.stats())
+            except (OSError, sqlite3.Error) as e:
+                stats['error'] = str(e)
+        stats['namespaces'] = {name: namespace.stats() for name, namespace in self.namespaces.items()}
+        return stats
+
+
+def default_shared_path(data_dir: str) -> str:
+    """A tmpfs file where there is one, named after the data directory so two checkouts never share"""
+    digest = hashlib.sha1(os.path.abspath(data_dir).encode('utf-8')).hexdigest()[:12]
+    if os.path.isdir('/dev/shm'):
+        return f'/dev/shm/studyhub-cache-{digest}.sqlite3'
+    return os.path.join(data_dir, 'cache.sqlite3')
+
+
+def make_cache(backend: str, data_dir: str = 'data', url: str = None, path: str = None,
+               prefix: str = 'studyhub') -> Cache:
+    if backend not in CACHE_BACKENDS:
+        raise ValueError(f"cache backend must be one of {', '.join(CACHE_BACKENDS)}")
+    if backend == 'memory':
+        return Cache(None, prefix)
+    if backend == 'shared':
+        return Cache(SharedCache(path or default_shared_path(data_dir)), prefix)
+    return Cache(KeyValueCache(url or 'redis://127.0.0.1:6379'), prefix)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> Cache:
+    """The process-wide cache, configured from STUDYHUB_CACHE_* on first use"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = make_cache(
+                    os.environ.get('STUDYHUB_CACHE_BACKEND', 'memory'),
+                    os.environ.get('STUDYHUB_DATA_DIR', 'data'),
+                    url=os.environ.get('STUDYHUB_CACHE_URL'),
+                    path=os.environ.get('STUDYHUB_CACHE_PATH'),
+                    prefix=os.environ.get('STUDYHUB_CACHE_PREFIX', 'studyhub')
+                )
+    return _cache
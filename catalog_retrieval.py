@@ -0,0 +1,220 @@
+import hashlib
+import json
+import math
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Dict, Any, List, Callable, Iterable, Optional
+
+from conversations import estimate_tokens
+
+STOPWORDS = {
+    'a', 'an', 'and', 'any', 'are', 'about', 'as', 'at', 'be', 'book', 'books', 'by', 'can', 'do',
+    'does', 'for', 'from', 'have', 'how', 'i', 'in', 'is', 'it', 'me', 'my', 'of', 'on', 'or',
+    'please', 'some', 'the', 'there', 'to', 'us', 'what', 'where', 'which', 'who', 'with', 'you'
+}
+
+# Field weights for scoring; titles and subjects say more about a record than its description
+FIELD_WEIGHTS = {'title': 3.0, 'subject': 2.0, 'course': 2.0, 'author': 1.5, 'level': 1.0, 'description': 1.0}
+
+BOOK_TYPE_LABELS = {'physical': 'library book', 'ebook': 'e-book', 'internal': 'course material'}
+
+
+def tokenize(text: str) -> List[str]:
+    tokens = []
+    for word in re.findall(r'[a-z0-9]+', text.lower()):
+        if word in STOPWORDS:
+            continue
+        # Light stemming so "databases" matches "database"
+        if len(word) > 4 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def record_fingerprint(record: Dict[str, Any]) -> str:
+    indexed = {field: record.get(field) for field in FIELD_WEIGHTS}
+    return hashlib.sha1(json.dumps(indexed, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+class CatalogRetriever:
+    """In-memory BM25 index over the catalog used to ground chatbot answers.
+
+    Records are re-tokenized only when their indexed fields change; availability
+    is stored separately so borrow/return updates never touch the postings.
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[[], list]], top_k: int = 5, token_budget: int = 300):
+        self.loaders = loaders
+        self.top_k = top_k
+        self.token_budget = token_budget
+        self._records = {}           # (book_type, id) -> compact record dict
+        self._fingerprints = {}      # (book_type, id) -> fingerprint of indexed fields
+        self._doc_terms = {}         # (book_type, id) -> {term: weighted tf}
+        self._postings = defaultdict(dict)  # term -> {(book_type, id): weighted tf}
+        self._doc_lengths = {}
+        self._total_length = 0.0
+        self._loaded = False
+        self._lock = threading.RLock()
+        self._latencies = deque(maxlen=500)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                for book_type, loader in self.loaders.items():
+                    self.sync(book_type, loader())
+                self._loaded = True
+
+    def warm(self):
+        """Build the index now rather than on the first lookup"""
+        self._ensure_loaded()
+
+    def sync(self, book_type: str, records: Iterable[Dict[str, Any]], changes: Dict[Any, Any] = None):
+        """Bring one catalog source up to date, re-indexing only changed records.
+
+        changes, when given, maps the ids a commit touched to their new record
+        (None when deleted) and only those are looked at; records is not read.
+        """
+        with self._lock:
+            if changes is not None:
+                for item_id, record in changes.items():
+                    self._update((book_type, item_id), book_type, record)
+                return
+            seen = set()
+            for record in records:
+                key = (book_type, record['id'])
+                seen.add(key)
+                self._update(key, book_type, record)
+            for key in [k for k in self._records if k[0] == book_type and k not in seen]:
+                self._update(key, book_type, None)
+
+    def _update(self, key, book_type: str, record: Optional[Dict[str, Any]]):
+        if record is None:
+            self._remove(key)
+            self._records.pop(key, None)
+            self._fingerprints.pop(key, None)
+            return
+        fingerprint = record_fingerprint(record)
+        if self._fingerprints.get(key) != fingerprint:
+            self._remove(key)
+            self._add(key, record)
+            self._fingerprints[key] = fingerprint
+        self._records[key] = self._compact(book_type, record)
+
+    def _add(self, key, record):
+        terms = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(str(record.get(field) or '')):
+                terms[term] += weight
+        for term, tf in terms.items():
+            self._postings[term][key] = tf
+        length = sum(terms.values())
+        self._doc_terms[key] = terms
+        self._doc_lengths[key] = length
+        self._total_length += length
+
+    def _remove(self, key):
+        terms = self._doc_terms.pop(key, None)
+        if terms is None:
+            return
+        for term in terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(key, 0.0)
+
+    def _compact(self, book_type: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'id': record['id'],
+            'title': record.get('title', ''),
+            'author': record.get('author', ''),
+            'subject': record.get('subject', ''),
+            'level': record.get('level', ''),
+            'course': record.get('course', ''),
+            'location': record.get('location', ''),
+            'book_type': book_type,
+            'copies': record.get('copies'),
+            'available': record.get('availableCopies')
+        }
+
+    def search(self, query: str, top_k: int = None) -> List[Dict[str, Any]]:
+        self._ensure_loaded()
+        top_k = top_k or self.top_k
+        with self._lock:
+            n_docs = len(self._doc_lengths)
+            if not n_docs:
+                return []
+            avg_length = self._total_length / n_docs
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, tf in postings.items():
+                    norm = 1.2 * (0.25 + 0.75 * self._doc_lengths[key] / avg_length)
+                    scores[key] += idf * tf * 2.2 / (tf + norm)
+            ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+            return [dict(self._records[key], score=round(score, 3)) for key, score in ranked]
+
+    def format_record(self, record: Dict[str, Any]) -> str:
+        parts = [f"[#{record['id']}] {record['title']}"]
+        if record['author']:
+            parts.append(record['author'])
+        details = ', '.join(filter(None, [record['subject'], record['level'], record['course']]))
+        if details:
+            parts.append(details)
+        if record['book_type'] == 'physical':
+            availability = f"{record['available']}/{record['copies']} available"
+            parts.append(f"{availability}, {record['location']}" if record['location'] else availability)
+        else:
+            parts.append(BOOK_TYPE_LABELS.get(record['book_type'], record['book_type']))
+        return ' | '.join(parts)
+
+    def retrieve(self, query: str) -> Dict[str, Any]:
+        """Return the compact catalog context for a question, within the token budget"""
+        start = time.perf_counter()
+        lines = []
+        used = 0
+        for record in self.search(query):
+            line = '- ' + self.format_record(record)
+            cost = estimate_tokens(line)
+            if used + cost > self.token_budget:
+                break
+            lines.append(line)
+            used += cost
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._latencies.append(elapsed_ms)
+        return {
+            'context': '\n'.join(lines),
+            'records': len(lines),
+            'tokens': used,
+            'latency_ms': round(elapsed_ms, 3)
+        }
+
+    def build_prompt(self, message: str, context: str) -> str:
+        if not context:
+            return message
+        return (
+            "You are the AI StudyHub library assistant. Use these catalog records when they are "
+            "relevant; if they do not answer the question, say the catalog has no match.\n"
+            f"Catalog records:\n{context}\n"
+            f"Question: {message}"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                'records': len(self._records),
+                'terms': len(self._postings),
+                'queries': len(latencies),
+                'avg_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                'p95_ms': round(latencies[int(len(latencies) * 0.95) - 1], 3) if latencies else 0.0,
+                'token_budget': self.token_budget
+            }
@@ -0,0 +1,505 @@
+"""Binary catalog snapshot shared by worker processes through mmap.
+
+Every worker used to parse the catalog JSON and keep its own dicts. The
+snapshot is one file, data/catalog.snapshot, that all workers map read-only,
+so the page cache holds a single copy:
+
+    header      magic, format version, generation, directory length
+    directory   JSON: per book type its row count, store version and columns
+    columns     per column a tag byte per row, then 4 or 8 bytes per row
+    heap        UTF-8 strings and JSON-encoded values
+
+A column is ``int`` (int64), ``float`` (float64), ``code`` (uint32 index
+into the column's distinct values, kept in the directory: subject, level,
+status), ``str`` (uint32 heap offset and length) or ``json`` for anything
+else (lists, mixed types). Tags mark a row's value as absent, null, true,
+false or stored in the column, so a record keeps exactly the keys it had.
+
+Numeric and code columns are also exposed as NumPy arrays over the mapping,
+so where() filters whole columns without touching a record; a predicate on
+a coded or numeric field runs once per distinct value.
+
+Records are handed out as RecordView mappings that decode a field when it
+is read; a page that only looks at titles and subjects never decodes a
+description. A snapshot is rewritten whole, to a temp file renamed over the
+old one, and readers notice the new inode and map the new generation; a
+generation stays mapped while views of it are alive.
+
+Each table records the store version of the file it was built from.
+Readers only use a table whose version matches the store, and otherwise
+fall back to the store while a background rebuild runs. Staleness is only
+ever judged by that version: under the oplog a compaction rewrites the data
+files without a commit, and the snapshot stays valid.
+"""
+import bisect
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from collections.abc import Mapping
+from typing import Dict, Any, List, Optional, Tuple, Callable
+
+import numpy as np
+
+from storage import FileLock, atomic_write
+
+MAGIC = b'SHCATSNP'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<8sIQI')   # magic, format version, generation, directory length
+
+TAG_ABSENT, TAG_NULL, TAG_TRUE, TAG_FALSE, TAG_VALUE = range(5)
+
+# Saves arriving within this long of each other are folded into one rebuild
+REBUILD_DELAY = 0.5
+
+# String columns with at most this many distinct values, each repeated on
+# average, are stored as codes
+CODED_DISTINCT = 65535
+
+CELL_WIDTH = {'int': 8, 'float': 8, 'code': 4, 'str': 8, 'json': 8}
+CELL_FORMAT = {'int': 'q', 'float': 'd', 'code': 'I', 'str': 'I', 'json': 'I'}
+
+_INT64 = (-2 ** 63, 2 ** 63 - 1)
+
+
+def _kind(values: List[Any]) -> str:
+    """Column kind for the non-null, non-bool values of one field"""
+    kinds = set()
+    for value in values:
+        if isinstance(value, int) and _INT64[0] <= value <= _INT64[1]:
+            kinds.add('int')
+        elif isinstance(value, float):
+            kinds.add('float')
+        elif isinstance(value, str):
+            kinds.add('str')
+        else:
+            return 'json'
+    if len(kinds) == 1:
+        return kinds.pop()
+    return 'float' if kinds == {'int', 'float'} else ('json' if kinds else 'int')
+
+
+def encode_snapshot(tables: Dict[str, Tuple[Any, List[Dict[str, Any]]]], generation: int) -> bytes:
+    """Serialize {book_type: (store version, records)}"""
+    directory = {'tables': {}}
+    body = bytearray()
+    heap = bytearray()
+    strings: Dict[str, Tuple[int, int]] = {}
+
+    def heap_ref(text: str) -> Tuple[int, int]:
+        ref = strings.get(text)
+        if ref is None:
+            data = text.encode('utf-8')
+            ref = strings[text] = (len(heap), len(data))
+            heap.extend(data)
+        return ref
+
+    for book_type, (version, records) in tables.items():
+        fields: Dict[str, None] = {}
+        for record in records:
+            for field in record:
+                fields.setdefault(field)
+        columns = []
+        for field in fields:
+            values = [record.get(field) for record in records]
+            kind = _kind([v for v in values if v is not None and not isinstance(v, bool)])
+            column = {'name': field, 'kind': kind}
+            if kind == 'str':
+                distinct = list(dict.fromkeys(v for v in values if isinstance(v, str)))
+                if len(distinct) <= CODED_DISTINCT and 2 * len(distinct) <= len(records):
+                    kind = column['kind'] = 'code'
+                    column['values'] = distinct
+                    codes = {value: code for code, value in enumerate(distinct)}
+            tags = bytearray(len(records))
+            cells = bytearray(CELL_WIDTH[kind] * len(records))
+            for row, (record, value) in enumerate(zip(records, values)):
+                if field not in record:
+                    tags[row] = TAG_ABSENT
+                elif value is None:
+                    tags[row] = TAG_NULL
+                elif value is True or value is False:
+                    tags[row] = TAG_TRUE if value else TAG_FALSE
+                else:
+                    tags[row] = TAG_VALUE
+                    if kind == 'int':
+                        struct.pack_into('<q', cells, 8 * row, value)
+                    elif kind == 'float':
+                        struct.pack_into('<d', cells, 8 * row, value)
+                    elif kind == 'code':
+                        struct.pack_into('<I', cells, 4 * row, codes[value])
+                    else:
+                        text = value if kind == 'str' else json.dumps(value)
+                        struct.pack_into('<II', cells, 8 * row, *heap_ref(text))
+            column['offset'] = len(body)
+            columns.append(column)
+            body.extend(tags)
+            body.extend(b'\0' * (-len(body) % 8))
+            body.extend(cells)
+            body.extend(b'\0' * (-len(body) % 8))
+
+        # Sorted (id, row) pairs make lookups by integer id a binary search
+        id_index = None
+        ids = [record.get('id') for record in records]
+        if ids and all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            pairs = sorted((item_id, row) for row, item_id in enumerate(ids))
+            id_index = len(body)
+            for item_id, _ in pairs:
+                body.extend(struct.pack('<q', item_id))
+            for _, row in pairs:
+                body.extend(struct.pack('<q', row))
+        directory['tables'][book_type] = {'rows': len(records), 'version': version,
+                                          'columns': columns, 'id_index': id_index}
+
+    directory['heap'] = len(body)
+    meta = json.dumps(directory).encode('utf-8')
+    meta += b' ' * (-(HEADER.size + len(meta)) % 8)
+    # Offsets in the directory are relative to the end of the directory
+    return HEADER.pack(MAGIC, FORMAT_VERSION, generation, len(meta)) + meta + bytes(body) + bytes(heap)
+
+
+class RecordView(Mapping):
+    """One catalog record, decoded field by field from the mapped snapshot; a row view over the columns"""
+
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table: 'SnapshotTable', row: int):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, field: str):
+        column = self._table.columns.get(field)
+        if column is None:
+            raise KeyError(field)
+        return self._table.value(column, self._row, field)
+
+    def get(self, field: str, default=None):
+        column = self._table.columns.get(field)
+        if column is None or column[1][self._row] == TAG_ABSENT:
+            return default
+        return self._table.value(column, self._row, field)
+
+    def __contains__(self, field) -> bool:
+        column = self._table.columns.get(field)
+        return column is not None and column[1][self._row] != TAG_ABSENT
+
+    def __iter__(self):
+        for field, column in self._table.columns.items():
+            if column[1][self._row] != TAG_ABSENT:
+                yield field
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"RecordView({dict(self)!r})"
+
+
+class SnapshotTable:
+    """The records of one book type inside a mapped generation"""
+
+    def __init__(self, generation: 'SnapshotGeneration', book_type: str, meta: Dict[str, Any], base: int):
+        self.generation = generation
+        self.book_type = book_type
+        self.rows = meta['rows']
+        self.version = meta['version']
+        buffer = generation.buffer
+        self.columns: Dict[str, tuple] = {}   # field -> (kind, tags, cells, distinct values of a code column)
+        self._offsets: Dict[str, Tuple[int, int]] = {}   # field -> (tags offset, cells offset)
+        for column in meta['columns']:
+            kind = column['kind']
+            start = base + column['offset']
+            tags = buffer[start:start + self.rows]
+            cells_start = start + self.rows + (-self.rows % 8)
+            cells = buffer[cells_start:cells_start + CELL_WIDTH[kind] * self.rows]
+            values = [sys.intern(v) for v in column['values']] if kind == 'code' else None
+            self.columns[column['name']] = (kind, tags, cells.cast(CELL_FORMAT[kind]), values)
+            self._offsets[column['name']] = (start, cells_start)
+        self._ids = self._id_rows = None
+        if meta['id_index'] is not None:
+            start = base + meta['id_index']
+            self._ids = buffer[start:start + 8 * self.rows].cast('q')
+            self._id_rows = buffer[start + 8 * self.rows:start + 16 * self.rows].cast('q')
+        self._views: Optional[List[RecordView]] = None
+
+    def value(self, column: tuple, row: int, field: str):
+        kind, tags, cells, values = column
+        tag = tags[row]
+        if tag == TAG_VALUE:
+            if kind == 'code':
+                return values[cells[row]]
+            if kind == 'int' or kind == 'float':
+                return cells[row]
+            text = self.generation.heap_text(cells[2 * row], cells[2 * row + 1])
+            return text if kind == 'str' else json.loads(text)
+        if tag == TAG_NULL:
+            return None
+        if tag == TAG_TRUE:
+            return True
+        if tag == TAG_FALSE:
+            return False
+        raise KeyError(field)
+
+    def views(self) -> List[RecordView]:
+        """All records in file order; the list is shared, callers must not modify it"""
+        if self._views is None:
+            self._views = [RecordView(self, row) for row in range(self.rows)]
+        return self._views
+
+    def tags(self, field: str) -> np.ndarray:
+        start = self._offsets[field][0]
+        return np.frombuffer(self.generation.buffer, dtype=np.uint8, count=self.rows, offset=start)
+
+    def array(self, field: str) -> np.ndarray:
+        """The int, float or code column of field as a read-only array over the mapping"""
+        kind = self.columns[field][0]
+        dtype = {'int': '<i8', 'float': '<f8', 'code': '<u4'}.get(kind)
+        if dtype is None:
+            raise TypeError(f"{field} is a {kind} column")
+        return np.frombuffer(self.generation.buffer, dtype=dtype, count=self.rows, offset=self._offsets[field][1])
+
+    def where(self, conditions: Dict[str, Any]) -> np.ndarray:
+        """Boolean row mask for records matching every condition.
+
+        A condition is a value (equality), a list/set/tuple (membership) or a
+        predicate called with the field's value. Rows where the field is
+        missing or null never match.
+        """
+        mask = np.ones(self.rows, dtype=bool)
+        for field, condition in conditions.items():
+            mask &= self._match(field, _predicate(condition))
+        return mask
+
+    def _match(self, field: str, predicate: Callable[[Any], bool]) -> np.ndarray:
+        column = self.columns.get(field)
+        if column is None:
+            return np.zeros(self.rows, dtype=bool)
+        kind, _, _, values = column
+        tags = self.tags(field)
+        mask = np.zeros(self.rows, dtype=bool)
+        if kind in ('code', 'int', 'float'):
+            present = tags == TAG_VALUE
+            array = self.array(field)
+            if kind == 'code':
+                matching = [code for code, value in enumerate(values) if predicate(value)]
+            else:
+                matching = [value for value in np.unique(array[present]) if predicate(value.item())]
+            mask |= present & np.isin(array, matching)
+        else:
+            for row in np.flatnonzero(tags == TAG_VALUE):
+                mask[row] = predicate(self.value(column, int(row), field))
+        for tag, value in ((TAG_TRUE, True), (TAG_FALSE, False)):
+            rows = tags == tag
+            if rows.any() and predicate(value):
+                mask |= rows
+        return mask
+
+    def select(self, mask: np.ndarray) -> List[RecordView]:
+        return [RecordView(self, int(row)) for row in np.flatnonzero(mask)]
+
+    def find(self, item_id) -> Optional[RecordView]:
+        if self._ids is None:
+            return next((view for view in self.views() if view.get('id') == item_id), None)
+        if not isinstance(item_id, int):
+            return None
+        position = bisect.bisect_left(self._ids, item_id)
+        if position < self.rows and self._ids[position] == item_id:
+            return RecordView(self, self._id_rows[position])
+        return None
+
+
+def _predicate(condition) -> Callable[[Any], bool]:
+    if callable(condition):
+        return condition
+    if isinstance(condition, (list, set, tuple, frozenset)):
+        members = set(condition)
+        return lambda value: value in members
+    return lambda value: value == condition
+
+
+def _matches(record: Dict[str, Any], conditions: Dict[str, Any]) -> bool:
+    """where() for one parsed record, used while the snapshot is stale"""
+    for field, condition in conditions.items():
+        value = record.get(field)
+        if value is None or not _predicate(condition)(value):
+            return False
+    return True
+
+
+class SnapshotGeneration:
+    """One mapped snapshot file; unmapped when nothing refers to it any more"""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self.key = os.fstat(f.fileno()).st_ino
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self._mmap)
+        magic, version, self.generation, meta_length = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not a catalog snapshot this version can read")
+        base = HEADER.size + meta_length
+        directory = json.loads(bytes(self.buffer[HEADER.size:base]))
+        self._heap = base + directory['heap']
+        self.tables = {book_type: SnapshotTable(self, book_type, meta, base)
+                       for book_type, meta in directory['tables'].items()}
+
+    def heap_text(self, offset: int, length: int) -> str:
+        start = self._heap + offset
+        return str(self.buffer[start:start + length], 'utf-8')
+
+
+class CatalogSnapshot:
+    """Catalog reads served from the shared snapshot, kept in step with a JsonStore"""
+
+    def __init__(self, path: str, sources: Dict[str, str], store):
+        self.path = path
+        self.sources = sources          # book_type -> data file
+        self.store = store
+        self._generation: Optional[SnapshotGeneration] = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._worker = None
+        self._worker_pid = None
+        self._build_lock = FileLock(os.path.join(os.path.dirname(path) or '.', '.locks',
+                                                 os.path.basename(path) + '.lock'))
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.last_build_ms = 0.0
+
+    def current(self) -> Optional[SnapshotGeneration]:
+        """The newest generation on disk, mapping it if it changed since the last call"""
+        try:
+            key = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if self._generation is None or self._generation.key != key:
+                try:
+                    self._generation = SnapshotGeneration(self.path)
+                except (OSError, ValueError) as e:
+                    print(f"Error mapping catalog snapshot: {e}")
+                    return None
+            return self._generation
+
+    def _table(self, book_type: str) -> Optional[SnapshotTable]:
+        generation = self.current()
+        table = generation.tables.get(book_type) if generation is not None else None
+        version = self.store.version(self.sources[book_type])
+        if table is not None and version is not None and table.version == version:
+            self.hits += 1
+            return table
+        self.misses += 1
+        self._schedule()
+        return None
+
+    def records(self, book_type: str) -> List[Any]:
+        """Records of book_type for reading only: snapshot views, or parsed from the store while it is stale"""
+        table = self._table(book_type)
+        if table is not None:
+            return table.views()
+        return self.store.load(self.sources[book_type], [])
+
+    def where(self, book_type: str, conditions: Dict[str, Any]) -> List[Any]:
+        """Records of book_type matching conditions (see SnapshotTable.where), in file order"""
+        table = self._table(book_type)
+        if table is not None:
+            return table.select(table.where(conditions))
+        return [r for r in self.store.load(self.sources[book_type], []) if _matches(r, conditions)]
+
+    def lookup(self, item_ids) -> Dict[Any, Any]:
+        """{id: record} for those of item_ids found anywhere in the catalog"""
+        wanted = set(item_ids)
+        found = {}
+        for book_type, file_path in self.sources.items():
+            if not wanted:
+                break
+            table = self._table(book_type)
+            if table is not None:
+                records = (table.find(item_id) for item_id in wanted)
+            else:
+                records = (r for r in self.store.load(file_path, []) if r.get('id') in wanted)
+            for record in records:
+                if record is not None:
+                    found[record['id']] = record
+            wanted.difference_update(found)
+        return found
+
+    def find(self, item_id) -> Optional[Tuple[str, Any]]:
+        """(book_type, record) for an id anywhere in the catalog"""
+        for book_type, file_path in self.sources.items():
+            table = self._table(book_type)
+            if table is not None:
+                record = table.find(item_id)
+            else:
+                record = next((r for r in self.store.load(file_path, []) if r.get('id') == item_id), None)
+            if record is not None:
+                return book_type, record
+        return None
+
+    def _stale(self) -> bool:
+        generation = self.current()
+        if generation is None:
+            return True
+        for book_type, file_path in self.sources.items():
+            version = self.store.version(file_path)
+            if version is None or book_type not in generation.tables or generation.tables[book_type].version != version:
+                return True
+        return False
+
+    def build(self, force: bool = False) -> bool:
+        """Write a new generation if the current one is stale; True if one was written"""
+        try:
+            with self._build_lock:
+                # Another worker may have rebuilt while this one waited for the lock
+                if not force and not self._stale():
+                    return False
+                start = time.perf_counter()
+                tables = {}
+                for book_type, file_path in self.sources.items():
+                    # Version first: data newer than its label only costs another rebuild
+                    version = self.store.version(file_path)
+                    tables[book_type] = (version, self.store.load(file_path, []))
+                generation = self.current()
+                atomic_write(self.path, encode_snapshot(tables, generation.generation + 1 if generation else 1))
+                self.builds += 1
+                self.last_build_ms = round((time.perf_counter() - start) * 1000, 2)
+                return True
+        except TimeoutError:
+            return False   # another worker is building
+
+    def warm(self):
+        """Build the snapshot if it is missing or behind the store's committed versions"""
+        self.build()
+        self.current()
+
+    def _schedule(self):
+        if self._worker is None or self._worker_pid != os.getpid():
+            self._worker = threading.Thread(target=self._run, name='catalog-snapshot', daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            time.sleep(REBUILD_DELAY)
+            self._wake.clear()
+            try:
+                self.build()
+            except (OSError, ValueError) as e:
+                print(f"Error building catalog snapshot: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        generation = self.current()
+        return {
+            'generation': generation.generation if generation else None,
+            'bytes': len(generation.buffer) if generation else 0,
+            'records': {book_type: table.rows for book_type, table in generation.tables.items()} if generation else {},
+            'hits': self.hits,
+            'misses': self.misses,
+            'builds': self.builds,
+            'last_build_ms': self.last_build_ms
+        }
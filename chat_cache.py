@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Dict, Any, Callable, Optional
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Fold case, punctuation and whitespace so near-identical questions share a key"""
+    text = prompt.lower()
+    text = re.sub(r"[^\w\s]", ' ', text)
+    return ' '.join(text.split())
+
+
+class _Flight:
+    """A generation in progress that duplicate callers can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class ChatResponseCache:
+    """Chat responses in a cache namespace, with pinned FAQ answers and single-flight request coalescing.
+
+    Entries are keyed by a digest of (normalized prompt, model), so with a
+    shared cache backend an answer generated by one worker or node serves
+    the others; concurrent duplicates are coalesced within the process.
+    Pinned FAQ entries never expire and match any model, so FAQ-style
+    traffic never reaches the LLM.
+    """
+
+    def __init__(self, store):
+        self.store = store              # a cache_store.CacheNamespace
+        self._faq = {}                  # normalized question -> answer
+        self._inflight = {}             # key -> _Flight
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.faq_hits = 0
+
+    def make_key(self, prompt: str, model: str, variant: str = '') -> str:
+        # variant distinguishes otherwise identical prompts sent with different grounding
+        text = f"{normalize_prompt(prompt)}\n{model or ''}{variant}"
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def load_faq(self, file_path: str) -> int:
+        """Load pinned question/answer pairs from a JSON file"""
+        if not os.path.exists(file_path):
+            return 0
+        with open(file_path, 'r') as f:
+            entries = json.load(f)
+        with self._lock:
+            for entry in entries:
+                for question in entry.get('questions', []):
+                    self._faq[normalize_prompt(question)] = entry['answer']
+        return len(self._faq)
+
+    def get(self, key: str) -> Optional[str]:
+        return self.store.get(key)
+
+    def put(self, key: str, response: str):
+        self.store.set(key, response)
+
+    def get_or_generate(self, prompt: str, model: str,
+                        generate: Callable[[], Dict[str, Any]], variant: str = '') -> Dict[str, Any]:
+        """Return a cached response or run generate() once for all concurrent duplicates"""
+        answer = self._faq.get(normalize_prompt(prompt))
+        if answer is not None:
+            with self._lock:
+                self.faq_hits += 1
+            return {'success': True, 'response': answer, 'cache': 'faq'}
+
+        # Outside the lock: with a kv backend this is a round trip
+        key = self.make_key(prompt, model, variant)
+        response = self.get(key)
+        with self._lock:
+            if response is not None:
+                self.hits += 1
+                return {'success': True, 'response': response, 'cache': 'hit'}
+
+            flight = self._inflight.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                self.misses += 1
+                flight = _Flight()
+                self._inflight[key] = flight
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            return dict(flight.result, cache='coalesced')
+
+        try:
+            result = generate()
+            flight.result = result
+            # Only cache real answers; errors should be retried by the next caller
+            if result.get('success') and result.get('response'):
+                self.put(key, result['response'])
+        except Exception as e:
+            flight.result = {'success': False, 'message': f'Error generating response: {e}'}
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+        return dict(result, cache='miss')
+
+    def clear(self):
+        """Drop cached responses everywhere the cache is shared; FAQ answers stay"""
+        self.store.invalidate()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced + self.faq_hits
+            stats = {
+                'faq_entries': len(self._faq),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'faq_hits': self.faq_hits,
+                'hit_rate': round((lookups - self.misses) / lookups, 3) if lookups else 0.0
+            }
+        stats['store'] = self.store.stats()
+        return stats
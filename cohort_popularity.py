@@ -0,0 +1,108 @@
+"""Streaming top-k popularity per (major, year) cohort.
+
+Each cohort keeps one compact integer counter per catalog item and a bounded
+min-heap of its current top-k. An increment is O(log k). A decrement only
+matters if it hits a top-k member, and then it can let an outside item
+overtake; the cohort is flagged and its top-k re-selected on the next read.
+"""
+import heapq
+from array import array
+from typing import Dict, Any, List, Tuple
+
+
+class _CohortTopK:
+    __slots__ = ('counts', 'members', 'heap', 'dirty', 'ranked')
+
+    def __init__(self, size: int):
+        self.counts = array('i', bytes(4 * size))
+        self.members: Dict[int, int] = {}   # column -> count recorded in the heap
+        self.heap: List[Tuple[int, int]] = []   # (count, -column); stale entries skipped lazily
+        self.dirty = False
+        self.ranked = None
+
+
+class CohortPopularity:
+    """Counters per (cohort, item) with a maintained top-k per cohort"""
+
+    def __init__(self, num_items: int, k: int = 10):
+        self.num_items = num_items
+        self.k = k
+        self._cohorts: Dict[Any, _CohortTopK] = {}
+        self.reselects = 0
+
+    def _cohort(self, key) -> _CohortTopK:
+        cohort = self._cohorts.get(key)
+        if cohort is None:
+            cohort = self._cohorts[key] = _CohortTopK(self.num_items)
+        return cohort
+
+    def load(self, key, counts):
+        """Seed a cohort from a full vector of per-item counts"""
+        cohort = self._cohort(key)
+        cohort.counts = array('i', (int(c) for c in counts))
+        self._reselect(cohort)
+
+    def add(self, key, column: int, delta: int):
+        cohort = self._cohort(key)
+        count = cohort.counts[column] + delta
+        cohort.counts[column] = max(count, 0)
+        cohort.ranked = None
+        if cohort.dirty:
+            return   # the next read re-selects from the counters anyway
+
+        if column in cohort.members:
+            if delta < 0:
+                cohort.dirty = True
+                return
+            cohort.members[column] = count
+            heapq.heappush(cohort.heap, (count, -column))
+        elif count > 0:
+            if len(cohort.members) < self.k:
+                cohort.members[column] = count
+                heapq.heappush(cohort.heap, (count, -column))
+            else:
+                weakest = self._peek_min(cohort)
+                if (count, -column) > weakest:
+                    heapq.heappop(cohort.heap)
+                    del cohort.members[-weakest[1]]
+                    cohort.members[column] = count
+                    heapq.heappush(cohort.heap, (count, -column))
+        # Stale entries pile up on repeated increments; keep the heap bounded
+        if len(cohort.heap) > 2 * self.k:
+            cohort.heap = [(c, -col) for col, c in cohort.members.items()]
+            heapq.heapify(cohort.heap)
+
+    def _peek_min(self, cohort: _CohortTopK) -> Tuple[int, int]:
+        while True:
+            count, neg_column = cohort.heap[0]
+            if cohort.members.get(-neg_column) == count:
+                return cohort.heap[0]
+            heapq.heappop(cohort.heap)
+
+    def _reselect(self, cohort: _CohortTopK):
+        best = heapq.nlargest(self.k, ((c, -col) for col, c in enumerate(cohort.counts) if c > 0))
+        cohort.members = {-neg_column: c for c, neg_column in best}
+        cohort.heap = list(best)
+        heapq.heapify(cohort.heap)
+        cohort.dirty = False
+        cohort.ranked = None
+        self.reselects += 1
+
+    def top(self, key) -> List[Tuple[int, int]]:
+        """(column, count) for the cohort's top-k, most popular first, ties in catalog order"""
+        cohort = self._cohorts.get(key)
+        if cohort is None:
+            return []
+        if cohort.dirty:
+            self._reselect(cohort)
+        if cohort.ranked is None:
+            cohort.ranked = sorted(((col, c) for col, c in cohort.members.items()), key=lambda m: (-m[1], m[0]))
+        return cohort.ranked
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'cohorts': len(self._cohorts),
+            'k': self.k,
+            'dirty': sum(1 for c in self._cohorts.values() if c.dirty),
+            'reselects': self.reselects
+        }
@@ -0,0 +1,160 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+def _first_sentence(text: str, max_words: int = 20) -> str:
+    sentence = re.split(r'(?<=[.!?])\s', text.strip(), maxsplit=1)[0]
+    words = sentence.split()
+    if len(words) > max_words:
+        sentence = ' '.join(words[:max_words]) + '...'
+    return sentence
+
+
+class Conversation:
+    """Message history for one user session"""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.messages: List[Dict[str, str]] = []
+        self.summary = ''
+        # Token context returned by /api/generate; lets follow-ups skip re-sending the transcript
+        self.context: Optional[List[int]] = None
+        self.last_active = time.time()
+        self.truncations = 0
+        self.lock = threading.Lock()
+
+    def history_tokens(self) -> int:
+        if self.context is not None:
+            return len(self.context)
+        total = estimate_tokens(self.summary) if self.summary else 0
+        return total + sum(estimate_tokens(m['content']) for m in self.messages)
+
+    def render_transcript(self, message: str) -> str:
+        lines = []
+        if self.summary:
+            lines.append(f"Summary of the earlier conversation: {self.summary}")
+        for m in self.messages:
+            speaker = 'User' if m['role'] == 'user' else 'Assistant'
+            lines.append(f"{speaker}: {m['content']}")
+        lines.append(f"User: {message}")
+        lines.append("Assistant:")
+        return '\n'.join(lines)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'session_id': self.session_id,
+            'turns': len(self.messages) // 2,
+            'history_tokens': self.history_tokens(),
+            'has_context': self.context is not None,
+            'truncations': self.truncations,
+            'idle_seconds': round(time.time() - self.last_active, 1)
+        }
+
+
+class ConversationStore:
+    """Per-session conversations with a token budget and idle eviction"""
+
+    def __init__(self, token_budget: int = 2048, idle_timeout: int = 1800,
+                 max_conversations: int = 1000, sweep_interval: int = 60):
+        self.token_budget = token_budget
+        self.idle_timeout = idle_timeout
+        self.max_conversations = max_conversations
+        self.sweep_interval = sweep_interval
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sweep = time.time()
+        self.evicted = 0
+
+    def get(self, session_id: str) -> Conversation:
+        with self._lock:
+            now = time.time()
+            if now - self._last_sweep > self.sweep_interval:
+                self._evict_idle_locked(now)
+            conversation = self._conversations.get(session_id)
+            if conversation is None:
+                conversation = Conversation(session_id)
+                self._conversations[session_id] = conversation
+                while len(self._conversations) > self.max_conversations:
+                    self._conversations.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._conversations.move_to_end(session_id)
+            conversation.last_active = now
+            return conversation
+
+    def peek(self, session_id: str) -> Optional[Conversation]:
+        with self._lock:
+            return self._conversations.get(session_id)
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._conversations.pop(session_id, None)
+
+    def evict_idle(self) -> int:
+        with self._lock:
+            return self._evict_idle_locked(time.time())
+
+    def _evict_idle_locked(self, now: float) -> int:
+        self._last_sweep = now
+        expired = [sid for sid, c in self._conversations.items() if now - c.last_active > self.idle_timeout]
+        for sid in expired:
+            del self._conversations[sid]
+        self.evicted += len(expired)
+        return len(expired)
+
+    def build_request(self, conversation: Conversation, message: str) -> Dict[str, Any]:
+        """Return the prompt/context pair to send for the next turn.
+
+        ``message`` is the full text for this turn (it may carry catalog grounding);
+        only the user's own words are kept in the history by record().
+        """
+        incoming = estimate_tokens(message)
+        if conversation.history_tokens() + incoming > self.token_budget:
+            self._truncate(conversation, self.token_budget - incoming)
+
+        if conversation.context is not None:
+            # The backend already holds the transcript; only send the new turn
+            return {'prompt': message, 'context': conversation.context}
+        if not conversation.messages and not conversation.summary:
+            return {'prompt': message}
+        return {'prompt': conversation.render_transcript(message)}
+
+    def _truncate(self, conversation: Conversation, budget: int):
+        # The returned context encodes the whole transcript, so it cannot be trimmed;
+        # fall back to re-sending a windowed transcript once
+        conversation.context = None
+        conversation.truncations += 1
+        # Keep the summary to a quarter of the budget, favouring the most recent notes
+        max_chars = max(0, budget // 4) * 4
+        while conversation.messages and conversation.history_tokens() > budget:
+            # Drop whole user/assistant turns so no reply is left without its question;
+            # the summary grows as they go, so it counts towards the budget it is checked against
+            dropped = conversation.messages[:2]
+            del conversation.messages[:2]
+            notes = [_first_sentence(m['content']) for m in dropped if m['role'] == 'user']
+            summary = '; '.join(filter(None, [conversation.summary] + notes))
+            conversation.summary = summary[-max_chars:] if max_chars else ''
+
+    def record(self, conversation: Conversation, message: str, response: str,
+               context: Optional[List[int]] = None):
+        conversation.messages.append({'role': 'user', 'content': message})
+        conversation.messages.append({'role': 'assistant', 'content': response})
+        # Without a fresh backend context the next turn must re-send the transcript
+        conversation.context = context or None
+        conversation.last_active = time.time()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'active': len(self._conversations),
+                'evicted': self.evicted,
+                'token_budget': self.token_budget
+            }
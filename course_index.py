@@ -0,0 +1,187 @@
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, Any, List, Callable, Iterable, Optional
+
+# Course code prefix -> catalog subject it draws on
+SUBJECT_PREFIXES = {'CS': 'computer science', 'MATH': 'mathematics'}
+
+# Lower sorts first; unknown document types go after the known ones
+DOCUMENT_TYPE_RANK = {'past-paper': 0, 'catalogue': 1, 'brochure': 2}
+LEVELS = ['Beginner', 'Intermediate', 'Advanced']
+
+COURSE_CODE = re.compile(r'\b([A-Za-z]{2,5})\s?(\d{3})\b')
+
+
+def course_prefix(course: str) -> str:
+    match = re.match(r'[A-Za-z]+', course or '')
+    return match.group(0).upper() if match else ''
+
+
+def course_level(course: str) -> Optional[int]:
+    """Expected level index from the course number: 1xx beginner, 2xx intermediate, 3xx+ advanced"""
+    match = re.search(r'(\d)\d\d', course or '')
+    return min(int(match.group(1)), len(LEVELS)) - 1 if match else None
+
+
+def title_course_codes(title: str) -> set:
+    return {f"{letters.upper()}{digits}" for letters, digits in COURSE_CODE.findall(title or '')}
+
+
+class CourseMaterialsIndex:
+    """Course code -> ranked candidate materials for the recommendations page.
+
+    Three tiers, in order: internal materials tagged with the course, records
+    whose title names the course code, then books in the subject behind the
+    code's prefix (CS, MATH, ...). Each course's list is merged once and
+    cached; a catalog change moves only the records it touched and drops the
+    cached lists they appear in.
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[[], list]]):
+        self.loaders = loaders
+        self._records: Dict[str, Dict[Any, Dict[str, Any]]] = {}   # book_type -> id -> record, in file order
+        self._by_course = defaultdict(list)
+        self._by_title_code = defaultdict(list)
+        self._by_subject = defaultdict(list)
+        self._candidates: Dict[str, List[Dict[str, Any]]] = {}
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                for book_type, loader in self.loaders.items():
+                    self._records[book_type] = {record['id']: record for record in loader()}
+                self._rebuild()
+                self._loaded = True
+
+    def warm(self):
+        """Build the index now rather than on the first lookup"""
+        self._ensure_loaded()
+
+    def sync(self, book_type: str, records: Iterable[Dict[str, Any]], changes: Dict[Any, Any] = None):
+        """Apply a saved catalog source.
+
+        changes maps the ids a commit touched to their new record (None when
+        deleted); only those move and records is not read. Without it the
+        course lists are rebuilt from records.
+        """
+        with self._lock:
+            if changes is None:
+                self._records[book_type] = {record['id']: record for record in records}
+                if self._loaded:
+                    self._rebuild()
+                return
+            if not self._loaded:
+                return   # the first lookup reads the loaders, which already hold these changes
+            codes, subjects = set(), set()
+            for item_id, record in changes.items():
+                for name, key in self._apply(book_type, item_id, record):
+                    (subjects if name == '_by_subject' else codes).add(key)
+            for course in list(self._candidates):
+                code = course.upper().replace(' ', '')
+                if code in codes or SUBJECT_PREFIXES.get(course_prefix(code)) in subjects:
+                    del self._candidates[course]
+
+    def _placements(self, book_type: str, record: Dict[str, Any]) -> List[tuple]:
+        """(list attribute, key) pairs the record is listed under"""
+        placements = []
+        if book_type == 'internal':
+            if record.get('course'):
+                placements.append(('_by_course', record['course'].upper()))
+        else:
+            # Only library books and e-books stand in for a course by subject
+            placements.append(('_by_subject', record.get('subject', '').lower()))
+        for code in title_course_codes(record.get('title', '')):
+            placements.append(('_by_title_code', code))
+        return placements
+
+    def _apply(self, book_type: str, item_id, record: Optional[Dict[str, Any]]) -> set:
+        """Swap one record in its lists in place; returns the placements it left or entered"""
+        records = self._records.setdefault(book_type, {})
+        old = records.pop(item_id, None) if record is None else records.get(item_id)
+        if record is not None:
+            records[item_id] = record
+        before = set(self._placements(book_type, old)) if old is not None else set()
+        after = set(self._placements(book_type, record)) if record is not None else set()
+        for name, key in before:
+            mapping = getattr(self, name)
+            listed = mapping[key]
+            position = next(i for i, r in enumerate(listed) if r is old)
+            if (name, key) in after:
+                listed[position] = record
+                if name == '_by_course':
+                    listed.sort(key=lambda r: DOCUMENT_TYPE_RANK.get(r.get('documentType'), len(DOCUMENT_TYPE_RANK)))
+            else:
+                del listed[position]
+                if not listed:
+                    del mapping[key]
+        for name, key in after - before:
+            listed = getattr(self, name)[key]
+            listed.append(record)
+            if name == '_by_course':
+                listed.sort(key=lambda r: DOCUMENT_TYPE_RANK.get(r.get('documentType'), len(DOCUMENT_TYPE_RANK)))
+        return before | after
+
+    def _rebuild(self):
+        by_course, by_title_code, by_subject = defaultdict(list), defaultdict(list), defaultdict(list)
+        lists = {'_by_course': by_course, '_by_title_code': by_title_code, '_by_subject': by_subject}
+        for book_type, records in self._records.items():
+            for record in records.values():
+                for name, key in self._placements(book_type, record):
+                    lists[name][key].append(record)
+        for materials in by_course.values():
+            materials.sort(key=lambda r: DOCUMENT_TYPE_RANK.get(r.get('documentType'), len(DOCUMENT_TYPE_RANK)))
+        self._by_course, self._by_title_code, self._by_subject = by_course, by_title_code, by_subject
+        self._candidates = {}
+
+    def _merge(self, course: str) -> List[Dict[str, Any]]:
+        code = course.upper().replace(' ', '')
+        target = course_level(code)
+
+        def level_fit(record):
+            level = record.get('level')
+            if target is None or level not in LEVELS:
+                return len(LEVELS)
+            return abs(LEVELS.index(level) - target)
+
+        subject = SUBJECT_PREFIXES.get(course_prefix(code))
+        by_subject = sorted(self._by_subject.get(subject, []), key=level_fit) if subject else []
+        merged, seen = [], set()
+        for record in self._by_course.get(code, []) + self._by_title_code.get(code, []) + by_subject:
+            if record['id'] not in seen:
+                seen.add(record['id'])
+                merged.append(record)
+        return merged
+
+    def candidates(self, course: str) -> List[Dict[str, Any]]:
+        self._ensure_loaded()
+        with self._lock:
+            materials = self._candidates.get(course)
+            if materials is None:
+                materials = self._candidates[course] = self._merge(course)
+            return materials
+
+    def best(self, course: str, exclude: set = None, tagged_only: bool = False) -> Optional[Dict[str, Any]]:
+        """Top-ranked material for the course that the user does not already have"""
+        if tagged_only:
+            self._ensure_loaded()
+            materials = self._by_course.get(course.upper().replace(' ', ''), [])
+        else:
+            materials = self.candidates(course)
+        for record in materials:
+            if not exclude or record['id'] not in exclude:
+                return record
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'courses': len(self._by_course),
+                'title_codes': len(self._by_title_code),
+                'subjects': len(self._by_subject),
+                'cached_courses': len(self._candidates)
+            }
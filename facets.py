@@ -0,0 +1,182 @@
+import threading
+from typing import Dict, Any, List, Callable, Iterable, Optional
+
+FACETS = ['bookType', 'subject', 'level', 'author', 'year', 'availability']
+
+try:
+    _popcount = int.bit_count
+except AttributeError:   # Python < 3.10
+    def _popcount(bits: int) -> int:
+        return bin(bits).count('1')
+
+
+def facet_values(book_type: str, record: Dict[str, Any]) -> Dict[str, str]:
+    """The value a record takes for each facet; facets it has no value for are left out"""
+    values = {'bookType': book_type}
+    for facet in ('subject', 'level', 'author', 'year'):
+        value = record.get(facet)
+        if value not in (None, ''):
+            values[facet] = str(value)
+    if book_type == 'physical':
+        available = record.get('availableCopies', 0) > 0 and record.get('status') != 'unavailable'
+        values['availability'] = 'Available' if available else 'On loan'
+    else:
+        values['availability'] = 'Online'
+    return values
+
+
+class FacetIndex:
+    """Bitset posting lists per facet value over the whole catalog.
+
+    Every record owns a row; each (facet, value) keeps a Python int whose set
+    bits are the rows having that value. A query ANDs the OR of the selected
+    values per facet, and counts for each facet are taken against the other
+    facets' selections only, so a selected value never hides its siblings.
+    A borrow or return flips one record's availability bits and nothing else.
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[[], list]]):
+        self.loaders = loaders
+        self._postings: Dict[str, Dict[str, int]] = {facet: {} for facet in FACETS}
+        self._rows: Dict[Any, int] = {}          # record id -> row
+        self._ids: List[Any] = []                # row -> record id, None when free
+        self._values: Dict[Any, Dict[str, str]] = {}
+        self._types: Dict[Any, str] = {}
+        self._free: List[int] = []
+        self._all = 0                            # rows currently holding a record
+        self._loaded = False
+        self._lock = threading.RLock()
+        self.updates = 0
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                for book_type, loader in self.loaders.items():
+                    self.sync(book_type, loader())
+                self._loaded = True
+
+    def warm(self):
+        """Build the index now rather than on the first lookup"""
+        self._ensure_loaded()
+
+    def sync(self, book_type: str, records: Iterable[Dict[str, Any]], changes: Dict[Any, Any] = None):
+        """Apply a saved catalog file; only records whose facet values changed touch the bitsets.
+
+        changes, when given, maps the ids a commit touched to their new record
+        (None when deleted) and only those are looked at; records is not read.
+        """
+        with self._lock:
+            if changes is not None:
+                for item_id, record in changes.items():
+                    self._update(item_id, book_type, record)
+                return
+            seen = set()
+            for record in records:
+                seen.add(record['id'])
+                self._update(record['id'], book_type, record)
+            for item_id in [i for i, t in self._types.items() if t == book_type and i not in seen]:
+                self._update(item_id, book_type, None)
+
+    def _update(self, item_id, book_type: str, record: Optional[Dict[str, Any]]):
+        if record is None:
+            self._set(item_id, None)
+            self._types.pop(item_id, None)
+            return
+        values = facet_values(book_type, record)
+        if self._values.get(item_id) != values:
+            self._set(item_id, values)
+            self._types[item_id] = book_type
+
+    def _set(self, item_id, values: Optional[Dict[str, str]]):
+        row = self._rows.get(item_id)
+        if row is None:
+            if values is None:
+                return
+            row = self._free.pop() if self._free else len(self._ids)
+            if row == len(self._ids):
+                self._ids.append(item_id)
+            else:
+                self._ids[row] = item_id
+            self._rows[item_id] = row
+        bit = 1 << row
+        old = self._values.get(item_id, {})
+        new = values or {}
+        for facet in FACETS:
+            if old.get(facet) == new.get(facet):
+                continue
+            postings = self._postings[facet]
+            if facet in old:
+                remaining = postings[old[facet]] & ~bit
+                if remaining:
+                    postings[old[facet]] = remaining
+                else:
+                    del postings[old[facet]]
+            if facet in new:
+                postings[new[facet]] = postings.get(new[facet], 0) | bit
+        self.updates += 1
+        if values is None:
+            self._all &= ~bit
+            self._values.pop(item_id, None)
+            del self._rows[item_id]
+            self._ids[row] = None
+            self._free.append(row)
+        else:
+            self._all |= bit
+            self._values[item_id] = values
+
+    def _selection(self, facet: str, selected: List[str]) -> Optional[int]:
+        """Rows matching any of the selected values, or None when the facet is unfiltered"""
+        if not selected:
+            return None
+        bits = 0
+        for value in selected:
+            bits |= self._postings[facet].get(value, 0)
+        return bits
+
+    def query(self, filters: Dict[str, List[str]], limit: int = 1000, offset: int = 0,
+              max_values: int = 20) -> Dict[str, Any]:
+        """Matching record ids plus per-value counts for every facet under the other filters"""
+        self._ensure_loaded()
+        with self._lock:
+            everything = self._all
+            selections = {facet: self._selection(facet, filters.get(facet) or []) for facet in FACETS}
+
+            matched = everything
+            for bits in selections.values():
+                if bits is not None:
+                    matched &= bits
+
+            counts = {}
+            for facet in FACETS:
+                others = everything
+                for other, bits in selections.items():
+                    if other != facet and bits is not None:
+                        others &= bits
+                values = [{'value': value, 'count': _popcount(posting & others),
+                           'selected': value in (filters.get(facet) or [])}
+                          for value, posting in self._postings[facet].items()]
+                ranked = sorted((v for v in values if v['count'] or v['selected']),
+                                key=lambda v: (-v['count'], v['value']))
+                # Long tails (authors) are cut, but a selected value always stays listed
+                counts[facet] = [v for i, v in enumerate(ranked) if i < max_values or v['selected']]
+
+            ids = []
+            position, bits = 0, matched
+            while bits and len(ids) < limit:
+                low = bits & -bits
+                if position >= offset:
+                    ids.append(self._ids[low.bit_length() - 1])
+                position += 1
+                bits ^= low
+
+            return {'total': _popcount(matched), 'ids': ids, 'facets': counts}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'records': len(self._rows),
+                'values': {facet: len(postings) for facet, postings in self._postings.items()},
+                'updates': self.updates
+            }
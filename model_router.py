@@ -0,0 +1,208 @@
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+from conversations import estimate_tokens
+
+# Words that usually mean the student wants reasoning rather than a quick lookup
+COMPLEX_HINTS = re.compile(
+    r'\b(explain|why|compare|difference|derive|prove|analy[sz]e|step by step|design|'
+    r'implement|code|algorithm|complexity|summari[sz]e|essay)\b',
+    re.IGNORECASE
+)
+
+COMPLEXITY_CLASSES = ['simple', 'standard', 'complex']
+
+# /api/tags lists embedding models next to the chat models; a family named after one
+# of these (bert, nomic-bert, xlm-roberta, ...) only embeds
+EMBEDDING_FAMILIES = ('bert',)
+
+
+def parse_parameter_size(name: str, details: Dict[str, Any] = None) -> float:
+    """Model size in billions of parameters, from the tag details or the model name"""
+    text = (details or {}).get('parameter_size') or name.split(':')[-1]
+    match = re.search(r'(\d+(?:\.\d+)?)\s*([bm])\b', text.lower())
+    if not match:
+        return 0.0
+    value = float(match.group(1))
+    return value / 1000 if match.group(2) == 'm' else value
+
+
+def model_base_name(name: str) -> str:
+    """'nomic-embed-text:latest' -> 'nomic-embed-text'"""
+    return name.split(':')[0]
+
+
+def model_tag(name: str) -> str:
+    """'llama3' -> 'llama3:latest', the tag Ollama resolves an untagged name to"""
+    return name if ':' in name else f'{name}:latest'
+
+
+def is_embedding_model(model: Dict[str, Any], embedding_models=()) -> bool:
+    """True for a tag entry that can embed but not chat, e.g. the semantic search model"""
+    if model_base_name(model['name']) in {model_base_name(name) for name in embedding_models}:
+        return True
+    details = model.get('details') or {}
+    families = set(details.get('families') or []) | ({details['family']} if details.get('family') else set())
+    return any(marker in family for family in families for marker in EMBEDDING_FAMILIES)
+
+
+class ModelStats:
+    def __init__(self, name: str, size: float):
+        self.name = name
+        self.size = size
+        self.latencies = deque(maxlen=50)   # (finished_at, seconds)
+        self.inflight = 0
+        self.requests = 0
+        self.fallbacks = 0
+
+    def p50(self, window: float = 300.0) -> Optional[float]:
+        # Only recent samples count, so a model that was slow earlier can be tried again
+        cutoff = time.time() - window
+        ordered = sorted(seconds for finished_at, seconds in self.latencies if finished_at >= cutoff)
+        if not ordered:
+            return None
+        return ordered[len(ordered) // 2]
+
+    def to_dict(self) -> Dict[str, Any]:
+        p50 = self.p50()
+        return {
+            'name': self.name,
+            'size_b': self.size,
+            'inflight': self.inflight,
+            'requests': self.requests,
+            'fallbacks': self.fallbacks,
+            'p50_latency': round(p50, 3) if p50 is not None else None
+        }
+
+
+class ModelRouter:
+    """Send each prompt to the cheapest installed model that suits it.
+
+    Models are ranked by parameter count. A prompt's complexity class picks the
+    smallest acceptable tier; if that model is saturated (too many requests in
+    flight or rolling p50 latency over the SLO) the router falls back to a
+    smaller model rather than queueing behind the large one.
+    """
+
+    def __init__(self, default_model: str, max_inflight: int = 4, latency_slo: float = 15.0,
+                 short_prompt_tokens: int = 60, long_prompt_tokens: int = 400, embedding_models=()):
+        self.default_model = default_model
+        self.embedding_models = list(embedding_models)
+        self.max_inflight = max_inflight
+        self.latency_slo = latency_slo
+        self.short_prompt_tokens = short_prompt_tokens
+        self.long_prompt_tokens = long_prompt_tokens
+        self._models: Dict[str, ModelStats] = {}
+        self._lock = threading.Lock()
+        self.set_models([{'name': default_model}])
+
+    def set_models(self, models: List[Dict[str, Any]]):
+        """Replace the model list with what the server reports, keeping known stats.
+
+        Embedding models are left out: they cannot answer a chat prompt, and
+        being the smallest listed they would otherwise win every simple one.
+        """
+        with self._lock:
+            discovered = {}
+            for model in models:
+                if is_embedding_model(model, self.embedding_models):
+                    continue
+                name = model['name']
+                stats = self._models.get(name) or ModelStats(name, parse_parameter_size(name, model.get('details')))
+                discovered[name] = stats
+            if discovered:
+                self._models = discovered
+
+    def model_names(self) -> List[str]:
+        with self._lock:
+            return [m.name for m in self._ranked()]
+
+    def _ranked(self) -> List[ModelStats]:
+        return sorted(self._models.values(), key=lambda m: (m.size, m.name))
+
+    def _installed(self, name: str) -> Optional[str]:
+        """Installed tag for a model name, so 'llama3' finds 'llama3:latest' and back"""
+        if name in self._models:
+            return name
+        # An untagged name means the default tag, the way 'ollama run' reads it
+        for installed in self._models:
+            if model_tag(installed) == model_tag(name):
+                return installed
+        if ':' not in name:
+            # Any installed size of the family beats ignoring the request
+            same_family = sorted(m for m in self._models if model_base_name(m) == model_base_name(name))
+            if same_family:
+                return same_family[0]
+        return None
+
+    def warmup_model(self) -> str:
+        """Model to load in the REPL: the configured default if installed, else the smallest"""
+        with self._lock:
+            installed = self._installed(self.default_model)
+            if installed:
+                return installed
+            ranked = self._ranked()
+            return ranked[0].name if ranked else self.default_model
+
+    def classify(self, message: str, prompt_tokens: int) -> str:
+        # Complexity comes from the question itself; grounding only counts towards length
+        complex_hint = bool(COMPLEX_HINTS.search(message))
+        message_tokens = estimate_tokens(message)
+        if prompt_tokens > self.long_prompt_tokens or (complex_hint and message_tokens > self.short_prompt_tokens):
+            return 'complex'
+        if complex_hint or message_tokens > self.short_prompt_tokens:
+            return 'standard'
+        return 'simple'
+
+    def _saturated(self, stats: ModelStats) -> bool:
+        if stats.inflight >= self.max_inflight:
+            return True
+        p50 = stats.p50()
+        return p50 is not None and p50 > self.latency_slo
+
+    def choose(self, message: str, prompt: str = None, requested: str = None) -> str:
+        with self._lock:
+            installed = self._installed(requested) if requested else None
+            if installed:
+                return installed
+            ranked = self._ranked()
+            if not ranked:
+                return self.default_model
+
+            complexity = self.classify(message, estimate_tokens(prompt or message))
+            # Spread the complexity classes over the available size tiers
+            tier = COMPLEXITY_CLASSES.index(complexity) * (len(ranked) - 1) // (len(COMPLEXITY_CLASSES) - 1)
+            for index in range(tier, -1, -1):
+                if not self._saturated(ranked[index]):
+                    if index != tier:
+                        ranked[tier].fallbacks += 1
+                    return ranked[index].name
+            # Everything is busy; queue on the smallest model since it drains fastest
+            return ranked[0].name
+
+    @contextmanager
+    def track(self, model: str):
+        with self._lock:
+            stats = self._models.get(model)
+            if stats is None:
+                stats = self._models[model] = ModelStats(model, parse_parameter_size(model))
+            stats.inflight += 1
+            stats.requests += 1
+        start = time.time()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            with self._lock:
+                stats.inflight -= 1
+                if ok:
+                    stats.latencies.append((time.time(), time.time() - start))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [m.to_dict() for m in self._ranked()]
@@ -1,17 +1,101 @@
-import paramiko
+import hashlib
+import json
 import os
 import re
+import random
+import threading
 import time
-from typing import Dict, Any
+from typing import Dict, Any, List
+
+from ollama_config import (
+    KEEPALIVE_INTERVAL,
+    HEALTH_CHECK_INTERVAL,
+    MODEL_LOAD_TIMEOUT,
+    RECONNECT_BACKOFF_INITIAL,
+    RECONNECT_BACKOFF_MAX,
+    CHAT_CACHE_MAX_ENTRIES,
+    CHAT_CACHE_MAX_BYTES,
+    CHAT_CACHE_TTL,
+    CHAT_FAQ_FILE,
+    CHAT_TIMEOUT,
+    CHAT_TRANSPORT,
+    EMBEDDING_MODEL,
+    EMBEDDING_TIMEOUT,
+    CONVERSATION_TOKEN_BUDGET,
+    CONVERSATION_IDLE_TIMEOUT,
+    MAX_CONVERSATIONS,
+    OLLAMA_HOST,
+    OLLAMA_PORT,
+    ROUTER_MAX_INFLIGHT,
+    ROUTER_LATENCY_SLO,
+    ROUTER_SHORT_PROMPT_TOKENS,
+    ROUTER_LONG_PROMPT_TOKENS,
+)
+from cache_store import get_cache
+from chat_cache import ChatResponseCache
+from conversations import ConversationStore
+from model_router import ModelRouter
 
 # SSH Configuration with private key from temp/app_ssh_key.py
+# (host, port and user can be overridden, e.g. to point at tools/fake_ollama.py)
 SSH_CONFIG = {
-    'hostname': "gateway.cs.cityu.edu.hk",
-    'username': "mavislong2",
+    'hostname': os.environ.get('OLLAMA_SSH_HOST', "gateway.cs.cityu.edu.hk"),
+    'port': int(os.environ.get('OLLAMA_SSH_PORT', 22)),
+    'username': os.environ.get('OLLAMA_SSH_USER', "mavislong2"),
     'private_key_path': "./pw/privatekey.txt",
     'passphrase': "mmducmeh"
 }
 
+# Preferred model; used for the `ollama run` session when it is installed
+OLLAMA_MODEL = 'llama3'
+
+# Connection states reported to the UI through get_status()
+STATE_DISCONNECTED = 'disconnected'
+STATE_CONNECTING = 'connecting'
+STATE_READY = 'ready'
+STATE_RECONNECTING = 'reconnecting'
+STATE_FAILED = 'failed'
+
+# Parsed private keys, keyed by (path, mtime) so an edited key file is re-read
+_private_key_cache = {}
+_private_key_lock = threading.Lock()
+
+
+def load_private_key(private_key_path: str, passphrase: str = None):
+    """Parse the SSH private key once and reuse it for every (re)connect"""
+    mtime = os.path.getmtime(private_key_path)
+    cache_key = (private_key_path, mtime)
+    with _private_key_lock:
+        if cache_key in _private_key_cache:
+            return _private_key_cache[cache_key]
+
+        import paramiko
+
+        print(f"Loading private key from: {private_key_path}")
+        private_key = None
+        key_types = [
+            (paramiko.RSAKey, "RSA"),
+            (paramiko.Ed25519Key, "Ed25519"),
+            (paramiko.ECDSAKey, "ECDSA")
+        ]
+
+        for key_class, key_type in key_types:
+            try:
+                private_key = key_class.from_private_key_file(private_key_path, password=passphrase)
+                print(f"Successfully loaded {key_type} key")
+                break
+            except Exception as e:
+                print(f"Failed to load as {key_type} key: {e}")
+                continue
+
+        if not private_key:
+            raise Exception(f"Could not load private key from {private_key_path}")
+
+        _private_key_cache.clear()
+        _private_key_cache[cache_key] = private_key
+        return private_key
+
+
 class OllamaSSHClient:
     def __init__(self):
         self.ssh = None
@@ -21,75 +105,203 @@ class OllamaSSHClient:
         self.ssh_host = SSH_CONFIG['hostname']
         self.ollama_host = 'localhost'
 
+        # Background supervisor state
+        self.state = STATE_DISCONNECTED
+        self.last_error = None
+        self.reconnect_attempts = 0
+        self.next_retry_at = None
+        self._shell_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._supervisor = None
+
+        # Repeated questions are answered from here instead of the model,
+        # by whichever worker or node generated the answer first when the cache is shared
+        self.response_cache = ChatResponseCache(get_cache().namespace(
+            'chat',
+            CHAT_CACHE_TTL,
+            max_entries=CHAT_CACHE_MAX_ENTRIES,
+            max_bytes=CHAT_CACHE_MAX_BYTES
+        ))
+        self.response_cache.load_faq(CHAT_FAQ_FILE)
+
+        # Each browser session gets its own history instead of sharing the REPL's context
+        self.transport = CHAT_TRANSPORT
+        self.conversations = ConversationStore(
+            token_budget=CONVERSATION_TOKEN_BUDGET,
+            idle_timeout=CONVERSATION_IDLE_TIMEOUT,
+            max_conversations=MAX_CONVERSATIONS
+        )
+
+        # Model list is refreshed from the server on every (re)connect
+        self.router = ModelRouter(
+            OLLAMA_MODEL,
+            max_inflight=ROUTER_MAX_INFLIGHT,
+            latency_slo=ROUTER_LATENCY_SLO,
+            short_prompt_tokens=ROUTER_SHORT_PROMPT_TOKENS,
+            long_prompt_tokens=ROUTER_LONG_PROMPT_TOKENS,
+            embedding_models=[EMBEDDING_MODEL]
+        )
+        self.repl_model = OLLAMA_MODEL
+
+    def start_background(self) -> Dict[str, Any]:
+        """Connect and load the model on a background thread, then keep the connection healthy"""
+        with self._state_lock:
+            self._stop.clear()
+            if self._supervisor and self._supervisor.is_alive():
+                self._wake.set()
+                return self.get_status()
+            if not self.is_connected:
+                self.state = STATE_CONNECTING
+            self._supervisor = threading.Thread(target=self._supervise, name='ollama-supervisor', daemon=True)
+            self._supervisor.start()
+        return self.get_status()
+
+    def _connect_on_demand(self):
+        """Start connecting on first use when nothing started the client; a deliberate disconnect stands"""
+        if self._supervisor is None and not self.is_connected:
+            self.start_background()
+
     def connect(self) -> Dict[str, Any]:
-        try:
-            print("Connecting to SSH with private key...")
-            self.ssh = paramiko.SSHClient()
-            self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-            private_key_path = os.path.expanduser(SSH_CONFIG['private_key_path'])
-            passphrase = SSH_CONFIG.get('passphrase')
-
-            if passphrase == "your_passphrase_here" or not passphrase:
-                passphrase = None
-
-            print(f"Loading private key from: {private_key_path}")
-            
-            private_key = None
-            key_types = [
-                (paramiko.RSAKey, "RSA"),
-                (paramiko.Ed25519Key, "Ed25519"),
-                (paramiko.ECDSAKey, "ECDSA")
-            ]
-            
-            for key_class, key_type in key_types:
-                try:
-                    private_key = key_class.from_private_key_file(private_key_path, password=passphrase)
-                    print(f"Successfully loaded {key_type} key")
+        """Request a connection; returns immediately so the UI can poll get_status()"""
+        if self.is_connected and self.ollama_ready:
+            return {'success': True, 'state': self.state, 'message': 'Connected to ollama successfully using private key!'}
+        status = self.start_background()
+        return {'success': True, 'state': status['state'], 'message': 'Connecting to Ollama in the background...'}
+
+    def _supervise(self):
+        delay = RECONNECT_BACKOFF_INITIAL
+        while not self._stop.is_set():
+            if not self._is_healthy():
+                if self.is_connected:
+                    print("Ollama connection lost, reconnecting...")
+                    self._close_connection()
+                    self.state = STATE_RECONNECTING
+
+                if self.reconnect_attempts:
+                    self.state = STATE_RECONNECTING
+                result = self._open_connection()
+                if self._stop.is_set():
+                    # disconnect() was requested while we were connecting
+                    self._close_connection()
+                    self.state = STATE_DISCONNECTED
                     break
-                except Exception as e:
-                    print(f"Failed to load as {key_type} key: {e}")
+                if result['success']:
+                    delay = RECONNECT_BACKOFF_INITIAL
+                    self.reconnect_attempts = 0
+                    self.next_retry_at = None
+                else:
+                    # Exponential backoff with jitter so workers do not retry in lockstep
+                    self.reconnect_attempts += 1
+                    self.last_error = result['message']
+                    self.state = STATE_FAILED
+                    wait = delay + random.uniform(0, delay / 2)
+                    self.next_retry_at = time.time() + wait
+                    print(f"Reconnect attempt {self.reconnect_attempts} failed, retrying in {wait:.1f}s")
+                    delay = min(delay * 2, RECONNECT_BACKOFF_MAX)
+                    self._wake.wait(wait)
+                    self._wake.clear()
                     continue
-            
-            if not private_key:
-                try:
-                    print("Trying generic key loading...")
-                    private_key = paramiko.RSAKey.from_private_key_file(private_key_path, password=passphrase)
-                    print("Successfully loaded key with generic RSA loader")
-                except Exception as e:
-                    print(f"Generic key loading failed: {e}")
-                    raise Exception(f"Could not load private key from {private_key_path}. Error: {e}")
-
-            self.ssh.connect(
-                hostname=SSH_CONFIG['hostname'],
-                username=SSH_CONFIG['username'],
-                pkey=private_key,
-                timeout=15
-            )
 
-            print("SSH connection established with private key")
-            self.shell = self.ssh.invoke_shell()
-            self.shell.settimeout(2.0)
-            time.sleep(2)
-            self._clear_buffer()
+            self._wake.wait(HEALTH_CHECK_INTERVAL)
+            self._wake.clear()
 
-            print("Starting ollama...")
-            if self.shell:
-                self.shell.send(b'ollama run llama3\n')
+    def _is_healthy(self) -> bool:
+        if not self.is_connected or not self.ssh or not self.shell:
+            return False
+        try:
+            transport = self.ssh.get_transport()
+            if transport is None or not transport.is_active():
+                return False
+            if self.shell.closed or self.shell.exit_status_ready():
+                return False
+            # SSH-level probe that does not touch the ollama prompt
+            transport.send_ignore()
+            return True
+        except Exception as e:
+            print(f"Health probe failed: {e}")
+            return False
 
-            if self._wait_for_ollama_ready():
-                self.is_connected = True
-                self.ollama_ready = True
-                print("Ollama ready!")
-                return {'success': True, 'message': 'Connected to ollama successfully using private key!'}
-            else:
-                print("Ollama failed to start")
-                self.disconnect()
-                return {'success': False, 'message': 'Ollama failed to start'}
+    def _open_connection(self) -> Dict[str, Any]:
+        with self._shell_lock:
+            try:
+                # paramiko brings in the whole cryptography stack; only processes that chat pay
+                # for it, and a missing install is a failed attempt rather than a dead supervisor
+                import paramiko
+
+                print("Connecting to SSH with private key...")
+                self.ssh = paramiko.SSHClient()
+                self.ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+
+                private_key_path = os.path.expanduser(SSH_CONFIG['private_key_path'])
+                passphrase = SSH_CONFIG.get('passphrase')
+
+                if passphrase == "your_passphrase_here" or not passphrase:
+                    passphrase = None
 
+                private_key = load_private_key(private_key_path, passphrase)
+
+                self.ssh.connect(
+                    hostname=SSH_CONFIG['hostname'],
+                    port=SSH_CONFIG['port'],
+                    username=SSH_CONFIG['username'],
+                    pkey=private_key,
+                    timeout=15
+                )
+                self.ssh.get_transport().set_keepalive(KEEPALIVE_INTERVAL)
+
+                print("SSH connection established with private key")
+                self.shell = self.ssh.invoke_shell()
+                self.shell.settimeout(2.0)
+                self._wait_for_quiet()
+
+                self._discover_models()
+                self.repl_model = self.router.warmup_model()
+
+                print(f"Starting ollama with {self.repl_model}...")
+                if self.shell:
+                    self.shell.send(f'ollama run {self.repl_model}\n'.encode('utf-8'))
+
+                if self._wait_for_ollama_ready(timeout=MODEL_LOAD_TIMEOUT):
+                    self.is_connected = True
+                    self.ollama_ready = True
+                    self.state = STATE_READY
+                    self.last_error = None
+                    print("Ollama ready!")
+                    return {'success': True, 'message': 'Connected to ollama successfully using private key!'}
+                else:
+                    print("Ollama failed to start")
+                    self._close_connection()
+                    return {'success': False, 'message': 'Ollama failed to start'}
+
+            except Exception as e:
+                print(f"Connection error: {e}")
+                self._close_connection()
+                return {'success': False, 'message': f'Connection error: {e}'}
+
+    def _discover_models(self):
+        try:
+            data = self._api_request('GET', '/api/tags', timeout=5)
+            models = data.get('models', [])
+            if models:
+                self.router.set_models(models)
+                print(f"Discovered models: {', '.join(self.router.model_names())}")
         except Exception as e:
-            print(f"Connection error: {e}")
-            return {'success': False, 'message': f'Connection error: {e}'}
+            print(f"Model discovery failed, keeping {self.router.model_names()}: {e}")
+
+    def _wait_for_quiet(self, quiet=0.3, timeout=2.0):
+        # Drain the login banner and shell prompt instead of sleeping a fixed time
+        start_time = time.time()
+        last_activity = None
+        while time.time() - start_time < timeout:
+            if self.shell and self.shell.recv_ready():
+                self.shell.recv(1024)
+                last_activity = time.time()
+            elif last_activity and time.time() - last_activity > quiet:
+                return
+            else:
+                time.sleep(0.05)
 
     def _clear_buffer(self):
         try:
@@ -113,27 +325,174 @@ class OllamaSSHClient:
                         print(f"Ollama error detected: {buffer}")
                         return False
                 else:
-                    time.sleep(0.5)
+                    time.sleep(0.1)
             except Exception as e:
                 print(f"Error waiting for ollama: {e}")
                 return False
         print("Timeout waiting for ollama to be ready")
         return False
 
-    def chat(self, message: str, model: str = None) -> Dict[str, Any]:
+    def chat(self, message: str, model: str = None, session_id: str = None,
+             prompt: str = None) -> Dict[str, Any]:
+        """Answer ``message``; ``prompt`` is the full text to send when it differs (e.g. grounded)"""
+        self._connect_on_demand()
+        prompt = prompt or message
+        variant = hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:12] if prompt != message else ''
+        if self.transport != 'api':
+            # The REPL only ever runs the model it was started with
+            model = self.repl_model
+            return self.response_cache.get_or_generate(
+                message, model, lambda: self._generate(prompt, model), variant
+            )
+
+        model = self.router.choose(message, prompt, requested=model)
+        if not session_id:
+            return self.response_cache.get_or_generate(
+                message, model, lambda: self._generate_api(model, {'prompt': prompt}), variant
+            )
+
+        conversation = self.conversations.get(session_id)
+        with conversation.lock:
+            request = self.conversations.build_request(conversation, prompt)
+            generate = lambda: self._generate_api(model, request)
+            if conversation.messages or conversation.summary:
+                # Follow-ups depend on this user's transcript, so they bypass the shared cache
+                result = generate()
+            else:
+                result = self.response_cache.get_or_generate(message, model, generate, variant)
+
+            # Only the generation that actually ran holds a context for this conversation
+            context = result.pop('context', None)
+            if result.get('cache') not in (None, 'miss'):
+                context = None
+            if result.get('success'):
+                self.conversations.record(conversation, message, result['response'], context)
+            return result
+
+    def complete(self, prompt: str, model: str = None) -> Dict[str, Any]:
+        """One-off generation for batch jobs; skips the response cache and conversations"""
+        self._connect_on_demand()
+        if self.transport != 'api':
+            return self._generate(prompt, self.repl_model)
+        model = self.router.choose(prompt, requested=model)
+        result = self._generate_api(model, {'prompt': prompt})
+        result.pop('context', None)
+        return result
+
+    def embed(self, texts: List[str], model: str = EMBEDDING_MODEL) -> Dict[str, Any]:
+        """Embedding vectors for a batch of texts; always goes over the HTTP API"""
+        self._connect_on_demand()
+        if not self.is_connected or not self.ssh:
+            return self._not_ready_result()
+        try:
+            data = self._api_request('POST', '/api/embed', {'model': model, 'input': texts},
+                                     timeout=EMBEDDING_TIMEOUT)
+        except Exception as e:
+            print(f"Error calling Ollama embed API: {e}")
+            self._wake.set()
+            return {'success': False, 'message': f"Error embedding text: {e}"}
+        if data.get('error'):
+            return {'success': False, 'message': data['error']}
+        embeddings = data.get('embeddings') or []
+        if len(embeddings) != len(texts):
+            return {'success': False, 'message': 'Ollama returned the wrong number of embeddings'}
+        return {'success': True, 'embeddings': embeddings, 'model': model}
+
+    def _not_ready_result(self) -> Dict[str, Any]:
+        if self.state in (STATE_CONNECTING, STATE_RECONNECTING):
+            return {'success': False, 'state': self.state, 'message': 'Ollama is still connecting, please try again shortly.'}
+        return {'success': False, 'state': self.state, 'message': 'Not connected to Ollama. Please connect first.'}
+
+    def _generate_api(self, model: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        if not self.is_connected or not self.ssh or not self.ollama_ready:
+            return self._not_ready_result()
+        payload = dict(request, model=model, stream=False)
+        try:
+            with self.router.track(model):
+                data = self._api_request('POST', '/api/generate', payload)
+        except Exception as e:
+            print(f"Error calling Ollama API: {e}")
+            self._wake.set()
+            return {'success': False, 'message': f"Error sending message: {e}"}
+        if data.get('error'):
+            return {'success': False, 'message': data['error']}
+        return {'success': True, 'response': data.get('response', '').strip(), 'context': data.get('context'), 'model': model}
+
+    def _api_request(self, method: str, path: str, payload: Dict[str, Any] = None,
+                     timeout: float = CHAT_TIMEOUT) -> Dict[str, Any]:
+        """Send one HTTP request to the remote Ollama API through an SSH direct-tcpip channel"""
+        transport = self.ssh.get_transport() if self.ssh else None
+        if transport is None or not transport.is_active():
+            raise ConnectionError('SSH transport is not active')
+
+        channel = transport.open_channel('direct-tcpip', (OLLAMA_HOST, OLLAMA_PORT), ('127.0.0.1', 0), timeout=timeout)
+        try:
+            channel.settimeout(timeout)
+            body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+            head = (
+                f"{method} {path} HTTP/1.1\r\n"
+                f"Host: {OLLAMA_HOST}:{OLLAMA_PORT}\r\n"
+                "Content-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            )
+            channel.sendall(head.encode('ascii') + body)
+
+            raw = b''
+            while True:
+                chunk = channel.recv(65536)
+                if not chunk:
+                    break
+                raw += chunk
+        finally:
+            channel.close()
+
+        header_blob, _, content = raw.partition(b'\r\n\r\n')
+        header_lines = header_blob.decode('iso-8859-1').split('\r\n')
+        status_code = int(header_lines[0].split()[1])
+        headers = {}
+        for line in header_lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            content = self._decode_chunked(content)
+
+        data = json.loads(content.decode('utf-8')) if content else {}
+        if status_code >= 400 and not data.get('error'):
+            data['error'] = f'Ollama API returned HTTP {status_code}'
+        return data
+
+    def _decode_chunked(self, content: bytes) -> bytes:
+        decoded = b''
+        while content:
+            size_line, _, content = content.partition(b'\r\n')
+            size = int(size_line.split(b';')[0], 16)
+            if size == 0:
+                break
+            decoded += content[:size]
+            content = content[size + 2:]
+        return decoded
+
+    def _generate(self, message: str, model: str = None) -> Dict[str, Any]:
         if not self.is_connected or not self.shell or not self.ollama_ready:
-            return {'success': False, 'message': 'Not connected to Ollama. Please connect first.'}
+            return self._not_ready_result()
         try:
-            print(f"Sending message: {message}")
-            self._clear_buffer()
-            if self.shell:
-                self.shell.send((message + '\n').encode('utf-8'))
-            response = self._collect_response(message)
+            # The REPL is a single shared terminal, so only one prompt may be in flight
+            # Each newline submits a separate prompt in the REPL, so send one line
+            message = ' '.join(message.splitlines())
+            with self._shell_lock:
+                print(f"Sending message: {message}")
+                self._clear_buffer()
+                if self.shell:
+                    self.shell.send((message + '\n').encode('utf-8'))
+                response = self._collect_response(message)
             if response and isinstance(response, str) and "error" in response.lower():
                  return {'success': False, 'response': response}
             return {'success': True, 'response': response}
         except Exception as e:
             print(f"Error sending message: {e}")
+            # Let the supervisor notice the broken connection right away
+            self._wake.set()
             return {'success': False, 'message': f"Error sending message: {e}"}
 
     def _collect_response(self, original_message: str, timeout=45):
@@ -171,12 +530,12 @@ class OllamaSSHClient:
         # Remove the echoed prompt from the beginning
         if text.strip().startswith(prompt.strip()):
             text = text.strip()[len(prompt.strip()):]
-        
+
         # Remove the trailing '>>> Send a message'
         end_marker = '>>> Send a message'
         if end_marker in text:
             text = text.split(end_marker)[0]
-            
+
         # Also handle just '>>>'
         end_marker_2 = '>>>'
         if text.strip().endswith(end_marker_2):
@@ -184,25 +543,55 @@ class OllamaSSHClient:
 
         return text.strip()
 
-    def disconnect(self) -> Dict[str, Any]:
-        print("Disconnecting...")
+    def _close_connection(self):
         self.is_connected = False
         self.ollama_ready = False
         try:
             if self.shell:
-                self.shell.send(b'/bye\n')
-                time.sleep(1)
                 self.shell.close()
             if self.ssh:
                 self.ssh.close()
+        except Exception as e:
+            print(f"Error closing connection: {e}")
+        self.shell = None
+        self.ssh = None
+
+    def disconnect(self) -> Dict[str, Any]:
+        print("Disconnecting...")
+        # Stop the supervisor first so it does not reconnect behind our back
+        self._stop.set()
+        self._wake.set()
+        self.is_connected = False
+        self.ollama_ready = False
+        self.state = STATE_DISCONNECTED
+        try:
+            with self._shell_lock:
+                if self.shell:
+                    self.shell.send(b'/bye\n')
+                    time.sleep(1)
+                    self.shell.close()
+                if self.ssh:
+                    self.ssh.close()
+                self.shell = None
+                self.ssh = None
             return {'success': True, 'message': 'Disconnected successfully'}
         except Exception as e:
             print(f"Error during disconnect: {e}")
             return {'success': False, 'message': f'Error during disconnect: {e}'}
 
     def get_status(self) -> Dict[str, Any]:
+        retry_in = None
+        if self.next_retry_at:
+            retry_in = max(0, round(self.next_retry_at - time.time(), 1))
         return {
             'connected': self.is_connected,
+            'state': self.state,
+            'last_error': self.last_error,
+            'reconnect_attempts': self.reconnect_attempts,
+            'retry_in': retry_in,
+            'transport': self.transport,
+            'cache': self.response_cache.stats(),
+            'conversations': self.conversations.stats(),
             'ssh_host': self.ssh_host,
             'ollama_host': self.ollama_host
         }
@@ -210,6 +599,22 @@ class OllamaSSHClient:
     def get_available_models(self) -> Dict[str, Any]:
         if not self.is_connected:
             return {'success': False, 'message': 'Not connected to Ollama'}
-        return {'success': True, 'models': ['llama3']}
+        return {
+            'success': True,
+            'models': self.router.model_names(),
+            'default': self.repl_model,
+            'stats': self.router.stats()
+        }
+
+_client = None
+_client_lock = threading.Lock()
+
 
-ollama_client = OllamaSSHClient()
\ No newline at end of file
+def get_ollama_client() -> OllamaSSHClient:
+    """The process-wide client, built on first use so importing this module stays cheap"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OllamaSSHClient()
+    return _client
@@ -20,4 +20,34 @@ CONNECTION_TIMEOUT = 10  # seconds
 
 # Chat Settings
 CHAT_TIMEOUT = 30  # seconds for chat responses
-MAX_MESSAGE_LENGTH = 1000  # characters
\ No newline at end of file
+MAX_MESSAGE_LENGTH = 1000  # characters
+
+# Connection Supervisor Settings
+KEEPALIVE_INTERVAL = 30          # seconds between SSH keepalive packets
+HEALTH_CHECK_INTERVAL = 15       # seconds between connection health probes
+MODEL_LOAD_TIMEOUT = 20          # seconds to wait for `ollama run` to become ready
+RECONNECT_BACKOFF_INITIAL = 1    # first reconnect delay in seconds
+RECONNECT_BACKOFF_MAX = 60       # upper bound for the reconnect delay
+
+# Chat Response Cache Settings
+CHAT_CACHE_MAX_ENTRIES = 512         # cached responses kept in memory (the near copy with a kv cache)
+CHAT_CACHE_MAX_BYTES = 2 * 1024 * 1024  # total size cap for cached responses kept in memory
+CHAT_CACHE_TTL = 3600                # seconds before a cached response expires
+CHAT_FAQ_FILE = "data/chat_faq.json"  # pinned answers that skip the model
+
+# Conversation Settings
+CHAT_TRANSPORT = "api"               # "api" (HTTP API over the SSH tunnel) or "repl" (shared `ollama run` shell)
+CONVERSATION_TOKEN_BUDGET = 2048     # tokens of history kept per conversation
+CONVERSATION_IDLE_TIMEOUT = 1800     # seconds before an idle conversation is evicted
+MAX_CONVERSATIONS = 1000             # conversations kept in memory
+
+# Model Router Settings
+ROUTER_MAX_INFLIGHT = 4              # requests per model before it counts as saturated
+ROUTER_LATENCY_SLO = 15              # seconds; models with a slower rolling p50 are saturated
+ROUTER_SHORT_PROMPT_TOKENS = 60      # prompts up to this size are "simple"
+ROUTER_LONG_PROMPT_TOKENS = 400      # prompts over this size are "complex"
+
+# Semantic Search Settings
+SEMANTIC_EMBEDDER = "local"          # "local" (hashed, deterministic, offline) or "ollama" (EMBEDDING_MODEL)
+EMBEDDING_MODEL = "nomic-embed-text" # Ollama model used to embed catalog records and queries
+EMBEDDING_TIMEOUT = 60               # seconds for one batch of embeddings
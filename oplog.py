@@ -0,0 +1,745 @@
+"""Append-only operation log in front of the JSON data files.
+
+The data files become snapshots. Each save is diffed against the
+collection's current records and only the records that changed are appended
+to data/oplog.jsonl as one line per commit, e.g.
+
+    {"commits": [{"file": "library_books.json", "version": 42, "ops": [{"op": "put", "id": 4, "value": {...}}]}]}
+
+so a borrow costs an append of two records instead of rewriting two files.
+A background compactor periodically writes the changed collections back to
+their files (atomically, see storage.py), records the versions they hold in
+data/oplog.versions.json and truncates the log to the commits made since.
+Startup loads the files and replays the log tail.
+
+Several processes can share one data directory. Every collection carries a
+version that each commit bumps by one; a commit holds the collection's lock
+(an fcntl lock under data/.locks) and appends under the log lock, and every
+process reads the other processes' commits from the log before it loads or
+commits, skipping those its snapshot already holds.
+
+Collections are split into records so a diff is cheap:
+
+* a top-level list of records with an ``id`` is a table keyed by id;
+* a top-level object keeps one entry per key, and a key whose value is a
+  list of records with ids (``{"workshops": [...]}``) is itself a table.
+
+Anything else is logged whole with a ``replace`` op.
+"""
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, Any, List, Optional, Callable, Tuple
+
+from storage import JsonStore, FileLock, atomic_write, DEFAULT_COMMIT_WINDOW, GROUP_COMMIT_TIMEOUT
+
+# Compact when the log grows past this size, or this long after the last compaction
+COMPACT_LOG_BYTES = 4 * 1024 * 1024
+COMPACT_INTERVAL = 60.0
+
+# A transaction that keeps losing version checks gives up after this many retries
+MAX_RETRIES = 8
+
+
+def _is_table(value) -> bool:
+    if not isinstance(value, list):
+        return False
+    ids = set()
+    for item in value:
+        if not isinstance(item, dict) or not isinstance(item.get('id'), (int, str)) or item['id'] in ids:
+            return False
+        ids.add(item['id'])
+    return True
+
+
+def _encode(value) -> str:
+    return json.dumps(value)
+
+
+def _record_changes(ops: List[Dict[str, Any]]) -> Optional[Dict[Any, Any]]:
+    """id -> new record (None when deleted) for ops on a top-level table; None when anything else changed"""
+    changes = {}
+    for op in ops:
+        if op['op'] not in ('put', 'delete') or 'key' in op:
+            return None
+        changes[op['id']] = op.get('value')
+    return changes
+
+
+def _file_identity(file_path: str) -> Optional[Tuple[int, int]]:
+    """Changes whenever atomic_write replaces file_path"""
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _commits(line: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The commits in one log line; lines written before versioning hold a single unversioned one"""
+    if 'commits' in line:
+        return line['commits']
+    return [{'file': line['file'], 'version': None, 'ops': line['ops']}]
+
+
+class Collection:
+    """One data file as ordered record texts; never mutated once published to readers"""
+
+    __slots__ = ('shape', 'parts', 'values', 'text')
+
+    def __init__(self, shape: str, parts, values=None):
+        self.shape = shape      # 'table' (top-level list), 'object' or 'raw'
+        # table: {id: text}; object: {key: text or {id: text}}; raw: text
+        self.parts = parts
+        # Decoded twin of parts, built on first save, so unchanged records are not re-encoded
+        self.values = values
+        self.text = None        # the whole document, joined on first load
+
+    @classmethod
+    def from_data(cls, data, base: 'Collection' = None) -> 'Collection':
+        """Split data into records; records equal to base's reuse base's encoding"""
+        if _is_table(data):
+            base_parts, base_values = _table_base(base, None, 'table')
+            parts, values = _encode_table(data, base_parts, base_values)
+            return cls('table', parts, values)
+        if isinstance(data, dict):
+            parts, values = {}, {}
+            for key, value in data.items():
+                if _is_table(value) and value:
+                    parts[key], values[key] = _encode_table(value, *_table_base(base, key, 'object'))
+                else:
+                    previous = base.parts.get(key) if base is not None and base.shape == 'object' else None
+                    if isinstance(previous, str) and base.decoded()[key] == value:
+                        parts[key], values[key] = previous, base.values[key]
+                    else:
+                        parts[key] = _encode(value)
+                        values[key] = json.loads(parts[key])
+            return cls('object', parts, values)
+        return cls('raw', _encode(data))
+
+    def decoded(self):
+        if self.values is None:
+            if self.shape == 'table':
+                self.values = {item_id: json.loads(text) for item_id, text in self.parts.items()}
+            elif self.shape == 'object':
+                self.values = {key: {i: json.loads(t) for i, t in part.items()} if isinstance(part, dict) else json.loads(part)
+                               for key, part in self.parts.items()}
+            else:
+                self.values = json.loads(self.parts)
+        return self.values
+
+    def to_data(self):
+        """Fresh objects for a caller, decoded from the joined record texts in one pass"""
+        if self.text is None:
+            if self.shape == 'table':
+                self.text = '[' + ','.join(self.parts.values()) + ']'
+            elif self.shape == 'object':
+                self.text = '{' + ','.join(
+                    json.dumps(key) + ':' + ('[' + ','.join(part.values()) + ']' if isinstance(part, dict) else part)
+                    for key, part in self.parts.items()) + '}'
+            else:
+                self.text = self.parts
+        return json.loads(self.text)
+
+    def copy(self) -> 'Collection':
+        if self.shape == 'table':
+            return Collection('table', dict(self.parts))
+        if self.shape == 'object':
+            return Collection('object', {k: dict(p) if isinstance(p, dict) else p for k, p in self.parts.items()})
+        return Collection(self.shape, self.parts)
+
+
+def _table_base(base: Optional[Collection], key, shape: str):
+    """(texts, decoded values) of the matching table in base, or empty ones"""
+    if base is None or base.shape != shape:
+        return {}, {}
+    parts = base.parts if key is None else base.parts.get(key)
+    if not isinstance(parts, dict):
+        return {}, {}
+    values = base.decoded()
+    return parts, values if key is None else values[key]
+
+
+def _encode_table(items: List[Dict[str, Any]], base_parts: Dict[Any, str], base_values: Dict[Any, Any]):
+    parts, values = {}, {}
+    for item in items:
+        item_id = item['id']
+        previous = base_values.get(item_id)
+        if previous is not None and previous == item:
+            parts[item_id], values[item_id] = base_parts[item_id], previous
+        else:
+            parts[item_id] = _encode(item)
+            # Decoded from the text so later edits to the caller's objects cannot leak in
+            values[item_id] = json.loads(parts[item_id])
+    return parts, values
+
+
+def _table_ops(old: Dict[Any, str], new: Dict[Any, str], key=None) -> Optional[List[Dict[str, Any]]]:
+    """put/delete ops turning table old into new, or None if only a rewrite keeps the order"""
+    kept = [item_id for item_id in old if item_id in new]
+    if kept != [item_id for item_id in new if item_id in old]:
+        return None
+    # New ids are appended on replay, so they have to come after every kept id
+    seen_new = False
+    for item_id in new:
+        if item_id not in old:
+            seen_new = True
+        elif seen_new:
+            return None
+    ops = []
+    for item_id in old:
+        if item_id not in new:
+            ops.append({'op': 'delete', 'id': item_id})
+    for item_id, text in new.items():
+        if old.get(item_id) != text:
+            ops.append({'op': 'put', 'id': item_id, 'value': json.loads(text)})
+    if key is not None:
+        for op in ops:
+            op['key'] = key
+    return ops
+
+
+def diff(old: Optional[Collection], new: Collection) -> List[Dict[str, Any]]:
+    """Ops that turn old into new; a single replace when the change is structural"""
+    replace = lambda: [{'op': 'replace', 'value': new.to_data()}]
+    if old is None or old.shape != new.shape or new.shape == 'raw':
+        return replace() if old is None or old.shape != new.shape or old.parts != new.parts else []
+    if new.shape == 'table':
+        ops = _table_ops(old.parts, new.parts)
+        return replace() if ops is None else ops
+
+    if [k for k in old.parts if k in new.parts] != [k for k in new.parts if k in old.parts]:
+        return replace()
+    ops = []
+    for key in old.parts:
+        if key not in new.parts:
+            ops.append({'op': 'unset', 'key': key})
+    for key, part in new.parts.items():
+        previous = old.parts.get(key)
+        if previous == part:
+            continue
+        table_ops = _table_ops(previous, part, key) if isinstance(previous, dict) and isinstance(part, dict) else None
+        if table_ops is None:
+            value = [json.loads(t) for t in part.values()] if isinstance(part, dict) else json.loads(part)
+            ops.append({'op': 'set', 'key': key, 'value': value})
+        else:
+            ops.extend(table_ops)
+    return ops
+
+
+# Replay handlers: each applies one op to a private copy of a collection and returns it
+
+def _replay_put(collection: Collection, op: Dict[str, Any]) -> Collection:
+    table = collection.parts if 'key' not in op else collection.parts.setdefault(op['key'], {})
+    if not isinstance(table, dict):
+        table = collection.parts[op['key']] = {}
+    table[op['id']] = _encode(op['value'])
+    return collection
+
+
+def _replay_delete(collection: Collection, op: Dict[str, Any]) -> Collection:
+    table = collection.parts if 'key' not in op else collection.parts.get(op['key'])
+    if isinstance(table, dict):
+        table.pop(op['id'], None)
+    return collection
+
+
+def _replay_set(collection: Collection, op: Dict[str, Any]) -> Collection:
+    value = op['value']
+    collection.parts[op['key']] = {item['id']: _encode(item) for item in value} if _is_table(value) and value else _encode(value)
+    return collection
+
+
+def _replay_unset(collection: Collection, op: Dict[str, Any]) -> Collection:
+    collection.parts.pop(op['key'], None)
+    return collection
+
+
+def _replay_replace(collection: Collection, op: Dict[str, Any]) -> Collection:
+    return Collection.from_data(op['value'])
+
+
+REPLAY_HANDLERS = {
+    'put': _replay_put,
+    'delete': _replay_delete,
+    'set': _replay_set,
+    'unset': _replay_unset,
+    'replace': _replay_replace
+}
+
+
+class LoggedJsonStore(JsonStore):
+    """JsonStore whose saves append record-level ops to a log instead of rewriting files.
+
+    Durability modes keep their meaning, applied to the log: ``sync`` fsyncs
+    the log in the caller, ``group`` waits for the writer thread's next fsync
+    (shared by every commit in the window) and ``async`` does not wait.
+
+    A plain save is diffed against the version this thread last loaded, so
+    records another process changed in the meantime are kept, not reverted.
+    transact() is the compare-and-swap path for read-check-write updates.
+
+    Listeners hear about every commit, this process's and the others', with
+    the records it changed taken from its ops. Changes are queued per file
+    under the store lock and delivered in commit order by whichever thread
+    drains the queue next.
+    """
+
+    def __init__(self, log_path: str, durability: str = 'group', window: float = DEFAULT_COMMIT_WINDOW,
+                 compact_bytes: int = COMPACT_LOG_BYTES, compact_interval: float = COMPACT_INTERVAL):
+        super().__init__(durability, window)
+        self._lock = threading.RLock()
+        self._committed = threading.Condition(self._lock)
+        self.log_path = log_path
+        self.directory = os.path.dirname(log_path) or '.'
+        self.versions_path = os.path.splitext(log_path)[0] + '.versions.json'
+        self.lock_dir = os.path.join(self.directory, '.locks')
+        self.compact_bytes = compact_bytes
+        self.compact_interval = compact_interval
+        self._collections: Dict[str, Optional[Collection]] = {}
+        self._versions: Dict[str, int] = {}      # path -> version of the collection in memory
+        self._touched = set()     # collections with commits in the current log
+        self._log_inode = None
+        self._offset = 0          # bytes of the current log already applied here
+        self._log = None
+        self._log_pid = None
+        self._appended = 0        # sequence of the last commit this process wrote to the log
+        self._synced = 0          # sequence of the last commit fsynced
+        self._local = threading.local()
+        self._locks: Dict[str, FileLock] = {}
+        self._log_lock = FileLock(os.path.join(self.lock_dir, os.path.basename(log_path) + '.lock'))
+        self._compact_lock = FileLock(os.path.join(self.lock_dir, 'compact.lock'))
+        self._last_compaction = time.monotonic()
+        self._outbox: Dict[str, Optional[Dict[Any, Any]]] = {}   # path -> changes not yet delivered
+        self._notify_lock = threading.RLock()
+        self.commits = 0
+        self.merges = 0
+        self.conflicts = 0
+        self.retries = 0
+        self.remote_commits = 0
+        self.compactions = 0
+        self.replayed = 0
+        self.last_compaction_ms = 0.0
+        with self._lock:
+            self._catch_up()
+        self.replayed = self.remote_commits
+        if self.replayed:
+            print(f"Operation log: replayed {self.replayed} commits into {len(self._touched)} collections")
+        if self._touched:
+            # Fold the replayed tail right away so an idle process never holds dirty state
+            self.compact()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _name(self, file_path: str) -> str:
+        """How the log and versions file refer to file_path: relative to the log's directory"""
+        return os.path.relpath(file_path, self.directory).replace(os.sep, '/')
+
+    def _folded_versions(self) -> Dict[str, int]:
+        if not os.path.exists(self.versions_path):
+            return {}
+        with open(self.versions_path, 'r') as f:
+            return json.load(f)
+
+    def _load_file(self, file_path: str) -> Optional[Collection]:
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, 'r') as f:
+            return Collection.from_data(json.load(f))
+
+    def _collection(self, file_path: str) -> Optional[Collection]:
+        if file_path not in self._collections:
+            # A compaction replaces the snapshot, then the versions file. Read in the same
+            # order, the version is never ahead of the data as long as the snapshot was not
+            # replaced in between; if it was, both are read again. Replay fills any gap
+            while True:
+                snapshot = _file_identity(file_path)
+                collection = self._load_file(file_path)
+                version = self._folded_versions().get(self._name(file_path), 0)
+                if _file_identity(file_path) == snapshot:
+                    break
+            self._collections[file_path] = collection
+            self._versions[file_path] = version
+        return self._collections[file_path]
+
+    def _lock_for(self, file_path: str) -> FileLock:
+        with self._lock:
+            lock = self._locks.get(file_path)
+            if lock is None:
+                lock = self._locks[file_path] = FileLock(
+                    os.path.join(self.lock_dir, self._name(file_path).replace('/', '__') + '.lock'))
+            return lock
+
+    def _bases(self) -> Dict[str, Tuple[Optional[Collection], int]]:
+        """path -> (collection, version) this thread last loaded or saved"""
+        bases = getattr(self._local, 'bases', None)
+        if bases is None:
+            bases = self._local.bases = {}
+        return bases
+
+    def _catch_up(self):
+        """Apply commits other processes appended since the last call and queue their changes.
+
+        Call with self._lock held. A log whose inode changed was swapped by a
+        compaction: everything is reloaded from the new snapshots.
+        """
+        try:
+            log = open(self.log_path, 'rb')
+        except FileNotFoundError:
+            return
+        with log:
+            inode = os.fstat(log.fileno()).st_ino
+            if inode != self._log_inode:
+                self._reload(inode)
+            log.seek(self._offset)
+            data = log.read()
+        # A line without its newline is still being appended, or torn by a crash
+        end = data.rfind(b'\n') + 1
+        if not end:
+            return
+        private = set()   # collections already copied for this batch of commits
+        for raw in data[:end].splitlines():
+            try:
+                line = json.loads(raw)
+            except ValueError:
+                print(f"Operation log: skipping unreadable commit at byte {self._offset}")
+                continue
+            for commit in _commits(line):
+                file_path = self._path(commit['file'])
+                collection = self._collection(file_path)
+                version = self._versions[file_path]
+                if commit['version'] is not None and commit['version'] <= version:
+                    continue   # already in the snapshot or applied here
+                if file_path not in private:
+                    collection = collection.copy() if collection is not None else Collection('object', {})
+                    private.add(file_path)
+                for op in commit['ops']:
+                    collection = REPLAY_HANDLERS[op['op']](collection, op)
+                self._collections[file_path] = collection
+                self._versions[file_path] = version + 1 if commit['version'] is None else commit['version']
+                self._touched.add(file_path)
+                self._queue(file_path, _record_changes(commit['ops']))
+                self.remote_commits += 1
+        self._offset += end
+
+    def _reload(self, inode: int):
+        """Start over on a new log generation; loaded collections that moved on are queued whole"""
+        previous = dict(self._versions)
+        self._collections.clear()
+        self._versions.clear()
+        self._touched.clear()
+        self._log_inode = inode
+        self._offset = 0
+        for file_path, version in previous.items():
+            self._collection(file_path)
+            if self._versions[file_path] != version:
+                self._queue(file_path, None)
+
+    def _queue(self, file_path: str, changes: Optional[Dict[Any, Any]]):
+        """Record a commit's changes for the listeners; call with self._lock held"""
+        if not self._listened(file_path):
+            return
+        if file_path not in self._outbox:
+            self._outbox[file_path] = changes
+        elif self._outbox[file_path] is not None:
+            if changes is None:
+                self._outbox[file_path] = None
+            else:
+                self._outbox[file_path].update(changes)
+
+    def _notify(self):
+        """Deliver queued changes; the lock keeps deliveries for one file in commit order"""
+        with self._notify_lock:
+            while True:
+                with self._lock:
+                    if not self._outbox:
+                        return
+                    file_path = next(iter(self._outbox))
+                    changes = self._outbox.pop(file_path)
+                    collection = self._collections.get(file_path)
+                if changes is None and collection is None:
+                    continue
+                self._emit(file_path, collection.to_data() if changes is None else None, changes)
+
+    def load(self, file_path: str, default=None):
+        with self._lock:
+            self._catch_up()
+            collection = self._collection(file_path)
+            self._bases()[file_path] = (collection, self._versions[file_path])
+        self._notify()
+        if collection is None:
+            return {} if default is None else default
+        # Every load hands out fresh objects; callers mutate what they get
+        return collection.to_data()
+
+    def version(self, file_path: str) -> int:
+        """Version of file_path's collection, counting commits from every process"""
+        with self._lock:
+            self._catch_up()
+            version = self._versions.get(file_path)
+            if version is None:
+                version = self._folded_versions().get(self._name(file_path), 0)
+        self._notify()
+        return version
+
+    def save(self, file_path: str, data: Any):
+        with self._lock:
+            self.saves += 1
+        sequence = self._commit({file_path: data}, strict=False)[1]
+        self._wait_durable(sequence, file_path)
+
+    def transact(self, file_paths: List[str], mutate: Callable, retries: int = MAX_RETRIES):
+        """Run mutate(*documents) and commit what it changed, if nobody committed to those files meanwhile.
+
+        mutate gets fresh documents and may run several times, so it must not
+        have side effects beyond editing them. Returns (mutate's result,
+        {path: document} for the documents saved); raises TimeoutError when
+        a lock cannot be had in time or the retries run out.
+        """
+        for attempt in range(retries + 1):
+            with self._lock:
+                self._catch_up()
+                bases = {}
+                for file_path in file_paths:
+                    bases[file_path] = (self._collection(file_path), self._versions[file_path])
+            self._notify()
+            documents = [collection.to_data() if collection is not None else {}
+                         for collection, _ in (bases[file_path] for file_path in file_paths)]
+            result = mutate(*documents)
+            # A file that does not exist yet and was left empty is not a change
+            changes = {path: doc for path, doc in zip(file_paths, documents) if bases[path][0] is not None or doc}
+            committed, sequence = self._commit(changes, strict=True, bases=bases)
+            if committed is not None:
+                self._wait_durable(sequence, ', '.join(sorted(committed)))
+                return result, {path: doc for path, doc in zip(file_paths, documents) if path in committed}
+            with self._lock:
+                self.retries += 1
+            time.sleep(random.uniform(0, 0.001 * 2 ** min(attempt, 6)))
+        raise TimeoutError(f"Too many concurrent updates to {', '.join(sorted(file_paths))}")
+
+    def _commit(self, documents: Dict[str, Any], strict: bool, bases=None):
+        """Append one log line with the changes of documents against their bases.
+
+        Returns (paths committed, commit sequence); in strict mode (None, None)
+        when a collection moved past its base version, otherwise the other
+        commits are merged with this one's ops.
+        """
+        bases = bases if bases is not None else {path: self._bases().get(path) for path in documents}
+        encoded = {}
+        for file_path, data in documents.items():
+            base = bases.get(file_path)
+            encoded[file_path] = Collection.from_data(data, base[0] if base else None)
+
+        locks, conflict, states, changes = [], False, {}, {}
+        try:
+            for file_path in sorted(documents):
+                lock = self._lock_for(file_path)
+                lock.acquire()
+                locks.append(lock)
+            with self._lock:
+                self._catch_up()
+                commits = []
+                for file_path, new in encoded.items():
+                    current = self._collection(file_path)
+                    version = self._versions[file_path]
+                    base = bases.get(file_path)
+                    if base is None or base[1] == version:
+                        ops = diff(current if base is None else base[0], new)
+                        state = new
+                    elif strict:
+                        self.conflicts += 1
+                        conflict = True
+                        break
+                    else:
+                        # Another process committed since this thread loaded: apply only this save's changes
+                        ops = diff(base[0], new)
+                        state = current.copy() if current is not None else Collection('object', {})
+                        for op in ops:
+                            state = REPLAY_HANDLERS[op['op']](state, op)
+                        self.merges += 1
+                    if ops:
+                        commits.append({'file': self._name(file_path), 'version': version + 1, 'ops': ops})
+                        states[file_path] = state
+                        changes[file_path] = ops
+                sequence = None
+                if commits and not conflict:
+                    self._append(commits)
+                    for file_path, state in states.items():
+                        self._collections[file_path] = state
+                        self._versions[file_path] += 1
+                        self._touched.add(file_path)
+                        self._bases()[file_path] = (state, self._versions[file_path])
+                        self._queue(file_path, _record_changes(changes[file_path]))
+                    self.commits += 1
+                    self._appended += 1
+                    sequence = self._appended
+                    self._ensure_writer()
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        self._notify()
+        if conflict:
+            return None, None
+        return set(states), sequence
+
+    def _append(self, commits: List[Dict[str, Any]]):
+        """Write one line to the end of the log; call with self._lock and the collections' locks held"""
+        line = (json.dumps({'commits': commits}) + '\n').encode('utf-8')
+        with self._log_lock:
+            # Nobody else appends now, so after this the offset is the end of the log
+            self._catch_up()
+            if self._log is None or self._log_pid != os.getpid() or \
+                    not os.path.exists(self.log_path) or os.fstat(self._log.fileno()).st_ino != self._log_inode:
+                self._open_log()
+            size = os.fstat(self._log.fileno()).st_size
+            if size > self._offset:
+                # Holding the log lock, a partial line can only be left over from a crash
+                print(f"Operation log: dropping incomplete commit at byte {self._offset}")
+                self._log.truncate(self._offset)
+            self._log.write(line)
+            self._log.flush()
+            self._offset += len(line)
+
+    def _open_log(self):
+        if self._log is not None and self._log_pid == os.getpid():
+            self._log.close()
+        self._log = open(self.log_path, 'ab')
+        self._log_pid = os.getpid()
+        inode = os.fstat(self._log.fileno()).st_ino
+        if inode != self._log_inode:
+            # A log created just now, with nothing in it to catch up on
+            self._reload(inode)
+
+    def _wait_durable(self, sequence: Optional[int], what: str):
+        if sequence is None:
+            return
+        if self.durability == 'sync':
+            self._sync()
+        else:
+            self._wake.set()
+        if self.durability == 'group':
+            with self._committed:
+                deadline = time.monotonic() + GROUP_COMMIT_TIMEOUT
+                while self._synced < sequence:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise IOError(f"Timed out saving {what}: {self.last_error}")
+                    self._committed.wait(remaining)
+
+    def _sync(self):
+        """fsync the log; one call covers every commit appended before it"""
+        with self._lock:
+            target = self._appended
+            log = self._log
+        if self._synced >= target:
+            return
+        try:
+            os.fsync(log.fileno())
+        except ValueError:
+            pass   # closed by a compaction, whose new log was fsynced with these commits in it
+        with self._committed:
+            self._synced = max(self._synced, target)
+            self.batches += 1
+            self._committed.notify_all()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.compact_interval)
+            time.sleep(self.window)
+            self._wake.clear()
+            try:
+                self._sync()
+            except OSError as e:
+                print(f"Error syncing operation log: {e}")
+                self.last_error = str(e)
+                time.sleep(max(self.window, 0.5))
+                self._wake.set()
+                continue
+            due = time.monotonic() - self._last_compaction >= self.compact_interval
+            if self._offset >= self.compact_bytes or (due and self._touched):
+                try:
+                    self.compact()
+                except (OSError, TimeoutError) as e:
+                    print(f"Error compacting operation log: {e}")
+
+    def compact(self):
+        """Write changed collections to their files and drop the log commits they cover"""
+        with self._compact_lock:
+            start = time.perf_counter()
+            with self._lock:
+                with self._log_lock:
+                    self._catch_up()
+                snapshots = {path: (self._collections[path], self._versions[path])
+                             for path in self._touched if self._collections.get(path)}
+                folded_inode, folded_bytes = self._log_inode, self._offset
+            if not snapshots:
+                return
+            for file_path, (collection, _) in snapshots.items():
+                atomic_write(file_path, json.dumps(collection.to_data(), indent=2))
+                self.writes += 1
+            versions = self._folded_versions()
+            for file_path, (_, version) in snapshots.items():
+                versions[self._name(file_path)] = version
+            atomic_write(self.versions_path, json.dumps(versions, indent=2))
+
+            with self._lock:
+                with self._log_lock:
+                    self._catch_up()
+                    if self._log_inode != folded_inode:
+                        return
+                    # Commits appended while the snapshots were written stay in the new log
+                    with open(self.log_path, 'rb') as f:
+                        f.seek(folded_bytes)
+                        tail = f.read()
+                    tail = tail[:tail.rfind(b'\n') + 1]
+                    atomic_write(self.log_path, tail.decode('utf-8'))
+                    if self._log is not None and self._log_pid == os.getpid():
+                        self._log.close()
+                    self._log = open(self.log_path, 'ab')
+                    self._log_pid = os.getpid()
+                    # The tail is already applied here; only the bookkeeping moves to the new log
+                    self._log_inode = os.fstat(self._log.fileno()).st_ino
+                    self._offset = len(tail)
+                    self._touched = set()
+                    for raw in tail.splitlines():
+                        try:
+                            self._touched.update(self._path(c['file']) for c in _commits(json.loads(raw)))
+                        except ValueError:
+                            continue
+                self._synced = self._appended
+                self._committed.notify_all()
+            self._last_compaction = time.monotonic()
+            self.compactions += 1
+            self.last_compaction_ms = round((time.perf_counter() - start) * 1000, 2)
+        # Other processes' commits picked up while compacting
+        self._notify()
+
+    def flush(self):
+        self._sync()
+        self.compact()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        with self._lock:
+            locks = [self._log_lock] + list(self._locks.values())
+            stats.update({
+                'log_bytes': self._offset,
+                'commits': self.commits,
+                'remote_commits': self.remote_commits,
+                'replayed': self.replayed,
+                'dirty': len(self._touched),
+                'compactions': self.compactions,
+                'last_compaction_ms': self.last_compaction_ms,
+                'merges': self.merges,
+                'conflicts': self.conflicts,
+                'retries': self.retries,
+                'lock_waits': sum(lock.contended for lock in locks),
+                'lock_wait_ms': round(sum(lock.wait_ms for lock in locks), 2),
+                'lock_max_wait_ms': round(max(lock.max_wait_ms for lock in locks), 2),
+                'lock_timeouts': sum(lock.timeouts for lock in locks),
+                'locks': {os.path.basename(lock.path): lock.stats() for lock in locks}
+            })
+        return stats
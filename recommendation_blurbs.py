@@ -0,0 +1,230 @@
+"""Offline generation of "why this book" blurbs for the recommendations page.
+
+Blurbs are produced in batch through ollama_client and stored in a versioned
+JSON cache keyed by a hash of the catalog record, so the page only does
+dictionary lookups. New or edited records hash differently and are picked up
+by the next run; bumping BLURB_PROMPT_VERSION regenerates everything.
+
+Usage (e.g. from cron during off-peak hours):
+    python recommendation_blurbs.py --off-peak 1-6 --max-items 200
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+from oplog import LoggedJsonStore
+from storage import JsonStore, atomic_write
+from user_store import UserStore
+
+BLURB_PROMPT_VERSION = 1
+
+# Fields that feed the prompt; a change to any of them invalidates the blurb
+HASHED_FIELDS = ['id', 'title', 'author', 'subject', 'level', 'course', 'documentType', 'description']
+
+
+def record_hash(record: Dict[str, Any]) -> str:
+    fields = {field: record.get(field) for field in HASHED_FIELDS}
+    return hashlib.sha1(json.dumps(fields, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def cohort_key(major: str, year: str) -> str:
+    return f"{major}|{year}"
+
+
+def book_prompt(record: Dict[str, Any]) -> str:
+    return (
+        "In one sentence of at most 25 words, tell a university student why this library item "
+        f"is worth reading. Title: {record.get('title', '')}. Author: {record.get('author', 'unknown')}. "
+        f"Subject: {record.get('subject', '')}. Level: {record.get('level', 'general')}. "
+        f"Description: {record.get('description', '')}"
+    )
+
+
+def cohort_prompt(record: Dict[str, Any], major: str, year: str) -> str:
+    return (
+        f"In one sentence of at most 25 words, tell a {year} {major} student why this library item "
+        f"suits them. Title: {record.get('title', '')}. Subject: {record.get('subject', '')}. "
+        f"Level: {record.get('level', 'general')}. Description: {record.get('description', '')}"
+    )
+
+
+class BlurbCache:
+    """Versioned on-disk blurb store, reloaded when the batch job rewrites it"""
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self):
+        try:
+            mtime = os.path.getmtime(self.file_path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        with self._lock:
+            with open(self.file_path, 'r') as f:
+                data = json.load(f)
+            # Blurbs written for an older prompt version are ignored, not served
+            self.entries = data.get('entries', {}) if data.get('version') == BLURB_PROMPT_VERSION else {}
+            self._mtime = mtime
+
+    def save(self):
+        with self._lock:
+            atomic_write(self.file_path, json.dumps({'version': BLURB_PROMPT_VERSION, 'entries': self.entries}, indent=2))
+            self._mtime = os.path.getmtime(self.file_path)
+
+    def key(self, record: Dict[str, Any], cohort: str = None) -> str:
+        digest = record_hash(record)
+        return f"{digest}|{cohort}" if cohort else digest
+
+    def lookup(self, record: Dict[str, Any], cohort: str = None) -> Optional[str]:
+        """Cohort-specific blurb if there is one, else the general blurb for the record"""
+        if cohort:
+            entry = self.entries.get(self.key(record, cohort))
+            if entry:
+                return entry['text']
+        entry = self.entries.get(self.key(record))
+        return entry['text'] if entry else None
+
+    def put(self, key: str, text: str, model: str = None):
+        with self._lock:
+            self.entries[key] = {
+                'text': text,
+                'model': model,
+                'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            }
+
+    def prune(self, live_hashes: set) -> int:
+        """Drop blurbs for records that no longer exist in their hashed form"""
+        with self._lock:
+            stale = [k for k in self.entries if k.split('|', 1)[0] not in live_hashes]
+            for k in stale:
+                del self.entries[k]
+            return len(stale)
+
+
+def cohort_candidates(records: List[Dict[str, Any]], major: str, limit: int) -> List[Dict[str, Any]]:
+    """Records worth a cohort-specific blurb: those in the cohort's subject area"""
+    major_lower = major.lower()
+    subjects = set()
+    if 'computer science' in major_lower or 'engineering' in major_lower:
+        subjects.add('computer science')
+    if 'mathematics' in major_lower or 'engineering' in major_lower:
+        subjects.add('mathematics')
+    matches = [r for r in records if r.get('subject', '').lower() in subjects]
+    return matches[:limit]
+
+
+def plan_jobs(cache: BlurbCache, records: List[Dict[str, Any]], cohorts: List[Tuple[str, str]],
+              per_cohort: int) -> List[Tuple[str, str]]:
+    """(cache key, prompt) pairs that are missing from the cache"""
+    jobs = []
+    for record in records:
+        key = cache.key(record)
+        if key not in cache.entries:
+            jobs.append((key, book_prompt(record)))
+    for major, year in cohorts:
+        for record in cohort_candidates(records, major, per_cohort):
+            key = cache.key(record, cohort_key(major, year))
+            if key not in cache.entries:
+                jobs.append((key, cohort_prompt(record, major, year)))
+    return jobs
+
+
+def run_batch(client, cache: BlurbCache, records, cohorts, per_cohort=20, max_items=None,
+              deadline=None, checkpoint_every=20) -> Dict[str, Any]:
+    live_hashes = {record_hash(r) for r in records}
+    pruned = cache.prune(live_hashes)
+    jobs = plan_jobs(cache, records, cohorts, per_cohort)
+    if max_items is not None:
+        jobs = jobs[:max_items]
+
+    generated = failed = 0
+    for key, prompt in jobs:
+        if deadline and time.time() > deadline:
+            print("Off-peak window is over, stopping early")
+            break
+        result = client.complete(prompt)
+        if result.get('success') and result.get('response'):
+            cache.put(key, ' '.join(result['response'].split()), result.get('model'))
+            generated += 1
+            if generated % checkpoint_every == 0:
+                cache.save()
+        else:
+            failed += 1
+            print(f"Blurb generation failed for {key}: {result.get('message')}")
+    cache.save()
+    return {'planned': len(jobs), 'generated': generated, 'failed': failed, 'pruned': pruned}
+
+
+def _in_window(window: str) -> bool:
+    start, end = (int(h) for h in window.split('-'))
+    hour = datetime.now().hour
+    return start <= hour < end if start <= end else hour >= start or hour < end
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-generate recommendation blurbs')
+    parser.add_argument('--data-dir', default=os.environ.get('STUDYHUB_DATA_DIR', 'data'))
+    parser.add_argument('--off-peak', help='only run inside this local hour window, e.g. 1-6')
+    parser.add_argument('--max-items', type=int, help='stop after this many generations')
+    parser.add_argument('--per-cohort', type=int, default=20, help='cohort-specific blurbs per cohort')
+    parser.add_argument('--storage', choices=['oplog', 'files'],
+                        default=os.environ.get('STUDYHUB_STORAGE', 'oplog'))
+    args = parser.parse_args()
+
+    if args.off_peak and not _in_window(args.off_peak):
+        print(f"Outside the off-peak window {args.off_peak}, nothing to do")
+        return
+
+    # Read through the app's store, so records still in the operation log are included
+    if args.storage == 'files':
+        store = JsonStore('sync')
+    else:
+        store = LoggedJsonStore(os.path.join(args.data_dir, 'oplog.jsonl'), 'sync')
+
+    def load(name, default=None):
+        return store.load(os.path.join(args.data_dir, name), default)
+
+    records = load('library_books.json', []) + load('ebooks.json', []) + load('internal_materials.json', [])
+    user_store = UserStore(store, os.path.join(args.data_dir, 'users'))
+    users = user_store.all() if user_store.migrated() else load('users.json')
+    cohorts = sorted({(u.get('major', ''), u.get('year', '')) for u in users.values() if u.get('major')})
+
+    deadline = None
+    if args.off_peak:
+        end_hour = int(args.off_peak.split('-')[1])
+        now = datetime.now()
+        end = now.replace(hour=end_hour % 24, minute=0, second=0, microsecond=0)
+        if end <= now:
+            end += timedelta(days=1)
+        deadline = end.timestamp()
+
+    from ollama_client import get_ollama_client
+    ollama_client = get_ollama_client()
+    ollama_client.start_background()
+    wait_until = time.time() + 120
+    while ollama_client.state != 'ready' and time.time() < wait_until:
+        time.sleep(0.5)
+    if ollama_client.state != 'ready':
+        raise SystemExit(f"Could not connect to Ollama: {ollama_client.get_status().get('last_error')}")
+
+    cache = BlurbCache(os.path.join(args.data_dir, 'recommendation_blurbs.json'))
+    try:
+        summary = run_batch(ollama_client, cache, records, cohorts, args.per_cohort, args.max_items, deadline)
+    finally:
+        ollama_client.disconnect()
+    print(f"Blurbs: {summary}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+"""Item-item collaborative filtering for the recommendations page.
+
+Interactions (favorites, borrowed and reserved items) from users.json form a
+sparse binary user x item matrix X. Item-item cosine similarity comes from the
+co-occurrence matrix X.T @ X, and top-N lists per user and per (major, year)
+cohort are computed in one pass so page requests only do dictionary reads.
+
+After the initial build the model is kept current by interaction events:
+each one adjusts co-occurrence counts in place and drops only the cached
+lists it can have changed, which are recomputed on next read. Cohort top-k
+lists are maintained by cohort_popularity.CohortPopularity.
+"""
+import queue
+import threading
+import time
+from typing import Dict, Any, Callable, List, Tuple
+
+import numpy as np
+
+from cohort_popularity import CohortPopularity
+
+INTERACTION_FIELDS = ['favorites', 'borrowed_books', 'reserved_books']
+
+# Users scored per sparse-dense block, bounds memory at BLOCK x items floats
+SCORE_BLOCK_ROWS = 256
+
+
+def user_items(user: Dict[str, Any]) -> set:
+    items = set()
+    for field in INTERACTION_FIELDS:
+        items.update(user.get(field) or [])
+    return items
+
+
+def top_n_indices(scores: np.ndarray, n: int) -> np.ndarray:
+    """Indices of the n largest positive scores, best first, ties in catalog order"""
+    positive = np.flatnonzero(scores > 0)
+    if positive.size > n:
+        positive = positive[np.argpartition(scores[positive], -n)[-n:]]
+    return positive[np.lexsort((positive, -scores[positive]))]
+
+
+class RecommendationEngine:
+    """Precomputed per-user and per-cohort recommendations.
+
+    build() swaps in a complete model, so readers never see a half-built one.
+    record() queues an interaction for the background updater; a burst of
+    events is applied as one batch.
+    """
+
+    def __init__(self, users_loader: Callable[[], Dict[str, Any]],
+                 catalog_loader: Callable[[], List[Dict[str, Any]]], top_n: int = 10):
+        self.users_loader = users_loader
+        self.catalog_loader = catalog_loader
+        self.top_n = top_n
+        self._model = None
+        self._lock = threading.RLock()
+        self._events = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+        self.builds = 0
+        self.last_build_ms = 0.0
+        self.events_applied = 0
+        self.lists_invalidated = 0
+
+    # -- full build -------------------------------------------------------
+
+    def build(self):
+        start = time.perf_counter()
+        model = self._compute(self.users_loader(), self.catalog_loader())
+        with self._lock:
+            self._model = model
+            self.builds += 1
+        self.last_build_ms = round((time.perf_counter() - start) * 1000, 2)
+        print(f"Recommendation model built: {len(model['user_items'])} users, "
+              f"{len(model['item_ids'])} items in {self.last_build_ms} ms")
+
+    def _compute(self, users: Dict[str, Any], catalog: List[Dict[str, Any]]) -> Dict[str, Any]:
+        # Imported here: scipy costs more start-up time than the rest of the module
+        from scipy import sparse
+
+        item_ids = [record['id'] for record in catalog]
+        item_index = {item_id: col for col, item_id in enumerate(item_ids)}
+        usernames = list(users)
+
+        rows, cols = [], []
+        interactions, item_users, user_cohort = {}, {}, {}
+        for row, username in enumerate(usernames):
+            user = users[username]
+            user_cohort[username] = (user.get('major', ''), user.get('year', ''))
+            owned = interactions[username] = {}
+            for field in INTERACTION_FIELDS:
+                for item_id in user.get(field) or []:
+                    if item_id in item_index:
+                        owned.setdefault(item_id, set()).add(field)
+            for item_id in owned:
+                rows.append(row)
+                cols.append(item_index[item_id])
+                item_users.setdefault(item_id, set()).add(username)
+        X = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(usernames), len(item_ids)))
+
+        # Co-occurrence counts; the diagonal is how many users touched each item
+        C = (X.T @ X).tocsr()
+        counts = C.diagonal()
+        cooc = (C - sparse.diags(counts)).tocsr()
+        cooc.eliminate_zeros()
+        inv_norm = np.zeros_like(counts)
+        np.divide(1.0, np.sqrt(counts), out=inv_norm, where=counts > 0)
+        S = (sparse.diags(inv_norm) @ cooc @ sparse.diags(inv_norm)).tocsr()
+
+        user_recs = {}
+        for start in range(0, len(usernames), SCORE_BLOCK_ROWS):
+            block = X[start:start + SCORE_BLOCK_ROWS]
+            scores = (block @ S).toarray()
+            scores[block.toarray() > 0] = 0   # never recommend what the user already has
+            for offset, row_scores in enumerate(scores):
+                top = top_n_indices(row_scores, self.top_n)
+                recs = []
+                if top.size:
+                    owned = block[offset].indices
+                    # The owned item most similar to each pick, used to explain it
+                    anchors = owned[S[owned][:, top].toarray().argmax(axis=0)]
+                    recs = [(item_ids[col], item_ids[anchor], float(row_scores[col]))
+                            for col, anchor in zip(top, anchors)]
+                user_recs[usernames[start + offset]] = recs
+
+        cohort_keys = sorted(set(user_cohort.values()))
+        cohorts = CohortPopularity(len(item_ids), self.top_n)
+        if cohort_keys:
+            key_index = {key: i for i, key in enumerate(cohort_keys)}
+            membership = sparse.csr_matrix(
+                (np.ones(len(usernames)), ([key_index[user_cohort[u]] for u in usernames], range(len(usernames)))),
+                shape=(len(cohort_keys), len(usernames)))
+            summed = (membership @ X).toarray()
+            for i, key in enumerate(cohort_keys):
+                cohorts.load(key, summed[i])
+
+        return {
+            'item_ids': item_ids,
+            'item_index': item_index,
+            'counts': counts,
+            'cooc': cooc.tolil(),
+            'user_items': interactions,
+            'item_users': item_users,
+            'user_cohort': user_cohort,
+            'cohorts': cohorts,
+            'user_recs': user_recs,
+            'popular': None
+        }
+
+    def _current(self) -> Dict[str, Any]:
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self.build()
+        return self._model
+
+    # -- incremental updates ----------------------------------------------
+
+    def record(self, username: str, item_id, field: str, added: bool, major: str = '', year: str = ''):
+        """Queue an interaction: item_id was added to or removed from user[field]"""
+        self._events.put(('interaction', username, item_id, field, added, (major, year)))
+        self._ensure_worker()
+
+    def invalidate(self):
+        """Queue a full rebuild, e.g. after users.json was changed outside the app"""
+        self._events.put(('rebuild',))
+        self._ensure_worker()
+
+    def flush(self):
+        """Block until every queued event has been applied"""
+        self._events.join()
+
+    def _ensure_worker(self):
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._events.get()]
+            while True:
+                try:
+                    batch.append(self._events.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._apply_batch(batch)
+            except Exception as e:
+                # Drop the model rather than serve one that missed events; the next read rebuilds it
+                print(f"Recommendation update failed, model will be rebuilt: {e}")
+                with self._lock:
+                    self._model = None
+            finally:
+                for _ in batch:
+                    self._events.task_done()
+
+    def _apply_batch(self, batch):
+        # Events are idempotent, so any that a rebuild already saw in users.json are no-ops
+        if any(event[0] == 'rebuild' for event in batch):
+            self.build()
+        elif self._model is None:
+            return   # nothing built yet; the first read loads users.json with these changes
+        if any(event[0] == 'interaction' and event[2] not in self._model['item_index'] for event in batch):
+            self.build()   # a catalog item the model has not seen yet
+        with self._lock:
+            item_index = self._model['item_index']
+            for event in batch:
+                if event[0] != 'interaction':
+                    continue
+                if event[2] not in item_index:
+                    # Still not in the catalog after the rebuild, e.g. a deleted book; nothing to score
+                    print(f"Recommendation update skipped: item {event[2]!r} is not in the catalog")
+                    continue
+                self._apply_interaction(*event[1:])
+
+    def _apply_interaction(self, username, item_id, field, added, cohort):
+        model = self._model
+        owned = model['user_items'].setdefault(username, {})
+        model['user_cohort'].setdefault(username, cohort)
+        fields = owned.get(item_id, set())
+        if added == (field in fields):
+            return
+        was_owned = bool(fields)
+        if added:
+            owned[item_id] = fields | {field}
+        else:
+            fields = fields - {field}
+            if fields:
+                owned[item_id] = fields
+            else:
+                del owned[item_id]
+        self.events_applied += 1
+        if was_owned == bool(owned.get(item_id)):
+            return   # another field still links the user to this item
+
+        delta = 1 if added else -1
+        col = model['item_index'][item_id]
+        others = [model['item_index'][other] for other in owned if other != item_id]
+        cooc = model['cooc']
+        for other in others:
+            cooc[col, other] += delta
+            cooc[other, col] += delta
+        model['counts'][col] += delta
+
+        holders = model['item_users'].setdefault(item_id, set())
+        if added:
+            holders.add(username)
+        else:
+            holders.discard(username)
+
+        model['cohorts'].add(model['user_cohort'][username], col, delta)
+
+        # Scores change for this user and anyone holding an item whose similarities moved
+        affected = {username} | holders
+        for other in owned:
+            affected |= model['item_users'].get(other, set())
+        for name in affected:
+            if model['user_recs'].pop(name, None) is not None:
+                self.lists_invalidated += 1
+        model['popular'] = None
+
+    # -- scoring from the live counts -------------------------------------
+
+    def _similarity_row(self, model, col: int) -> Tuple[np.ndarray, np.ndarray]:
+        cooc, counts = model['cooc'], model['counts']
+        neighbours = np.array(cooc.rows[col], dtype=np.intp)
+        values = np.array(cooc.data[col], dtype=float)
+        keep = values > 0
+        neighbours, values = neighbours[keep], values[keep]
+        if neighbours.size == 0:
+            return neighbours, values
+        return neighbours, values / np.sqrt(counts[col] * counts[neighbours])
+
+    def _score_user(self, model, username: str) -> List[Tuple[Any, Any, float]]:
+        owned = [model['item_index'][item_id] for item_id in model['user_items'].get(username, {})]
+        if not owned:
+            return []
+        similarity = np.zeros((len(owned), len(model['item_ids'])))
+        for i, col in enumerate(owned):
+            neighbours, values = self._similarity_row(model, col)
+            similarity[i, neighbours] = values
+        scores = similarity.sum(axis=0)
+        scores[owned] = 0
+        top = top_n_indices(scores, self.top_n)
+        anchors = np.array(owned)[similarity[:, top].argmax(axis=0)] if top.size else []
+        item_ids = model['item_ids']
+        return [(item_ids[col], item_ids[anchor], float(scores[col])) for col, anchor in zip(top, anchors)]
+
+    # -- reads --------------------------------------------------------------
+
+    def for_user(self, username: str) -> List[Tuple[Any, Any, float]]:
+        """(item id, most similar item the user has, score), best first"""
+        model = self._current()
+        with self._lock:
+            recs = model['user_recs'].get(username)
+            if recs is None:
+                recs = model['user_recs'][username] = self._score_user(model, username)
+            return list(recs)
+
+    def for_cohort(self, major: str, year: str) -> List[Tuple[Any, int]]:
+        """(item id, readers in the cohort), best first"""
+        model = self._current()
+        with self._lock:
+            item_ids = model['item_ids']
+            return [(item_ids[col], count) for col, count in model['cohorts'].top((major, year))]
+
+    def popular(self) -> List[Any]:
+        model = self._current()
+        with self._lock:
+            if model['popular'] is None:
+                counts = model['counts']
+                model['popular'] = [model['item_ids'][col] for col in top_n_indices(counts, len(counts))]
+            return list(model['popular'])
+
+    def readers(self, item_id) -> int:
+        """How many users have favorited, borrowed or reserved the item"""
+        model = self._current()
+        col = model['item_index'].get(item_id)
+        return int(model['counts'][col]) if col is not None else 0
+
+    def stats(self) -> Dict[str, Any]:
+        model = self._model or {}
+        return {
+            'users': len(model.get('user_items', {})),
+            'items': len(model.get('item_ids', [])),
+            'cohort_topk': model['cohorts'].stats() if model else {},
+            'cached_user_lists': len(model.get('user_recs', {})),
+            'builds': self.builds,
+            'last_build_ms': self.last_build_ms,
+            'events_applied': self.events_applied,
+            'lists_invalidated': self.lists_invalidated,
+            'queued_events': self._events.qsize()
+        }
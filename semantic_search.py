@@ -0,0 +1,528 @@
+"""Semantic search over catalog titles and descriptions.
+
+Every record's title and description is embedded once, in batches, and kept
+as a row of a memory-mapped float32 matrix under the data directory, so a
+restart only embeds records that are new or whose text changed. Rows are
+grouped by an inverted-file (IVF) index: spherical k-means centroids split
+the catalog into about sqrt(n) lists and a query scores only the rows in the
+few lists nearest to it, rather than the whole matrix.
+
+Workers share the matrix. One process at a time is the writer: it holds
+writer.lock in the embeddings directory for as long as it runs, embeds, hands
+out rows and rewrites meta.json. The others only read, and reopen the row
+map when meta.json changes; when the writer exits its lock is released and
+another worker takes over.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Dict, Any, List, Callable, Iterable, Optional
+
+import numpy as np
+
+from catalog_retrieval import tokenize
+from storage import FileLock, atomic_write
+
+EMBED_FIELDS = ['title', 'description']
+EMBED_BATCH_SIZE = 32
+LOCAL_EMBEDDING_DIM = 256
+
+# Below this many records the matrix is small enough to score in full
+IVF_MIN_RECORDS = 4096
+# Lists scored per query
+IVF_PROBES = 8
+# Re-train the centroids once the catalog has grown by this factor since training
+IVF_RETRAIN_GROWTH = 2.0
+KMEANS_ITERATIONS = 8
+KMEANS_SAMPLE_PER_LIST = 40
+
+# Seconds between checkpoints of the row map while a long refresh runs
+CHECKPOINT_INTERVAL = 5.0
+
+# Seconds between the background worker's passes: the writer looks for catalog commits
+# from other processes, the other workers check whether the writer has gone away
+WRITER_POLL_INTERVAL = 5.0
+
+
+def embedding_text(record: Dict[str, Any]) -> str:
+    return '. '.join(str(record.get(field) or '').strip() for field in EMBED_FIELDS if record.get(field))
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+class LocalEmbedder:
+    """Deterministic hashed embedder for tests and offline use.
+
+    Each word and character trigram maps to a fixed pseudo-random direction;
+    a text is the normalised sum of its features' directions. It captures
+    word and sub-word overlap only, not meaning.
+    """
+
+    def __init__(self, dim: int = LOCAL_EMBEDDING_DIM):
+        self.dim = dim
+        self.name = f"local-hash-{dim}"
+        self._directions: Dict[str, np.ndarray] = {}
+
+    def _direction(self, feature: str) -> np.ndarray:
+        direction = self._directions.get(feature)
+        if direction is None:
+            rng = np.random.default_rng(zlib.crc32(feature.encode('utf-8')))
+            direction = self._directions[feature] = rng.standard_normal(self.dim).astype(np.float32)
+        return direction
+
+    def embed(self, texts: List[str]) -> Optional[np.ndarray]:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in tokenize(text):
+                vectors[i] += self._direction(f"w:{word}")
+                padded = f" {word} "
+                for j in range(len(padded) - 2):
+                    vectors[i] += 0.3 * self._direction(f"g:{padded[j:j + 3]}")
+        return _normalize_rows(vectors)
+
+
+class OllamaEmbedder:
+    """Embeddings from the Ollama embed API, through the SSH client from client_factory"""
+
+    def __init__(self, client_factory: Callable[[], Any], model: str):
+        self.client_factory = client_factory
+        self.model = model
+        self.name = f"ollama:{model}"
+
+    def embed(self, texts: List[str]) -> Optional[np.ndarray]:
+        """Normalised vectors, or None while Ollama cannot be reached"""
+        result = self.client_factory().embed(texts, model=self.model)
+        if not result.get('success'):
+            print(f"Embedding batch failed: {result.get('message')}")
+            return None
+        return _normalize_rows(np.asarray(result['embeddings'], dtype=np.float32))
+
+
+class SemanticSearchIndex:
+    """Embedding matrix on disk plus an IVF index for approximate nearest neighbours.
+
+    Catalog saves only queue changed records; in the writer process a
+    background worker embeds the queue in batches and writes the rows in
+    place, so a save never waits for the embedding model. poll, if given, is
+    called before each of the writer's passes so catalog commits made by
+    other processes reach sync() here.
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[[], list]], embedder, directory: str,
+                 probes: int = IVF_PROBES, poll: Callable[[], None] = None):
+        self.loaders = loaders
+        self.embedder = embedder
+        self.directory = directory
+        self.probes = probes
+        self.poll = poll
+        self._vectors_path = os.path.join(directory, 'vectors.f32')
+        self._meta_path = os.path.join(directory, 'meta.json')
+        self._writer_lock = FileLock(os.path.join(directory, 'writer.lock'), timeout=0)
+        self._writer_pid = None                      # set in the process holding the writer lock
+        self._next_claim = 0.0
+        self._meta_version = None                    # mtime of the meta.json the row map came from
+        self._dim = None
+        self._capacity = 0
+        self._matrix = None                          # np.memmap, capacity x dim
+        self._rows: Dict[Any, int] = {}              # record id -> row holding its vector
+        self._owners: Dict[int, Any] = {}            # row -> record id
+        self._embedded: Dict[Any, str] = {}          # record id -> fingerprint of the embedded text
+        self._free: List[int] = []
+        self._records: Dict[Any, Dict[str, Any]] = {}
+        self._types: Dict[Any, str] = {}
+        self._pending: Dict[Any, str] = {}          # record id -> text still to embed
+        self._centroids = None
+        self._lists: List[set] = []
+        self._list_rows: Dict[int, np.ndarray] = {}  # list -> sorted row array, rebuilt lazily
+        self._assignment: Dict[int, int] = {}        # row -> list
+        self._trained_size = 0
+        self._loaded = False
+        self._lock = threading.RLock()
+        self._wake = threading.Event()
+        self._worker = None
+        self._latencies = deque(maxlen=500)
+        self.embedded_count = 0
+
+    # Storage --------------------------------------------------------------
+
+    def _is_writer(self) -> bool:
+        return self._writer_pid == os.getpid()
+
+    def _claim(self) -> bool:
+        """Become the writer if no other process is; True if this process is the writer"""
+        if self._is_writer():
+            return True
+        now = time.monotonic()
+        if now < self._next_claim:
+            return False
+        self._next_claim = now + WRITER_POLL_INTERVAL
+        try:
+            self._writer_lock.acquire()
+        except TimeoutError:
+            return False
+        # Never released: the lock goes with the process, and a reader takes over then
+        self._writer_pid = os.getpid()
+        with self._lock:
+            self._reopen()
+            # Records other workers changed that the previous writer had not embedded yet
+            for book_type, loader in self.loaders.items():
+                self._ingest(book_type, loader())
+            for item_id in [i for i in self._rows if i not in self._types]:
+                self._release(item_id)
+        print(f"Semantic index: process {os.getpid()} is now the embedding writer")
+        return True
+
+    def _open(self):
+        """Reopen the matrix and row map left by a previous run, if it used the same embedder"""
+        try:
+            version = os.stat(self._meta_path).st_mtime_ns
+            with open(self._meta_path, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._meta_version = version
+        if meta.get('embedder') != self.embedder.name or not os.path.exists(self._vectors_path):
+            print(f"Semantic index: embedder changed to {self.embedder.name}, re-embedding the catalog")
+            return
+        self._dim = meta['dim']
+        self._capacity = meta['capacity']
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode='r+' if self._is_writer() else 'r',
+                                 shape=(self._capacity, self._dim))
+        for item_id, row, fingerprint in meta['rows']:
+            self._rows[item_id] = row
+            self._owners[row] = item_id
+            self._embedded[item_id] = fingerprint
+        used = set(self._rows.values())
+        self._free = [row for row in range(self._capacity) if row not in used]
+
+    def _save_meta(self):
+        meta = {
+            'embedder': self.embedder.name,
+            'dim': self._dim,
+            'capacity': self._capacity,
+            'rows': [[item_id, row, self._embedded[item_id]] for item_id, row in self._rows.items()]
+        }
+        atomic_write(self._meta_path, json.dumps(meta))
+        self._meta_version = os.stat(self._meta_path).st_mtime_ns
+
+    def _follow(self):
+        """Pick up the rows the writer embedded since this process last read meta.json"""
+        if self._is_writer():
+            return
+        try:
+            version = os.stat(self._meta_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if version != self._meta_version:
+            with self._lock:
+                self._reopen()
+
+    def _reopen(self):
+        """Reload the row map from meta.json, re-assigning only the rows that changed"""
+        old_rows, old_embedded, old_dim = self._rows, self._embedded, self._dim
+        self._rows, self._owners, self._embedded, self._free = {}, {}, {}, []
+        self._dim, self._capacity, self._matrix = None, 0, None
+        self._open()
+        for item_id, text in list(self._pending.items()):
+            if self._embedded.get(item_id) == hashlib.sha1(text.encode('utf-8')).hexdigest():
+                del self._pending[item_id]
+        if self._dim != old_dim or self._needs_training():
+            self._train()
+            return
+        for item_id, row in old_rows.items():
+            if self._rows.get(item_id) != row:
+                self._unassign(row)
+        for item_id, row in self._rows.items():
+            if old_rows.get(item_id) != row or old_embedded.get(item_id) != self._embedded[item_id]:
+                self._assign(row)
+
+    def _reserve(self, count: int, dim: int):
+        """Make sure `count` free rows exist, growing the file by doubling"""
+        if self._dim is None:
+            self._dim = dim
+        if len(self._free) >= count:
+            return
+        capacity = max(64, self._capacity * 2, self._capacity + count - len(self._free))
+        os.makedirs(self.directory, exist_ok=True)
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        with open(self._vectors_path, 'ab') as f:
+            f.truncate(capacity * self._dim * 4)
+        self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self._dim))
+        # Rows are popped from the end: older free rows go first, then the new ones in order
+        self._free = list(range(capacity - 1, self._capacity - 1, -1)) + self._free
+        self._capacity = capacity
+
+    # Catalog changes ----------------------------------------------------------
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                self._open()
+                for book_type, loader in self.loaders.items():
+                    self._ingest(book_type, loader())
+                # Rows of records deleted while the app was not running
+                for item_id in [i for i in self._rows if i not in self._types]:
+                    self._release(item_id)
+                self._train()
+                self._loaded = True
+        if self._pending:
+            self._kick()
+
+    def warm(self):
+        """Build the index, and start the worker that embeds what the previous run left out"""
+        self._ensure_loaded()
+        self._kick()
+
+    def sync(self, book_type: str, records: Iterable[Dict[str, Any]], changes: Dict[Any, Any] = None):
+        """Queue records whose title or description changed; the worker embeds them.
+
+        changes, when given, maps the ids a commit touched to their new record
+        (None when deleted) and only those are looked at; records is not read.
+        """
+        with self._lock:
+            self._ingest(book_type, records, changes)
+            if not self._loaded or not self._pending:
+                return
+        self._kick()
+
+    def _ingest(self, book_type: str, records: Iterable[Dict[str, Any]], changes: Dict[Any, Any] = None):
+        if changes is not None:
+            for item_id, record in changes.items():
+                if record is None:
+                    self._forget(item_id)
+                else:
+                    self._store(book_type, record)
+            return
+        seen = set()
+        for record in records:
+            seen.add(record['id'])
+            self._store(book_type, record)
+        for item_id in [i for i, t in self._types.items() if t == book_type and i not in seen]:
+            self._forget(item_id)
+
+    def _store(self, book_type: str, record: Dict[str, Any]):
+        item_id = record['id']
+        self._types[item_id] = book_type
+        self._records[item_id] = {
+            'id': item_id,
+            'title': record.get('title', ''),
+            'author': record.get('author', ''),
+            'img': record.get('img', ''),
+            'subject': record.get('subject', ''),
+            'bookType': book_type
+        }
+        text = embedding_text(record)
+        if self._embedded.get(item_id) != hashlib.sha1(text.encode('utf-8')).hexdigest():
+            self._pending[item_id] = text
+        else:
+            self._pending.pop(item_id, None)
+
+    def _forget(self, item_id):
+        for store in (self._types, self._records, self._pending):
+            store.pop(item_id, None)
+        self._release(item_id)
+
+    def _release(self, item_id):
+        row = self._rows.pop(item_id, None)
+        self._embedded.pop(item_id, None)
+        if row is not None:
+            self._owners.pop(row, None)
+            self._unassign(row)
+            self._free.append(row)
+
+    def _kick(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(WRITER_POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                if self._is_writer() and self.poll is not None:
+                    self.poll()
+                self.refresh()
+            except Exception as e:
+                print(f"Semantic index refresh failed: {e}")
+
+    def refresh(self) -> int:
+        """Embed queued records in batches; returns how many rows were written, 0 outside the writer"""
+        if not self._claim():
+            self._follow()
+            return 0
+        written = 0
+        checkpoint = time.monotonic()
+        while True:
+            with self._lock:
+                batch = list(self._pending.items())[:EMBED_BATCH_SIZE]
+            if not batch:
+                break
+            # The model call runs outside the lock so searches keep being served
+            vectors = self.embedder.embed([text for _, text in batch])
+            if vectors is None:
+                break   # retried on the next save or search
+            with self._lock:
+                self._reserve(len(batch), vectors.shape[1])
+                for (item_id, text), vector in zip(batch, vectors):
+                    if self._pending.get(item_id) != text:
+                        continue   # changed again or deleted while embedding
+                    del self._pending[item_id]
+                    row = self._rows.get(item_id)
+                    if row is None:
+                        row = self._rows[item_id] = self._free.pop()
+                        self._owners[row] = item_id
+                    self._matrix[row] = vector
+                    self._embedded[item_id] = hashlib.sha1(text.encode('utf-8')).hexdigest()
+                    self._assign(row)
+                    written += 1
+                if time.monotonic() - checkpoint > CHECKPOINT_INTERVAL:
+                    # Rows embedded after the last checkpoint are redone if the process dies
+                    self._checkpoint()
+                    checkpoint = time.monotonic()
+        if written:
+            self.embedded_count += written
+            with self._lock:
+                self._checkpoint()
+                if self._needs_training():
+                    self._train()
+        return written
+
+    def _checkpoint(self):
+        self._matrix.flush()
+        self._save_meta()
+
+    # IVF index ------------------------------------------------------------
+
+    def _needs_training(self) -> bool:
+        size = len(self._rows)
+        if self._centroids is None:
+            return size >= IVF_MIN_RECORDS
+        return size > IVF_RETRAIN_GROWTH * self._trained_size
+
+    def _train(self):
+        """Spherical k-means over a sample of the rows, then assign every row to its nearest list"""
+        self._assignment, self._lists, self._list_rows = {}, [], {}
+        rows = np.fromiter(self._rows.values(), dtype=np.int64, count=len(self._rows))
+        if rows.size < IVF_MIN_RECORDS:
+            self._centroids = None
+            return
+        start = time.perf_counter()
+        rows.sort()
+        n_lists = int(np.sqrt(rows.size))
+        rng = np.random.default_rng(0)
+        sample = self._matrix[np.sort(rng.choice(rows, min(rows.size, n_lists * KMEANS_SAMPLE_PER_LIST), replace=False))]
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)]
+        for _ in range(KMEANS_ITERATIONS):
+            nearest = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, nearest, sample)
+            empty = np.bincount(nearest, minlength=n_lists) == 0
+            # An empty list keeps its old centroid rather than collapsing to zero
+            sums[empty] = centroids[empty]
+            centroids = _normalize_rows(sums)
+        self._centroids = centroids
+        self._lists = [set() for _ in range(n_lists)]
+        for begin in range(0, rows.size, 4096):
+            block = rows[begin:begin + 4096]
+            for row, list_no in zip(block.tolist(), np.argmax(self._matrix[block] @ centroids.T, axis=1).tolist()):
+                self._assignment[row] = list_no
+                self._lists[list_no].add(row)
+        self._trained_size = rows.size
+        print(f"Semantic index trained: {rows.size} records in {n_lists} lists "
+              f"in {round((time.perf_counter() - start) * 1000, 2)} ms")
+
+    def _assign(self, row: int):
+        if self._centroids is None:
+            return
+        self._unassign(row)
+        list_no = int(np.argmax(self._centroids @ self._matrix[row]))
+        self._assignment[row] = list_no
+        self._lists[list_no].add(row)
+        self._list_rows.pop(list_no, None)
+
+    def _unassign(self, row: int):
+        list_no = self._assignment.pop(row, None)
+        if list_no is not None:
+            self._lists[list_no].discard(row)
+            self._list_rows.pop(list_no, None)
+
+    def _candidate_rows(self, query: np.ndarray) -> np.ndarray:
+        if self._centroids is None:
+            return np.fromiter(self._rows.values(), dtype=np.int64, count=len(self._rows))
+        probes = min(self.probes, len(self._lists))
+        nearest = np.argpartition(-(self._centroids @ query), probes - 1)[:probes]
+        parts = []
+        for list_no in nearest.tolist():
+            rows = self._list_rows.get(list_no)
+            if rows is None:
+                rows = self._list_rows[list_no] = np.array(sorted(self._lists[list_no]), dtype=np.int64)
+            parts.append(rows)
+        return np.concatenate(parts)
+
+    # Queries --------------------------------------------------------------
+
+    def search(self, query: str, limit: int = 10) -> Optional[List[Dict[str, Any]]]:
+        """Records closest in meaning to the query, best first.
+
+        None when the query cannot be embedded, or when nothing is embedded yet:
+        the catalog is embedded in the background, never on a search.
+        """
+        self._ensure_loaded()
+        self._follow()
+        if not self._rows:
+            return None
+        start = time.perf_counter()
+        vectors = self.embedder.embed([query])
+        if vectors is None:
+            return None
+        with self._lock:
+            if self._matrix is None or not self._rows:
+                return None
+            if vectors.shape[1] != self._dim:
+                return None
+            rows = self._candidate_rows(vectors[0])
+            if not rows.size:
+                return []
+            scores = self._matrix[rows] @ vectors[0]
+            if rows.size > limit:
+                top = np.argpartition(-scores, limit - 1)[:limit]
+            else:
+                top = np.arange(rows.size)
+            top = top[np.argsort(-scores[top], kind='stable')]
+            results = []
+            for index in top.tolist():
+                record = self._records.get(self._owners.get(int(rows[index])))
+                if record:
+                    results.append(dict(record, score=round(float(scores[index]), 4)))
+        self._latencies.append((time.perf_counter() - start) * 1000)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                'embedder': self.embedder.name,
+                'writer': self._is_writer(),
+                'records': len(self._records),
+                'embedded': len(self._rows),
+                'pending': len(self._pending),
+                'lists': len(self._lists),
+                'probes': self.probes,
+                'avg_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                'p95_ms': round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else 0.0
+            }
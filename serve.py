@@ -0,0 +1,245 @@
+"""Production server: the app under gunicorn with preloaded, shared indexes.
+
+The master imports the app and builds the catalog snapshot and indexes once,
+then forks the workers, so their memory starts out shared copy-on-write
+instead of every worker parsing the catalog itself. Workers start their own
+background threads (Ollama connection, embedding, similar-items neighbours,
+compaction) after the fork.
+
+Reloads replace workers without dropping connections: new workers are forked
+and the old ones finish their requests before exiting. A reload runs on
+SIGHUP. With STUDYHUB_STORAGE=files it also runs on its own when a catalog
+file changed on disk since the last one, at most once per --reload-interval,
+as that is how one worker's saves and edits made outside the app reach the
+others. Under the operation log the workers follow each other's commits
+through the log, and every compaction rewrites the catalog files, so they
+are not watched.
+
+Workers do not connect to Ollama when they start: each one opens its SSH
+session on its first chat or embedding request, so only workers that serve
+chat pay for paramiko and the connection. A gevent server, usually the one
+serving /api/ollama/, connects right after the fork; set OLLAMA_WARMUP to
+choose either way explicitly.
+
+Worker classes:
+
+* ``gthread`` - processes with a thread pool each (default)
+* ``gevent``  - one event loop per process for long-lived chat requests;
+  needs ``pip install gevent``. Run a second server on its own port for
+  /api/ollama/ and route that prefix to it.
+
+Usage:
+    python serve.py --bind 0.0.0.0:8000 --workers 4 --threads 8
+    python serve.py --bind 127.0.0.1:8001 --worker-class gevent --worker-connections 200
+    python serve.py --profile-startup
+"""
+import argparse
+import gc
+import os
+import signal
+import threading
+import time
+
+from gunicorn.app.base import BaseApplication
+from gunicorn.workers.gthread import ThreadWorker
+
+from oplog import LoggedJsonStore
+
+# Longest a worker may spend on one request; chat answers can take a while
+DEFAULT_TIMEOUT = 120
+
+# Seconds between checks of the catalog files for changes
+RELOAD_POLL_INTERVAL = 5.0
+
+# A stopping worker keeps serving connections it already accepted this long
+DRAIN_SECONDS = 0.5
+
+
+def default_workers() -> int:
+    return int(os.environ.get('STUDYHUB_WORKERS', (os.cpu_count() or 1) * 2 + 1))
+
+
+def default_threads() -> int:
+    return int(os.environ.get('STUDYHUB_THREADS', 4))
+
+
+def catalog_mtimes(file_paths):
+    mtimes = {}
+    for file_path in file_paths:
+        try:
+            mtimes[file_path] = os.stat(file_path).st_mtime_ns
+        except FileNotFoundError:
+            mtimes[file_path] = 0
+    return mtimes
+
+
+class CatalogWatcher:
+    """Asks the master for a graceful reload when a catalog file changed on disk.
+
+    Only stats files: the thread runs in the master, which forks workers,
+    and must never hold a lock a worker could inherit.
+    """
+
+    def __init__(self, file_paths, interval: float):
+        self.file_paths = list(file_paths)
+        self.interval = interval
+        self._seen = catalog_mtimes(self.file_paths)
+        self._last_reload = time.monotonic()
+
+    def mark_reloaded(self):
+        self._seen = catalog_mtimes(self.file_paths)
+        self._last_reload = time.monotonic()
+
+    def start(self):
+        threading.Thread(target=self._run, name='catalog-watcher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(min(RELOAD_POLL_INTERVAL, self.interval))
+            if time.monotonic() - self._last_reload < self.interval:
+                continue
+            if catalog_mtimes(self.file_paths) != self._seen:
+                print("Catalog changed on disk, reloading workers")
+                self._last_reload = time.monotonic()
+                os.kill(os.getpid(), signal.SIGHUP)
+
+
+def catalog_watcher(studyhub, interval: float):
+    """A CatalogWatcher for the files backend, or None"""
+    if interval <= 0 or isinstance(studyhub.json_store, LoggedJsonStore):
+        return None
+    return CatalogWatcher(studyhub.CATALOG_FILES, interval)
+
+
+class DrainingThreadWorker(ThreadWorker):
+    """gunicorn's gthread worker, made to stop accepting before it stops.
+
+    The stock worker leaves its loop as soon as it is told to exit and drops
+    connections it accepted but had not read yet, which shows up as resets
+    during a reload. This one unregisters the listeners first and exits once
+    those connections had DRAIN_SECONDS to reach the thread pool.
+    """
+
+    def handle_exit(self, sig, frame):
+        with self._lock:
+            for sock in self.sockets:
+                try:
+                    self.poller.unregister(sock)
+                except (KeyError, ValueError):
+                    pass
+        threading.Timer(DRAIN_SECONDS, super().handle_exit, (sig, frame)).start()
+
+
+class StudyHubServer(BaseApplication):
+    def __init__(self, application, options: dict):
+        self.application = application
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def build_options(args, studyhub, watcher) -> dict:
+    """gunicorn settings, with hooks that keep preloaded state valid across forks"""
+
+    def when_ready(server):
+        if watcher is not None:
+            watcher.start()
+
+    def on_reload(server):
+        # Runs in the master after SIGHUP, before the new workers are forked
+        studyhub.refresh_catalog()
+        gc.freeze()
+        if watcher is not None:
+            watcher.mark_reloaded()
+
+    def pre_fork(server, worker):
+        # A save still pending in the master would be written by two processes
+        studyhub.json_store.flush()
+
+    def post_fork(server, worker):
+        studyhub.start_background_services()
+
+    def worker_exit(server, worker):
+        studyhub.json_store.flush()
+
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        # By name: gunicorn 21 cannot describe a worker class passed as an object
+        'worker_class': f'{__name__}.DrainingThreadWorker' if args.worker_class == 'gthread' else args.worker_class,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'keepalive': args.keepalive,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10 if args.max_requests else 0,
+        'preload_app': True,
+        'accesslog': args.access_log,
+        'when_ready': when_ready,
+        'on_reload': on_reload,
+        'pre_fork': pre_fork,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit
+    }
+    if args.worker_class == 'gthread':
+        options['threads'] = args.threads
+    else:
+        options['worker_connections'] = args.worker_connections
+    return options
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run AIStudyHub under gunicorn')
+    parser.add_argument('--bind', default=os.environ.get('STUDYHUB_BIND', '127.0.0.1:8000'))
+    parser.add_argument('--workers', type=int, default=default_workers(), help='worker processes')
+    parser.add_argument('--threads', type=int, default=default_threads(), help='threads per gthread worker')
+    parser.add_argument('--worker-class', choices=['gthread', 'gevent'],
+                        default=os.environ.get('STUDYHUB_WORKER_CLASS', 'gthread'))
+    parser.add_argument('--worker-connections', type=int, default=100,
+                        help='concurrent requests per gevent worker')
+    parser.add_argument('--timeout', type=int, default=DEFAULT_TIMEOUT)
+    parser.add_argument('--graceful-timeout', type=int, default=30,
+                        help='seconds old workers get to finish requests on reload or shutdown')
+    parser.add_argument('--keepalive', type=int, default=5)
+    parser.add_argument('--max-requests', type=int, default=0,
+                        help='recycle a worker after this many requests (0: never)')
+    parser.add_argument('--reload-interval', type=float,
+                        default=float(os.environ.get('STUDYHUB_RELOAD_INTERVAL', 300)),
+                        help='least seconds between catalog-triggered reloads under STUDYHUB_STORAGE=files '
+                             '(0: only on SIGHUP)')
+    parser.add_argument('--access-log', default=None, help="file for the access log, '-' for stdout")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='report import time per module instead of serving')
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        from tools.profile_startup import report
+        report()
+        return
+
+    # Read by start_background_services() in each worker after the fork
+    os.environ.setdefault('OLLAMA_WARMUP', '1' if args.worker_class == 'gevent' else '0')
+    if args.worker_class == 'gevent':
+        try:
+            from gevent import monkey
+        except ImportError:
+            raise SystemExit("--worker-class gevent needs gevent: pip install gevent")
+        # Before the app is imported, so its locks and sockets are cooperative
+        monkey.patch_all()
+    import app as studyhub
+    studyhub.preload()
+    # Keep the collector from writing to the shared objects and unsharing their pages
+    gc.freeze()
+
+    watcher = catalog_watcher(studyhub, args.reload_interval)
+    StudyHubServer(studyhub.app, build_options(args, studyhub, watcher)).run()
+
+
+if __name__ == '__main__':
+    main()
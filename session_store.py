@@ -0,0 +1,413 @@
+"""Server-side sessions: the cookie carries only a random session id.
+
+Flask's default session is the whole session dict, signed and sent back and
+forth in a cookie on every request. Here the data stays on the server and
+the cookie holds a 256-bit id. Session data is kept in a backend:
+
+* ``memory`` - a dict in this process; the development server or one worker
+* ``file``   - one small JSON file per session, shared by workers on one host
+* ``sqlite`` - one table in a SQLite file, shared by workers on one host
+* ``cache``  - entries in the cache_store cache; with its kv backend,
+  shared by every node behind a load balancer
+
+Sessions expire SESSION_TTL seconds after they were last used. A session
+read within SESSION_TOUCH_INTERVAL of its last write is not written again
+just to move its expiry, and expired sessions are purged every
+SESSION_PURGE_INTERVAL. In front of the file and SQLite backends, each
+process keeps the sessions it used most recently in a hot set. A hot
+session is served after a version check (an os.stat or a primary-key
+lookup), so a logout in one worker is seen at once by the others.
+"""
+import json
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from storage import atomic_write
+
+SESSION_BACKENDS = ('memory', 'file', 'sqlite', 'cache')
+
+# Idle seconds before a session expires
+SESSION_TTL = 24 * 3600
+
+# A session is rewritten to extend its expiry at most this often
+SESSION_TOUCH_INTERVAL = 300
+
+# Seconds between sweeps for expired sessions
+SESSION_PURGE_INTERVAL = 600
+
+# Sessions each process keeps decoded in memory
+SESSION_HOT_SET = 1024
+
+SESSION_ID = re.compile(r'[A-Za-z0-9_-]{43}')
+
+
+def new_session_id() -> str:
+    return secrets.token_urlsafe(32)
+
+
+class MemorySessionBackend:
+    """Sessions in a dict; lost on restart and private to the process"""
+
+    shared = False
+
+    def __init__(self):
+        self._sessions: Dict[str, Tuple[str, float]] = {}   # sid -> (data, expires)
+        self._lock = threading.Lock()
+
+    def load(self, sid: str) -> Optional[Tuple[str, float, Any]]:
+        with self._lock:
+            entry = self._sessions.get(sid)
+        return (entry[0], entry[1], None) if entry else None
+
+    def save(self, sid: str, text: str, expires: float):
+        with self._lock:
+            self._sessions[sid] = (text, expires)
+
+    def touch(self, sid: str, expires: float):
+        with self._lock:
+            if sid in self._sessions:
+                self._sessions[sid] = (self._sessions[sid][0], expires)
+
+    def delete(self, sid: str):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def purge(self, now: float) -> int:
+        with self._lock:
+            expired = [sid for sid, (_, expires) in self._sessions.items() if expires < now]
+            for sid in expired:
+                del self._sessions[sid]
+        return len(expired)
+
+    def count(self) -> int:
+        return len(self._sessions)
+
+
+class FileSessionBackend:
+    """One JSON file per session; its mtime is its last use, its inode and mtime its version"""
+
+    shared = True
+
+    def __init__(self, directory: str, ttl: float = SESSION_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid: str) -> str:
+        return os.path.join(self.directory, sid + '.json')
+
+    def version(self, sid: str):
+        try:
+            stat = os.stat(self._path(sid))
+        except FileNotFoundError:
+            return None
+        # Every save renames a new file into place, so the inode changes even within one mtime tick
+        return stat.st_ino, stat.st_mtime_ns
+
+    def load(self, sid: str) -> Optional[Tuple[str, float, Any]]:
+        try:
+            with open(self._path(sid), 'r') as f:
+                text = f.read()
+                stat = os.fstat(f.fileno())
+        except FileNotFoundError:
+            return None
+        return text, stat.st_mtime_ns / 1e9 + self.ttl, (stat.st_ino, stat.st_mtime_ns)
+
+    def save(self, sid: str, text: str, expires: float):
+        atomic_write(self._path(sid), text)
+        return self.version(sid)
+
+    def touch(self, sid: str, expires: float):
+        """Moving the mtime moves the version too; returns the new one"""
+        try:
+            os.utime(self._path(sid), (expires - self.ttl, expires - self.ttl))
+        except FileNotFoundError:
+            return None
+        return self.version(sid)
+
+    def delete(self, sid: str):
+        try:
+            os.unlink(self._path(sid))
+        except FileNotFoundError:
+            pass
+
+    def purge(self, now: float) -> int:
+        purged = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json') and entry.stat().st_mtime + self.ttl < now:
+                try:
+                    os.unlink(entry.path)
+                    purged += 1
+                except FileNotFoundError:
+                    pass
+        return purged
+
+    def count(self) -> int:
+        return sum(1 for name in os.listdir(self.directory) if name.endswith('.json'))
+
+
+class SqliteSessionBackend:
+    """Sessions in one SQLite table; each write gives the row a new random version"""
+
+    shared = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        db = self._db()
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                   'id TEXT PRIMARY KEY, data TEXT NOT NULL, expires REAL NOT NULL, version INTEGER NOT NULL)')
+        db.execute('CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)')
+
+    def _db(self) -> sqlite3.Connection:
+        """A connection per thread; a forked worker opens its own"""
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.db = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            self._local.db.execute('PRAGMA synchronous=NORMAL')
+            self._local.pid = os.getpid()
+        return self._local.db
+
+    def version(self, sid: str):
+        row = self._db().execute('SELECT version FROM sessions WHERE id = ?', (sid,)).fetchone()
+        return row[0] if row else None
+
+    def load(self, sid: str) -> Optional[Tuple[str, float, Any]]:
+        return self._db().execute('SELECT data, expires, version FROM sessions WHERE id = ?', (sid,)).fetchone()
+
+    def save(self, sid: str, text: str, expires: float):
+        version = secrets.randbits(62)
+        self._db().execute('INSERT OR REPLACE INTO sessions (id, data, expires, version) VALUES (?, ?, ?, ?)',
+                           (sid, text, expires, version))
+        return version
+
+    def touch(self, sid: str, expires: float):
+        self._db().execute('UPDATE sessions SET expires = ? WHERE id = ?', (expires, sid))
+
+    def delete(self, sid: str):
+        self._db().execute('DELETE FROM sessions WHERE id = ?', (sid,))
+
+    def purge(self, now: float) -> int:
+        return self._db().execute('DELETE FROM sessions WHERE expires < ?', (now,)).rowcount
+
+    def count(self) -> int:
+        return self._db().execute('SELECT COUNT(*) FROM sessions').fetchone()[0]
+
+
+class CacheSessionBackend:
+    """Sessions as cache entries that expire with their TTL; a version key next to each makes hot checks cheap.
+
+    A session is only as durable as the cache: one the kv server evicts or
+    loses is logged out, so give the server enough memory not to evict.
+    """
+
+    shared = True
+
+    def __init__(self, namespace):
+        self.namespace = namespace   # a cache_store.CacheNamespace without a near copy
+
+    def version(self, sid: str):
+        return self.namespace.get(sid + ':version')
+
+    def load(self, sid: str) -> Optional[Tuple[str, float, Any]]:
+        entry = self.namespace.get(sid)
+        return tuple(entry) if entry else None
+
+    def save(self, sid: str, text: str, expires: float):
+        version = secrets.randbits(62)
+        ttl = max(1.0, expires - time.time())
+        self.namespace.set(sid, [text, expires, version], ttl)
+        self.namespace.set(sid + ':version', version, ttl)
+        return version
+
+    def touch(self, sid: str, expires: float):
+        """Rewrites the entry to move its TTL; returns the new version"""
+        entry = self.load(sid)
+        return self.save(sid, entry[0], expires) if entry else None
+
+    def delete(self, sid: str):
+        self.namespace.delete(sid)
+        self.namespace.delete(sid + ':version')
+
+    def purge(self, now: float) -> int:
+        # Entries expire on their own
+        return 0
+
+    def count(self) -> Optional[int]:
+        return None
+
+
+class SessionStore:
+    """Session data by id over a backend, with expiry and a per-process hot set"""
+
+    def __init__(self, backend, ttl: float = SESSION_TTL, hot_size: int = SESSION_HOT_SET):
+        self.backend = backend
+        self.ttl = ttl
+        self.hot_size = hot_size if backend.shared else 0
+        self._hot: 'OrderedDict[str, Tuple[str, float, Any]]' = OrderedDict()   # sid -> (data, expires, version)
+        self._lock = threading.Lock()
+        self._next_purge = time.time() + SESSION_PURGE_INTERVAL
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.touches = 0
+        self.purged = 0
+
+    def get(self, sid: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        self._maybe_purge(now)
+        entry = None
+        with self._lock:
+            hot = self._hot.get(sid)
+            if hot is not None:
+                self._hot.move_to_end(sid)
+        # The hot copy stands only while nobody else has written or dropped the session
+        if hot is not None and self.backend.version(sid) == hot[2]:
+            entry = hot
+            self.hits += 1
+        else:
+            entry = self.backend.load(sid)
+            self.misses += 1
+        if entry is None or entry[1] < now:
+            self._forget(sid)
+            return None
+        if entry[1] - now < self.ttl - SESSION_TOUCH_INTERVAL:
+            version = self.backend.touch(sid, now + self.ttl)
+            self.touches += 1
+            entry = (entry[0], now + self.ttl, entry[2] if version is None else version)
+        self._remember(sid, entry)
+        return json.loads(entry[0])
+
+    def save(self, sid: str, data: Dict[str, Any]):
+        text = json.dumps(data)
+        expires = time.time() + self.ttl
+        version = self.backend.save(sid, text, expires)
+        self.writes += 1
+        self._remember(sid, (text, expires, version))
+
+    def delete(self, sid: str):
+        self.backend.delete(sid)
+        self._forget(sid)
+
+    def _remember(self, sid: str, entry: Tuple[str, float, Any]):
+        if not self.hot_size:
+            return
+        with self._lock:
+            self._hot[sid] = entry
+            self._hot.move_to_end(sid)
+            while len(self._hot) > self.hot_size:
+                self._hot.popitem(last=False)
+
+    def _forget(self, sid: str):
+        with self._lock:
+            self._hot.pop(sid, None)
+
+    def _maybe_purge(self, now: float):
+        with self._lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + SESSION_PURGE_INTERVAL
+        try:
+            self.purged += self.backend.purge(now)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error purging expired sessions: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': type(self.backend).__name__,
+            'sessions': self.backend.count(),
+            'hot': len(self._hot),
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'touches': self.touches,
+            'purged': self.purged
+        }
+
+
+def make_session_store(backend: str, data_dir: str, ttl: float = SESSION_TTL, cache=None) -> SessionStore:
+    if backend not in SESSION_BACKENDS:
+        raise ValueError(f"session backend must be one of {', '.join(SESSION_BACKENDS)}")
+    if backend == 'memory':
+        return SessionStore(MemorySessionBackend(), ttl)
+    if backend == 'file':
+        return SessionStore(FileSessionBackend(os.path.join(data_dir, 'sessions'), ttl), ttl)
+    if backend == 'cache':
+        if cache is None or cache.kind == 'memory':
+            raise ValueError("the cache session backend needs STUDYHUB_CACHE_BACKEND=shared or kv")
+        # Sessions change under the same key, so they must not be served from a near copy
+        return SessionStore(CacheSessionBackend(cache.namespace('sessions', ttl, near=False)), ttl)
+    return SessionStore(SqliteSessionBackend(os.path.join(data_dir, 'sessions.sqlite3')), ttl)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """The session dict of one request; only its id goes into the cookie"""
+
+    def __init__(self, initial=None, sid: str = None, new: bool = False):
+        def on_update(session):
+            session.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.replaced_sid = None
+
+    def regenerate(self):
+        """Move the data to a fresh id, e.g. on login, so an id known before it is worthless after"""
+        if not self.new and self.replaced_sid is None:
+            self.replaced_sid = self.sid
+        self.sid = new_session_id()
+        self.new = True
+        self.modified = True
+
+
+class ServerSideSessionInterface(SessionInterface):
+    def __init__(self, store: SessionStore):
+        self.store = store
+
+    def open_session(self, app, request) -> ServerSession:
+        # Static files never look at the session; don't touch the store for them
+        if app.static_url_path and request.path.startswith(app.static_url_path + '/'):
+            return ServerSession(sid=new_session_id(), new=True)
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and SESSION_ID.fullmatch(sid):
+            data = self.store.get(sid)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+        return ServerSession(sid=new_session_id(), new=True)
+
+    def save_session(self, app, session: ServerSession, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.replaced_sid is not None:
+            self.store.delete(session.replaced_sid)
+        if not session:
+            # Emptied, e.g. by logout: drop it on both sides
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        response.vary.add('Cookie')
+        if session.modified:
+            self.store.save(session.sid, dict(session))
+        if session.new or session.permanent:
+            response.set_cookie(
+                name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app)
+            )
@@ -0,0 +1,406 @@
+""""More like this" neighbours for catalog records.
+
+Each record becomes an L2-normalised TF-IDF vector over hashed features from
+its title, description, subject, level and author, stored as rows of a sparse
+float32 matrix. The top-k neighbours of every record are computed up front in
+blocks, so a lookup is a dictionary read. The full build runs on a background
+thread and leaves out features common to a large share of the catalog, which
+keeps the products sparse. When a catalog file is saved only the changed
+records are re-vectorised; their rows are spliced into the matrix, their
+neighbour lists are recomputed with one sparse product and they are inserted
+into the lists they now belong to.
+"""
+import hashlib
+import json
+import threading
+import time
+import zlib
+from typing import Dict, Any, List, Callable, Iterable, Optional, Tuple
+
+import numpy as np
+
+from catalog_retrieval import tokenize
+
+# Hashed feature space; collisions only blur similarity slightly at this size
+NUM_FEATURES = 1 << 20
+
+# Weight of each field's features; whole-value features let exact subject/level/author matches count
+FIELD_WEIGHTS = {'title': 2.0, 'description': 1.0, 'subject': 1.5, 'level': 0.5, 'author': 1.0}
+WHOLE_VALUE_FIELDS = {'subject', 'level', 'author'}
+
+# Rows scored per block during a full build; bounds memory at BLOCK x records floats
+BUILD_BLOCK_ROWS = 128
+
+# Features found in more records than this are left out of the vectors (a max_df cut):
+# they say little about similarity and would make every block product dense
+MAX_FEATURE_RECORDS = 1000
+
+# Recompute IDF from scratch once this share of the catalog has changed incrementally
+REBUILD_CHANGE_RATIO = 0.2
+
+
+def _feature(text: str) -> int:
+    return zlib.crc32(text.encode('utf-8')) % NUM_FEATURES
+
+
+def record_features(record: Dict[str, Any]) -> Dict[int, float]:
+    """Hashed term counts, weighted by field"""
+    features: Dict[int, float] = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        value = str(record.get(field) or '')
+        if not value:
+            continue
+        for term in tokenize(value):
+            index = _feature(f"{field}:{term}")
+            features[index] = features.get(index, 0.0) + weight
+        if field in WHOLE_VALUE_FIELDS:
+            index = _feature(f"{field}=" + ' '.join(value.lower().split()))
+            features[index] = features.get(index, 0.0) + weight
+    return features
+
+
+def _fingerprint(record: Dict[str, Any]) -> str:
+    fields = {field: record.get(field) for field in FIELD_WEIGHTS}
+    return hashlib.sha1(json.dumps(fields, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _stack(vectors: List[Tuple[np.ndarray, np.ndarray]]):
+    """CSR matrix with one row per (indices, values) vector"""
+    # Imported on first build; scipy dominates the module's import time
+    from scipy import sparse
+
+    indptr = np.zeros(len(vectors) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(cols) for cols, _ in vectors])
+    return sparse.csr_matrix(
+        (np.concatenate([vals for _, vals in vectors]) if vectors else np.zeros(0, dtype=np.float32),
+         np.concatenate([cols for cols, _ in vectors]) if vectors else np.zeros(0, dtype=np.int64),
+         indptr),
+        shape=(len(vectors), NUM_FEATURES), dtype=np.float32)
+
+
+class SimilarItemsIndex:
+    """Precomputed top-k similar records per catalog record"""
+
+    def __init__(self, loaders: Dict[str, Callable[[], list]], k: int = 10):
+        self.loaders = loaders
+        self.k = k
+        self._ids: List[Any] = []              # row -> record id, None when free
+        self._rows: Dict[Any, int] = {}        # record id -> row
+        self._free: List[int] = []
+        self._features: Dict[Any, Dict[int, float]] = {}
+        self._vectors: Dict[Any, Tuple[np.ndarray, np.ndarray]] = {}
+        self._cited_by: Dict[Any, set] = {}    # record id -> records whose lists include it
+        self._fingerprints: Dict[Any, str] = {}
+        self._records: Dict[Any, Dict[str, Any]] = {}   # record id -> compact record
+        self._types: Dict[Any, str] = {}
+        self._idf = None
+        self._matrix = None
+        self._neighbours: Dict[Any, List[Tuple[Any, float]]] = {}
+        self._kth = np.zeros(0, dtype=np.float32)   # k-th best score per row, 0 if fewer than k
+        self._changes_since_build = 0
+        self._changed_during_build = None      # ids synced while a build runs, applied after it
+        self._ingested = False
+        self._loaded = False
+        self._lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._builder = None
+        self.last_build_ms = 0.0
+        self.last_sync_ms = 0.0
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._build_lock:
+            if self._loaded:
+                return
+            with self._lock:
+                if not self._ingested:
+                    for book_type, loader in self.loaders.items():
+                        self._ingest(book_type, loader())
+                    self._ingested = True
+            self._build()
+
+    def warm(self):
+        """Build the index now rather than on the first lookup"""
+        self._ensure_loaded()
+
+    def _start(self, target: Callable):
+        """Run a build on a background thread unless one is already running"""
+        with self._lock:
+            if self._builder is None or not self._builder.is_alive():
+                self._builder = threading.Thread(target=target, name='similar-items-build', daemon=True)
+                self._builder.start()
+
+    def _rebuild(self):
+        with self._build_lock:
+            self._build()
+
+    def _ingest(self, book_type: str, records: Iterable[Dict[str, Any]],
+                changes: Dict[Any, Any] = None) -> Tuple[set, set]:
+        """Store records for one source; returns (changed ids, removed ids)"""
+        changed, removed = set(), set()
+        if changes is not None:
+            for item_id, record in changes.items():
+                if record is None:
+                    if item_id in self._types:
+                        removed.add(item_id)
+                elif self._store(book_type, record):
+                    changed.add(item_id)
+        else:
+            seen = set()
+            for record in records:
+                seen.add(record['id'])
+                if self._store(book_type, record):
+                    changed.add(record['id'])
+            removed = {item_id for item_id, t in self._types.items() if t == book_type and item_id not in seen}
+        for item_id in removed:
+            for store in (self._types, self._records, self._fingerprints, self._features, self._vectors):
+                store.pop(item_id, None)
+        return changed, removed
+
+    def _store(self, book_type: str, record: Dict[str, Any]) -> bool:
+        """Keep one record; True when its indexed fields changed"""
+        item_id = record['id']
+        self._types[item_id] = book_type
+        self._records[item_id] = {
+            'id': item_id,
+            'title': record.get('title', ''),
+            'author': record.get('author', ''),
+            'img': record.get('img', ''),
+            'subject': record.get('subject', ''),
+            'bookType': book_type
+        }
+        fingerprint = _fingerprint(record)
+        if self._fingerprints.get(item_id) == fingerprint:
+            return False
+        self._fingerprints[item_id] = fingerprint
+        self._features[item_id] = record_features(record)
+        return True
+
+    def _vector(self, features: Dict[int, float], idf: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        idf = self._idf if idf is None else idf
+        indices = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+        values = np.fromiter(features.values(), dtype=np.float32, count=len(features))
+        # Features first seen after the last build carry the idf of an unseen term;
+        # those cut for being too common have an idf of 0 and are dropped
+        values = (1.0 + np.log(values)) * idf[indices]
+        kept = values > 0
+        indices, values = indices[kept], values[kept]
+        norm = np.linalg.norm(values)
+        return indices, (values / norm if norm > 0 else values)
+
+    def _build(self):
+        """Recompute IDF and every neighbour list; call with the build lock held.
+
+        The products run without the index lock, so lookups keep answering
+        from the previous build and syncs keep being applied; records synced
+        meanwhile are applied again once the new build is in place.
+        """
+        start = time.perf_counter()
+        with self._lock:
+            features = dict(self._features)
+            self._changed_during_build = set()
+        n = len(features)
+        df = np.zeros(NUM_FEATURES, dtype=np.int32)
+        if n:
+            np.add.at(df, np.concatenate([np.fromiter(f.keys(), dtype=np.int64, count=len(f))
+                                          for f in features.values()]), 1)
+        idf = (np.log((1 + n) / (1 + df)) + 1).astype(np.float32)
+        idf[df > MAX_FEATURE_RECORDS] = 0
+        ids = list(features)
+        vectors = {item_id: self._vector(features[item_id], idf) for item_id in ids}
+        matrix = _stack([vectors[item_id] for item_id in ids])
+
+        neighbours = {}
+        transposed = matrix.T.tocsr()
+        for begin in range(0, n, BUILD_BLOCK_ROWS):
+            product = matrix[begin:begin + BUILD_BLOCK_ROWS] @ transposed
+            for offset in range(product.shape[0]):
+                row = begin + offset
+                cols = product.indices[product.indptr[offset]:product.indptr[offset + 1]]
+                scores = product.data[product.indptr[offset]:product.indptr[offset + 1]]
+                neighbours[ids[row]] = self._top(ids, row, cols, scores)
+
+        with self._lock:
+            self._idf, self._matrix, self._vectors = idf, matrix, vectors
+            self._ids, self._rows, self._free = ids, {item_id: row for row, item_id in enumerate(ids)}, []
+            self._neighbours, self._cited_by = neighbours, {}
+            self._kth = np.zeros(n, dtype=np.float32)
+            for row, item_id in enumerate(ids):
+                for neighbour, _ in neighbours[item_id]:
+                    self._cited_by.setdefault(neighbour, set()).add(item_id)
+                self._kth[row] = self._kth_for(item_id)
+            self._changes_since_build = 0
+            self._loaded = True
+            pending, self._changed_during_build = self._changed_during_build, None
+            if pending:
+                self._update({i for i in pending if i in self._features}, {i for i in pending if i not in self._features})
+        self.last_build_ms = round((time.perf_counter() - start) * 1000, 2)
+        print(f"Similar-items index built: {n} records in {self.last_build_ms} ms")
+
+    def _top(self, ids: List[Any], row: int, cols: np.ndarray, scores: np.ndarray) -> List[Tuple[Any, float]]:
+        """The k best-scoring other records among one row's sparse scores"""
+        keep = (cols != row) & (scores > 0)
+        cols, scores = cols[keep], scores[keep]
+        if cols.size > self.k:
+            best = np.argpartition(scores, -self.k)[-self.k:]
+            cols, scores = cols[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return [(ids[c], float(score)) for c, score in zip(cols[order], scores[order])]
+
+    def _assign(self, row: int, neighbours: List[Tuple[Any, float]]):
+        owner = self._ids[row]
+        for old, _ in self._neighbours.get(owner, []):
+            self._cited_by.get(old, set()).discard(owner)
+        for new, _ in neighbours:
+            self._cited_by.setdefault(new, set()).add(owner)
+        self._neighbours[owner] = neighbours
+        self._kth[row] = neighbours[-1][1] if len(neighbours) == self.k else 0.0
+
+    def sync(self, book_type: str, records: Iterable[Dict[str, Any]], changes: Dict[Any, Any] = None):
+        """Apply a saved catalog file, touching only records whose indexed fields changed.
+
+        changes, when given, maps the ids a commit touched to their new record
+        (None when deleted) and only those are looked at; records is not read.
+        """
+        with self._lock:
+            changed, removed = self._ingest(book_type, records, changes)
+            if not (changed or removed):
+                return
+            if self._changed_during_build is not None:
+                self._changed_during_build |= changed | removed
+            if not self._loaded:
+                return
+            self._update(changed, removed)
+            self._changes_since_build += len(changed) + len(removed)
+            if self._changes_since_build > REBUILD_CHANGE_RATIO * max(len(self._features), 1):
+                # IDF has drifted; rebuild in the background and keep serving these lists meanwhile
+                self._start(self._rebuild)
+
+    def _update(self, changed: set, removed: set):
+        """Re-vectorise changed records, free removed ones and repair the lists they touch"""
+        start = time.perf_counter()
+        # Lists that cited a touched record may now hold a stale score or a deleted id
+        stale = set()
+        for item_id in changed | removed:
+            stale |= self._cited_by.get(item_id, set())
+        rows = {}
+        for item_id in removed:
+            row = self._rows.pop(item_id, None)
+            if row is None:
+                continue
+            for neighbour, _ in self._neighbours.pop(item_id, []):
+                self._cited_by.get(neighbour, set()).discard(item_id)
+            self._cited_by.pop(item_id, None)
+            self._ids[row] = None
+            self._free.append(row)
+            rows[row] = None
+        for item_id in changed:
+            row = self._rows.get(item_id)
+            if row is None:
+                row = self._free.pop() if self._free else len(self._ids)
+                if row == len(self._ids):
+                    self._ids.append(item_id)
+                else:
+                    self._ids[row] = item_id
+                self._rows[item_id] = row
+            rows[row] = self._vectors[item_id] = self._vector(self._features[item_id])
+        self._set_rows(rows)
+        if len(self._kth) < len(self._ids):
+            self._kth = np.concatenate([self._kth, np.zeros(len(self._ids) - len(self._kth), dtype=np.float32)])
+        for row, vector in rows.items():
+            if vector is None:
+                self._kth[row] = 0.0
+
+        stale = {owner for owner in stale if owner in self._rows} - changed
+        targets = [self._rows[item_id] for item_id in changed] + [self._rows[item_id] for item_id in stale]
+        for begin in range(0, len(targets), BUILD_BLOCK_ROWS):
+            block = targets[begin:begin + BUILD_BLOCK_ROWS]
+            # Scores of the block against every row, without transposing the whole matrix
+            product = (self._matrix @ self._matrix[block].T).T.tocsr()
+            for offset, row in enumerate(block):
+                cols = product.indices[product.indptr[offset]:product.indptr[offset + 1]]
+                scores = product.data[product.indptr[offset]:product.indptr[offset + 1]]
+                self._assign(row, self._top(self._ids, row, cols, scores))
+                item_id = self._ids[row]
+                if item_id not in changed:
+                    continue
+                # Splice the changed record into lists whose k-th entry it now beats
+                beats = (scores > self._kth[cols]) & (cols != row)
+                for other_row, score in zip(cols[beats], scores[beats]):
+                    other = self._ids[other_row]
+                    if other not in stale and other not in changed:
+                        self._insert(other_row, item_id, float(score))
+        self.last_sync_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    def _set_rows(self, rows: Dict[int, Optional[Tuple[np.ndarray, np.ndarray]]]):
+        """Replace whole rows of the matrix (None empties one); rows past the end are appended"""
+        from scipy import sparse
+
+        if not rows:
+            return
+        matrix = self._matrix
+        old_rows = matrix.shape[0]
+        total = max(old_rows, max(rows) + 1)
+        lengths = np.zeros(total, dtype=np.int64)
+        lengths[:old_rows] = np.diff(matrix.indptr)
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32))
+        cols, vals, cursor = [], [], 0
+        for row in sorted(rows):
+            # Rows between the previous replacement and this one are copied as one slice
+            begin, end = matrix.indptr[min(cursor, old_rows)], matrix.indptr[min(row, old_rows)]
+            cols.append(matrix.indices[begin:end])
+            vals.append(matrix.data[begin:end])
+            vector = rows[row] if rows[row] is not None else empty
+            cols.append(vector[0])
+            vals.append(vector[1])
+            lengths[row] = len(vector[0])
+            cursor = row + 1
+        begin = matrix.indptr[min(cursor, old_rows)]
+        cols.append(matrix.indices[begin:])
+        vals.append(matrix.data[begin:])
+        indptr = np.zeros(total + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(lengths)
+        self._matrix = sparse.csr_matrix(
+            (np.concatenate(vals).astype(np.float32, copy=False), np.concatenate(cols), indptr),
+            shape=(total, NUM_FEATURES))
+
+    def _kth_for(self, item_id) -> float:
+        neighbours = self._neighbours.get(item_id, [])
+        return neighbours[-1][1] if len(neighbours) == self.k else 0.0
+
+    def _insert(self, row: int, item_id, score: float):
+        neighbours = [n for n in self._neighbours.get(self._ids[row], []) if n[0] != item_id]
+        neighbours.append((item_id, score))
+        neighbours.sort(key=lambda n: -n[1])
+        self._assign(row, neighbours[:self.k])
+
+    def similar(self, item_id, limit: int = None) -> Optional[List[Dict[str, Any]]]:
+        """Compact records most like item_id, best first; None if the record is unknown.
+
+        Until the first build finishes every known record has no neighbours
+        yet; the lookup starts that build instead of waiting for it.
+        """
+        if not self._loaded:
+            self._start(self._ensure_loaded)
+            return [] if item_id in self._records or not self._ingested else None
+        neighbours = self._neighbours.get(item_id)
+        if neighbours is None:
+            return None
+        records = []
+        for neighbour_id, score in neighbours[:limit or self.k]:
+            record = self._records.get(neighbour_id)
+            if record:
+                records.append(dict(record, score=round(score, 4)))
+        return records
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'records': len(self._rows),
+            'nonzeros': int(self._matrix.nnz) if self._matrix is not None else 0,
+            'k': self.k,
+            'changes_since_build': self._changes_since_build,
+            'building': self._builder is not None and self._builder.is_alive(),
+            'last_build_ms': self.last_build_ms,
+            'last_sync_ms': self.last_sync_ms
+        }
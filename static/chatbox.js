@@ -271,10 +271,17 @@ class FloatingChatbox {
             const data = await response.json();
             
             if (data.success) {
-                this.isConnected = true;
-                this.updateConnectionStatus(true);
-                this.addMessage(data.message, false);
-                this.addMessage('Hello! I\'m your AI StudyHub assistant. How can I help you today?', false);
+                // The server connects in the background; poll until the model is loaded
+                const status = data.state === 'ready' ? data : await this.waitForConnection();
+                if (status.state === 'ready') {
+                    this.isConnected = true;
+                    this.updateConnectionStatus(true);
+                    this.addMessage('Connected to ollama successfully!', false);
+                    this.addMessage('Hello! I\'m your AI StudyHub assistant. How can I help you today?', false);
+                } else {
+                    this.updateConnectionStatus(false);
+                    this.addMessage(`Connection failed: ${status.last_error || 'Ollama is not ready yet'}`, false);
+                }
             } else {
                 this.updateConnectionStatus(false);
                 this.addMessage(`Connection failed: ${data.message}`, false);
@@ -287,6 +294,22 @@ class FloatingChatbox {
         }
     }
 
+    async waitForConnection(timeoutMs = 60000, intervalMs = 1000) {
+        const deadline = Date.now() + timeoutMs;
+        let data = { state: 'connecting' };
+        
+        while (Date.now() < deadline) {
+            const response = await fetch('/api/ollama/status');
+            data = await response.json();
+            
+            if (data.state === 'ready' || data.state === 'failed' || data.state === 'disconnected') {
+                return data;
+            }
+            await new Promise(resolve => setTimeout(resolve, intervalMs));
+        }
+        return data;
+    }
+
     async disconnectFromOllama() {
         try {
             const response = await fetch('/api/ollama/disconnect', {
@@ -333,6 +356,11 @@ class FloatingChatbox {
             if (data.connected) {
                 this.isConnected = true;
                 this.updateConnectionStatus(true);
+            } else if (data.state === 'connecting' || data.state === 'reconnecting') {
+                // Warm-up started with the server; pick up the connection once it is ready
+                this.updateConnectionStatus(false, 'Connecting...');
+                const status = await this.waitForConnection();
+                this.updateConnectionStatus(status.state === 'ready');
             } else {
                 this.isConnected = false;
                 this.updateConnectionStatus(false);
@@ -523,16 +523,111 @@ function moveToMyBookshelf(bookItem, category = 'borrowed') {
 function setupSearchFunctionality() {
     const searchInput = document.getElementById('searchInput');
     let searchTimeout;
+    let suggestTimeout;
+    
+    // Dropdown for server-side, typo-tolerant suggestions
+    const suggestionBox = document.createElement('ul');
+    suggestionBox.className = 'search-suggestions';
+    searchInput.parentNode.appendChild(suggestionBox);
+    
+    // Semantic mode asks the server for records close in meaning instead of matching text
+    const semanticToggle = document.getElementById('semanticToggle');
+    if (semanticToggle) {
+        semanticToggle.addEventListener('click', function() {
+            this.classList.toggle('active');
+            searchInput.placeholder = this.classList.contains('active')
+                ? 'Describe what you want to learn...'
+                : 'Search books, authors, or topics...';
+            performSearch(searchInput.value);
+        });
+    }
     
     searchInput.addEventListener('input', function() {
         clearTimeout(searchTimeout);
+        clearTimeout(suggestTimeout);
         searchTimeout = setTimeout(() => {
             performSearch(this.value);
         }, 300);
+        suggestTimeout = setTimeout(() => {
+            fetchSuggestions(this.value, suggestionBox);
+        }, 120);
+    });
+    
+    searchInput.addEventListener('keydown', function(e) {
+        const items = Array.from(suggestionBox.querySelectorAll('li'));
+        if (!items.length) return;
+        let index = items.findIndex(item => item.classList.contains('active'));
+        
+        if (e.key === 'ArrowDown' || e.key === 'ArrowUp') {
+            e.preventDefault();
+            if (index >= 0) items[index].classList.remove('active');
+            index = e.key === 'ArrowDown' ? (index + 1) % items.length : (index - 1 + items.length) % items.length;
+            items[index].classList.add('active');
+        } else if (e.key === 'Enter') {
+            e.preventDefault();
+            applySuggestion(items[Math.max(index, 0)].dataset.text, suggestionBox);
+        }
+    });
+    
+    searchInput.addEventListener('blur', () => {
+        // Delay so a click on a suggestion lands before the list is hidden
+        setTimeout(() => hideSuggestions(suggestionBox), 150);
     });
 }
 
+function fetchSuggestions(query, suggestionBox) {
+    if (query.trim().length < 2) {
+        hideSuggestions(suggestionBox);
+        return;
+    }
+    
+    fetch(`/api/suggest?q=${encodeURIComponent(query)}&limit=8`)
+        .then(response => response.json())
+        .then(data => {
+            const searchInput = document.getElementById('searchInput');
+            // Ignore answers for text the user has already changed
+            if (data.status !== 'success' || searchInput.value !== query) return;
+            
+            if (!data.suggestions.length) {
+                hideSuggestions(suggestionBox);
+                return;
+            }
+            
+            suggestionBox.innerHTML = data.suggestions.map(suggestion => `
+                <li data-text="${suggestion.text.replace(/"/g, '&quot;')}">
+                    <i class="fas fa-${suggestion.type === 'author' ? 'user' : 'book'}"></i>
+                    <span>${suggestion.text}</span>
+                </li>
+            `).join('');
+            suggestionBox.querySelectorAll('li').forEach(item => {
+                item.addEventListener('mousedown', () => applySuggestion(item.dataset.text, suggestionBox));
+            });
+            suggestionBox.classList.add('show');
+        })
+        .catch(error => {
+            console.error('Error fetching suggestions:', error);
+        });
+}
+
+function applySuggestion(text, suggestionBox) {
+    const searchInput = document.getElementById('searchInput');
+    searchInput.value = text;
+    hideSuggestions(suggestionBox);
+    performSearch(text);
+}
+
+function hideSuggestions(suggestionBox) {
+    suggestionBox.classList.remove('show');
+    suggestionBox.innerHTML = '';
+}
+
 function performSearch(query) {
+    const semanticToggle = document.getElementById('semanticToggle');
+    if (semanticToggle && semanticToggle.classList.contains('active') && query.trim()) {
+        performSemanticSearch(query);
+        return;
+    }
+    
     const bookItems = document.querySelectorAll('.book-item');
     const lowercaseQuery = query.toLowerCase();
     
@@ -569,6 +664,30 @@ function performSearch(query) {
     }
 }
 
+function performSemanticSearch(query) {
+    fetch(`/api/search/semantic?q=${encodeURIComponent(query)}&limit=10`)
+        .then(response => response.json())
+        .then(data => {
+            const searchInput = document.getElementById('searchInput');
+            if (searchInput.value !== query) return;
+            if (data.status !== 'success') {
+                showNotification(data.message || 'Semantic search is unavailable', 'error');
+                return;
+            }
+            
+            const matchingIds = new Set(data.results.map(result => String(result.id)));
+            document.querySelectorAll('.book-item').forEach(item => {
+                const matches = matchingIds.has(item.getAttribute('data-book-id'));
+                item.style.display = matches ? 'block' : 'none';
+                item.style.opacity = '1';
+            });
+            showNotification(`Found ${data.results.length} results related to "${query}"`, 'info');
+        })
+        .catch(error => {
+            console.error('Error in semantic search:', error);
+        });
+}
+
 // View controls (grid/list view)
 function setupViewControls() {
     const viewButtons = document.querySelectorAll('.view-btn');
@@ -613,6 +732,71 @@ function setupFilterControls() {
             applyFilter(filterType);
         });
     });
+
+    loadFacets();
+}
+
+// Facet filters: counts come precomputed from the server for the current selection
+const FACET_LABELS = {
+    bookType: 'Type',
+    subject: 'Subject',
+    level: 'Level',
+    author: 'Author',
+    year: 'Year',
+    availability: 'Availability'
+};
+const BOOK_TYPE_LABELS = { physical: 'Library books', ebook: 'E-books', internal: 'Course materials' };
+
+function selectedFacets() {
+    const params = new URLSearchParams();
+    document.querySelectorAll('#facetBar select').forEach(select => {
+        if (select.value) {
+            params.append(select.dataset.facet, select.value);
+        }
+    });
+    return params;
+}
+
+function loadFacets() {
+    const facetBar = document.getElementById('facetBar');
+    if (!facetBar) return;
+
+    const params = selectedFacets();
+    fetch(`/api/library/facets?${params.toString()}`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.status !== 'success') return;
+            renderFacets(facetBar, data.facets);
+            applyFacetResults(params.toString() ? new Set(data.ids.map(String)) : null);
+        })
+        .catch(error => console.error('Error loading facets:', error));
+}
+
+function renderFacets(facetBar, facets) {
+    facetBar.innerHTML = '';
+    Object.keys(FACET_LABELS).forEach(facet => {
+        const values = facets[facet] || [];
+        if (!values.length) return;
+
+        const select = document.createElement('select');
+        select.className = 'facet-select';
+        select.dataset.facet = facet;
+        select.innerHTML = `<option value="">${FACET_LABELS[facet]}: All</option>` + values.map(v => {
+            const label = facet === 'bookType' ? (BOOK_TYPE_LABELS[v.value] || v.value) : v.value;
+            return `<option value="${v.value}" ${v.selected ? 'selected' : ''}>${label} (${v.count})</option>`;
+        }).join('');
+        select.addEventListener('change', loadFacets);
+        facetBar.appendChild(select);
+    });
+}
+
+function applyFacetResults(matchingIds) {
+    // My Bookshelf always shows everything the user has; facets narrow the catalog shelves
+    document.querySelectorAll('.book-item').forEach(item => {
+        if (item.closest('#myBookshelf')) return;
+        const visible = !matchingIds || matchingIds.has(item.getAttribute('data-book-id'));
+        item.style.display = visible ? '' : 'none';
+    });
 }
 
 function applyFilter(filterType) {
@@ -1004,6 +1188,7 @@ function showBookDetails(bookItem) {
                     modal.classList.add('show');
                 }, 10);
                 
+                loadRelatedTitles(modal, data.book.id);
                 console.log(`Showing details for book: ${data.book.title}`);
             } else {
                 throw new Error('Book details not found');
@@ -1032,6 +1217,46 @@ function showBookDetails(bookItem) {
         });
 }
 
+// Append "Related titles" from the precomputed similar-items index to an open modal
+function loadRelatedTitles(modal, bookId) {
+    fetch(`/api/book/${bookId}/similar?limit=5`)
+        .then(response => response.json())
+        .then(data => {
+            if (data.status !== 'success' || !data.similar || data.similar.length === 0) {
+                return;
+            }
+            
+            const items = data.similar.map(book => `
+                <li class="related-title" data-book-id="${book.id}">
+                    <span class="related-name">${book.title}</span>
+                    <span class="related-author">${book.author || ''}</span>
+                </li>
+            `).join('');
+            
+            const section = document.createElement('div');
+            section.className = 'related-titles';
+            section.innerHTML = `<h4>Related titles</h4><ul>${items}</ul>`;
+            
+            // Open the related book's details if it is shown on the page
+            section.querySelectorAll('.related-title').forEach(item => {
+                item.addEventListener('click', () => {
+                    const bookItem = document.querySelector(`.book-item[data-book-id="${item.dataset.bookId}"]`);
+                    if (bookItem) {
+                        showBookDetails(bookItem);
+                    }
+                });
+            });
+            
+            const info = modal.querySelector('.modal-info');
+            if (info) {
+                info.appendChild(section);
+            }
+        })
+        .catch(error => {
+            console.error('Error fetching related titles:', error);
+        });
+}
+
 function createLoadingModal(title) {
     const modal = document.createElement('div');
     modal.className = 'book-modal';
@@ -1444,6 +1669,104 @@ const additionalStyles = `
     margin-bottom: 0.5rem;
 }
 
+.search-suggestions {
+    display: none;
+    position: absolute;
+    top: 100%;
+    left: 0;
+    right: 0;
+    margin: 4px 0 0;
+    padding: 0.25rem 0;
+    list-style: none;
+    background: white;
+    border-radius: 8px;
+    box-shadow: 0 4px 20px rgba(0,0,0,0.15);
+    z-index: 1000;
+}
+
+.search-suggestions.show {
+    display: block;
+}
+
+.search-suggestions li {
+    display: flex;
+    align-items: center;
+    gap: 0.5rem;
+    padding: 0.5rem 1rem;
+    cursor: pointer;
+}
+
+.search-suggestions li i {
+    position: static;
+    color: #999;
+}
+
+.search-suggestions li:hover,
+.search-suggestions li.active {
+    background-color: #f1f5fe;
+}
+
+.semantic-toggle {
+    padding: 0.75rem;
+    border: 2px solid #e9ecef;
+    background: white;
+    border-radius: 8px;
+    cursor: pointer;
+    transition: all 0.3s ease;
+}
+
+.semantic-toggle:hover,
+.semantic-toggle.active {
+    border-color: #4285f4;
+    background-color: #4285f4;
+    color: white;
+}
+
+.facet-bar {
+    display: flex;
+    flex-wrap: wrap;
+    gap: 10px;
+    margin-top: 15px;
+}
+
+.facet-select {
+    padding: 8px 12px;
+    border: 1px solid #ddd;
+    border-radius: 20px;
+    background: white;
+    font-size: 0.9rem;
+    cursor: pointer;
+}
+
+.related-titles {
+    margin-top: 1rem;
+    padding-top: 1rem;
+    border-top: 1px solid #eee;
+}
+
+.related-titles ul {
+    list-style: none;
+    padding: 0;
+    margin: 0;
+}
+
+.related-title {
+    display: flex;
+    justify-content: space-between;
+    gap: 1rem;
+    padding: 0.4rem 0;
+    cursor: pointer;
+}
+
+.related-title:hover .related-name {
+    color: #4285f4;
+}
+
+.related-author {
+    color: #666;
+    font-size: 0.85rem;
+}
+
 .text-center {
     text-align: center;
 }
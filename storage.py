@@ -0,0 +1,367 @@
+"""Crash-safe JSON persistence with group commit.
+
+Every write goes to a temp file in the target's directory, is fsynced and
+then renamed over the target, so a crash leaves either the old or the new
+file, never a truncated one. Saves are serialized in the caller (the data
+is a snapshot from then on) and handed to a writer thread, which gathers
+everything saved within a short window and writes each dirty file once:
+ten saves of users.json in the same window cost one rewrite and one fsync.
+
+Durability modes:
+
+* ``sync``  - the caller writes and fsyncs the file itself
+* ``group`` - the caller waits until the batch holding its save is on disk
+* ``async`` - the caller returns at once; the file is on disk within the window
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Any, Tuple, List, Callable, Optional
+
+try:
+    import fcntl
+except ImportError:   # Windows: locks stay per process
+    fcntl = None
+
+DURABILITY_MODES = ('sync', 'group', 'async')
+
+# Seconds a group/async save can wait for others to share its write
+DEFAULT_COMMIT_WINDOW = 0.005
+
+# A group-commit caller gives up waiting after this long and surfaces the error
+GROUP_COMMIT_TIMEOUT = 10.0
+
+# Longest a request waits for a collection lock before giving up
+LOCK_TIMEOUT = 5.0
+
+
+def _fsync_directory(directory: str):
+    """Make the rename itself durable; not every platform can open a directory"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(file_path: str, text):
+    """Replace file_path with text (str or bytes) via temp file, fsync and rename"""
+    directory = os.path.dirname(file_path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path) + '-')
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(text, bytes) else 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    _fsync_directory(directory)
+
+
+class FileLock:
+    """Exclusive lock across threads and processes, acquired with a bounded wait.
+
+    A thread lock orders threads of this process; an fcntl lock on a small
+    lock file orders processes. The lock file is reopened after a fork so a
+    worker never shares its parent's lock.
+    """
+
+    def __init__(self, path: str, timeout: float = LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self._thread_lock = threading.Lock()
+        self._fd = None
+        self._pid = None
+        self.acquisitions = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def acquire(self):
+        start = time.monotonic()
+        if not self._thread_lock.acquire(timeout=self.timeout):
+            self.timeouts += 1
+            raise TimeoutError(f"Timed out waiting for {os.path.basename(self.path)}")
+        try:
+            if fcntl is not None:
+                if self._pid != os.getpid():
+                    os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                    self._pid = os.getpid()
+                delay = 0.001
+                while True:
+                    try:
+                        fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() - start > self.timeout:
+                            self.timeouts += 1
+                            raise TimeoutError(f"Timed out waiting for {os.path.basename(self.path)}")
+                        time.sleep(delay)
+                        delay = min(delay * 2, 0.02)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        waited = (time.monotonic() - start) * 1000
+        self.acquisitions += 1
+        if waited > 1:
+            self.contended += 1
+        self.wait_ms += waited
+        self.max_wait_ms = max(self.max_wait_ms, waited)
+
+    def release(self):
+        if fcntl is not None and self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'acquisitions': self.acquisitions,
+            'contended': self.contended,
+            'timeouts': self.timeouts,
+            'wait_ms': round(self.wait_ms, 2),
+            'max_wait_ms': round(self.max_wait_ms, 2)
+        }
+
+
+def table_changes(old, new) -> Optional[Dict[Any, Any]]:
+    """id -> new record (None when deleted) between two lists of records; None for any other data"""
+    if not isinstance(old, list) or not isinstance(new, list):
+        return None
+    tables = []
+    for items in (old, new):
+        if not all(isinstance(item, dict) and 'id' in item for item in items):
+            return None
+        tables.append({item['id']: item for item in items})
+    old_table, new_table = tables
+    changes = {item_id: None for item_id in old_table if item_id not in new_table}
+    changes.update((item_id, record) for item_id, record in new_table.items() if old_table.get(item_id) != record)
+    return changes
+
+
+class JsonStore:
+    """load/save of JSON files with coalesced, atomic writes.
+
+    Loads see pending saves, so a request always reads what the previous
+    request saved even before the writer thread has put it on disk.
+    """
+
+    def __init__(self, durability: str = 'group', window: float = DEFAULT_COMMIT_WINDOW):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {', '.join(DURABILITY_MODES)}")
+        self.durability = durability
+        self.window = window
+        self._pending: Dict[str, Tuple[str, int]] = {}   # path -> (serialized text, sequence)
+        self._sequence = 0
+        self._durable: Dict[str, int] = {}   # path -> newest sequence on disk
+        self._failed: Dict[str, int] = {}    # path -> newest sequence whose write failed
+        self._lock = threading.Lock()
+        self._committed = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._writer = None
+        self._writer_pid = None
+        self._file_locks: Dict[str, threading.Lock] = {}
+        self._transaction_locks: Dict[str, threading.Lock] = {}
+        self._listeners: List[Tuple[Callable, Optional[set]]] = []
+        self.saves = 0
+        self.writes = 0
+        self.batches = 0
+        self.last_error = None
+
+    def load(self, file_path: str, default=None):
+        with self._lock:
+            pending = self._pending.get(file_path)
+        if pending is not None:
+            return json.loads(pending[0])
+        if os.path.exists(file_path):
+            with open(file_path, 'r') as f:
+                return json.load(f)
+        return {} if default is None else default
+
+    def listen(self, listener: Callable[[str, Any, Optional[Dict[Any, Any]]], None], paths=None):
+        """Call listener(path, data, changes) after each save to one of paths, or to any file.
+
+        changes maps the ids of the records a commit changed to their new
+        record (None when deleted), and data is then None; when the store
+        cannot tell which records changed, changes is None and data is the
+        whole document.
+        """
+        self._listeners.append((listener, set(paths) if paths is not None else None))
+
+    def _listened(self, file_path: str) -> bool:
+        return any(paths is None or file_path in paths for _, paths in self._listeners)
+
+    def _emit(self, file_path: str, data: Any, changes: Optional[Dict[Any, Any]]):
+        for listener, paths in self._listeners:
+            if paths is not None and file_path not in paths:
+                continue
+            try:
+                listener(file_path, data if changes is None else None, changes)
+            except Exception as e:
+                print(f"Error applying change to {file_path}: {e}")
+
+    def save(self, file_path: str, data: Any):
+        self._save(file_path, data)
+        self._emit(file_path, data, None)
+
+    def _save(self, file_path: str, data: Any):
+        text = json.dumps(data, indent=2)
+        with self._lock:
+            self.saves += 1
+            if self.durability == 'sync':
+                self._pending.pop(file_path, None)
+        if self.durability == 'sync':
+            self._write(file_path, text)
+            return
+
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+            self._pending[file_path] = (text, sequence)
+            self._ensure_writer()
+        self._wake.set()
+
+        if self.durability == 'group':
+            with self._committed:
+                deadline = time.monotonic() + GROUP_COMMIT_TIMEOUT
+                while self._durable.get(file_path, 0) < sequence:
+                    if self._failed.get(file_path, 0) >= sequence:
+                        raise IOError(f"Could not save {file_path}: {self.last_error}")
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise IOError(f"Timed out saving {file_path}")
+                    self._committed.wait(remaining)
+
+    def version(self, file_path: str):
+        """Token that changes whenever file_path's content does; None while a save is pending"""
+        with self._lock:
+            if file_path in self._pending:
+                return None
+        try:
+            return os.stat(file_path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def _ensure_writer(self):
+        """Start the writer thread; a forked worker starts its own, the parent's did not survive the fork"""
+        if self._writer is None or self._writer_pid != os.getpid():
+            self._writer = threading.Thread(target=self._run, name='json-store-writer', daemon=True)
+            self._writer_pid = os.getpid()
+            self._writer.start()
+
+    def transact(self, file_paths: List[str], mutate: Callable, retries: int = 0):
+        """Run mutate(*documents) on fresh copies and save what it changed.
+
+        Returns (mutate's result, {path: document} for the documents saved).
+        Here the files are only locked within this process; LoggedJsonStore
+        adds cross-process locks and version checks.
+        """
+        locks = []
+        with self._lock:
+            for file_path in sorted(file_paths):
+                locks.append(self._transaction_locks.setdefault(file_path, threading.Lock()))
+        for lock in locks:
+            lock.acquire()
+        try:
+            documents = [self.load(file_path) for file_path in file_paths]
+            before = [json.dumps(document) for document in documents]
+            result = mutate(*documents)
+            saved = {}
+            for file_path, document, text in zip(file_paths, documents, before):
+                if json.dumps(document) != text:
+                    self._save(file_path, document)
+                    saved[file_path] = document
+                    if self._listened(file_path):
+                        self._emit(file_path, document, table_changes(json.loads(text), document))
+            return result, saved
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    def _write(self, file_path: str, text: str):
+        with self._lock:
+            lock = self._file_locks.setdefault(file_path, threading.Lock())
+        # Two writers renaming over the same file would race on which lands last
+        with lock:
+            atomic_write(file_path, text)
+        with self._lock:
+            self.writes += 1
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            # Let the rest of the window's saves pile up behind the first one
+            time.sleep(self.window)
+            self._wake.clear()
+            with self._lock:
+                batch = dict(self._pending)
+            if not batch:
+                continue
+            failed = False
+            for file_path, (text, sequence) in batch.items():
+                try:
+                    self._write(file_path, text)
+                except OSError as e:
+                    print(f"Error writing {file_path}: {e}")
+                    with self._lock:
+                        self.last_error = str(e)
+                        self._failed[file_path] = sequence
+                    failed = True
+                    continue
+                self._mark_durable(file_path, sequence)
+            with self._committed:
+                self.batches += 1
+                self._committed.notify_all()
+            if failed:
+                # Failed files stay pending and are retried after a pause
+                time.sleep(max(self.window, 0.5))
+                self._wake.set()
+
+    def _mark_durable(self, file_path: str, sequence: int):
+        with self._lock:
+            # A newer save of the same file stays pending for the next batch
+            if self._pending.get(file_path, (None, None))[1] == sequence:
+                del self._pending[file_path]
+            self._durable[file_path] = max(self._durable.get(file_path, 0), sequence)
+
+    def flush(self):
+        """Write everything pending now, in the calling thread"""
+        with self._lock:
+            batch = dict(self._pending)
+        for file_path, (text, sequence) in batch.items():
+            self._write(file_path, text)
+            self._mark_durable(file_path, sequence)
+        with self._committed:
+            self._committed.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'durability': self.durability,
+                'window_ms': round(self.window * 1000, 2),
+                'saves': self.saves,
+                'writes': self.writes,
+                'batches': self.batches,
+                'pending': len(self._pending),
+                'last_error': self.last_error
+            }
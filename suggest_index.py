@@ -0,0 +1,306 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import deque
+from typing import Dict, Any, List, Callable, Iterable, Optional, Tuple
+
+SUGGEST_FIELDS = ['title', 'author']
+
+# Candidate words gathered per query token before ranking
+MAX_PREFIX_WORDS = 200
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip accents and punctuation"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch)).lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', text))
+
+
+def trigrams(word: str) -> set:
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_typos(token: str) -> int:
+    if len(token) < 3:
+        return 0
+    return 1 if len(token) < 6 else 2
+
+
+def _last_row(query: str, word: str, limit: int) -> Optional[List[int]]:
+    """Final Levenshtein DP row of query against word; None once every cell exceeds limit.
+
+    Only the diagonal band |i - j| <= limit is filled; cells outside it are
+    already over the limit and are left at limit + 1.
+    """
+    over = limit + 1
+    previous = [j if j <= limit else over for j in range(len(word) + 1)]
+    for i, qc in enumerate(query, 1):
+        low, high = max(1, i - limit), min(len(word), i + limit)
+        current = [over] * (len(word) + 1)
+        if i <= limit:
+            current[0] = i
+        for j in range(low, high + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (qc != word[j - 1]))
+        if min(current[low - 1:high + 1]) > limit:
+            return None
+        previous = current
+    return previous
+
+
+def prefix_edit_distance(query: str, word: str, limit: int) -> Optional[int]:
+    """Smallest edit distance between query and any prefix of word, or None if over limit"""
+    row = _last_row(query, word, limit)
+    if row is None or min(row) > limit:
+        return None
+    return min(row)
+
+
+def edit_distance(a: str, b: str, limit: int) -> Optional[int]:
+    row = _last_row(a, b, limit)
+    if row is None or row[-1] > limit:
+        return None
+    return row[-1]
+
+
+class _TrieNode:
+    __slots__ = ('children', 'word')
+
+    def __init__(self):
+        self.children: Dict[str, '_TrieNode'] = {}
+        self.word = False
+
+
+class SuggestIndex:
+    """Search-box suggestions over catalog titles and authors.
+
+    A prefix trie over the vocabulary answers as-you-type completions and a
+    character-trigram index finds words within a couple of typos. Matching
+    phrases are ranked by total edit distance, then record popularity.
+    """
+
+    def __init__(self, loaders: Dict[str, Callable[[], list]],
+                 popularity: Callable[[Any], float] = None, limit: int = 8):
+        self.loaders = loaders
+        self.popularity = popularity or (lambda item_id: 0)
+        self.limit = limit
+        self._root = _TrieNode()
+        self._trigrams: Dict[str, set] = {}        # trigram -> words
+        self._word_phrases: Dict[str, set] = {}    # word -> phrase keys containing it
+        self._phrases: Dict[Tuple[str, str], Dict[str, Any]] = {}   # (field, normalized) -> phrase
+        self._record_phrases: Dict[Any, List[Tuple[str, str]]] = {}
+        self._fingerprints: Dict[Any, str] = {}
+        self._types: Dict[Any, str] = {}
+        self._loaded = False
+        self._lock = threading.RLock()
+        self._latencies = deque(maxlen=500)
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if not self._loaded:
+                for book_type, loader in self.loaders.items():
+                    self.sync(book_type, loader())
+                self._loaded = True
+
+    def warm(self):
+        """Build the index now rather than on the first lookup"""
+        self._ensure_loaded()
+
+    def sync(self, book_type: str, records: Iterable[Dict[str, Any]], changes: Dict[Any, Any] = None):
+        """Re-index records whose title or author changed and drop deleted ones.
+
+        changes, when given, maps the ids a commit touched to their new record
+        (None when deleted) and only those are looked at; records is not read.
+        """
+        with self._lock:
+            if changes is not None:
+                for item_id, record in changes.items():
+                    if record is None:
+                        self._drop(item_id)
+                    else:
+                        self._update(book_type, record)
+                return
+            seen = set()
+            for record in records:
+                seen.add(record['id'])
+                self._update(book_type, record)
+            for item_id in [i for i, t in self._types.items() if t == book_type and i not in seen]:
+                self._drop(item_id)
+
+    def _update(self, book_type: str, record: Dict[str, Any]):
+        item_id = record['id']
+        fingerprint = hashlib.sha1(json.dumps(
+            [record.get(field) for field in SUGGEST_FIELDS], default=str).encode('utf-8')).hexdigest()
+        if self._fingerprints.get(item_id) != fingerprint or self._types.get(item_id) != book_type:
+            self._remove(item_id)
+            self._add(book_type, record)
+            self._fingerprints[item_id] = fingerprint
+            self._types[item_id] = book_type
+
+    def _drop(self, item_id):
+        self._remove(item_id)
+        self._fingerprints.pop(item_id, None)
+        self._types.pop(item_id, None)
+
+    def _add(self, book_type: str, record: Dict[str, Any]):
+        keys = []
+        for field in SUGGEST_FIELDS:
+            text = str(record.get(field) or '').strip()
+            normalized = normalize(text)
+            if not normalized:
+                continue
+            key = (field, normalized)
+            phrase = self._phrases.get(key)
+            if phrase is None:
+                phrase = self._phrases[key] = {'text': text, 'type': field, 'records': {}}
+                for word in set(normalized.split()):
+                    self._add_word(word)
+                    self._word_phrases[word].add(key)
+            phrase['records'][record['id']] = book_type
+            keys.append(key)
+        self._record_phrases[record['id']] = keys
+
+    def _add_word(self, word: str):
+        if word in self._word_phrases:
+            return
+        self._word_phrases[word] = set()
+        node = self._root
+        for ch in word:
+            node = node.children.setdefault(ch, _TrieNode())
+        node.word = True
+        for gram in trigrams(word):
+            self._trigrams.setdefault(gram, set()).add(word)
+
+    def _remove(self, item_id):
+        for key in self._record_phrases.pop(item_id, []):
+            phrase = self._phrases.get(key)
+            if phrase is None:
+                continue
+            phrase['records'].pop(item_id, None)
+            if not phrase['records']:
+                # Words stay in the trie; with no phrases left they simply never match
+                del self._phrases[key]
+                for word in set(key[1].split()):
+                    self._word_phrases.get(word, set()).discard(key)
+
+    def _prefix_words(self, prefix: str) -> List[str]:
+        node = self._root
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        words, stack = [], [(node, prefix)]
+        while stack and len(words) < MAX_PREFIX_WORDS:
+            node, text = stack.pop()
+            if node.word and self._word_phrases.get(text):
+                words.append(text)
+            for ch, child in node.children.items():
+                stack.append((child, text + ch))
+        return words
+
+    def _fuzzy_words(self, token: str, as_prefix: bool) -> Dict[str, int]:
+        limit = max_typos(token)
+        if not limit:
+            return {}
+        grams = trigrams(token)
+        overlap: Dict[str, int] = {}
+        for gram in grams:
+            for word in self._trigrams.get(gram, ()):
+                overlap[word] = overlap.get(word, 0) + 1
+        # Each typo can break at most three trigrams
+        needed = max(1, len(grams) - 3 * limit)
+        matches = {}
+        for word, shared in overlap.items():
+            if shared < needed or not self._word_phrases.get(word):
+                continue
+            # A completion can be longer than the token, a whole word only by the typo budget
+            if len(word) < len(token) - limit or (not as_prefix and len(word) > len(token) + limit):
+                continue
+            if as_prefix:
+                distance = prefix_edit_distance(token, word, limit)
+            else:
+                distance = edit_distance(token, word, limit)
+            if distance is not None:
+                matches[word] = distance
+        return matches
+
+    def _token_matches(self, token: str, last: bool, fuzzy: bool) -> Dict[str, int]:
+        """word -> edit distance for one query token; the last token may be incomplete"""
+        matches = self._fuzzy_words(token, as_prefix=last) if fuzzy else {}
+        exact = self._prefix_words(token) if last else ([token] if self._word_phrases.get(token) else [])
+        for word in exact:
+            matches[word] = 0
+        return matches
+
+    def _score(self, tokens: List[str], fuzzy: bool) -> Dict[Tuple[str, str], int]:
+        """Phrase key -> summed edit distance; every token has to match some word in the phrase"""
+        scores: Optional[Dict[Tuple[str, str], int]] = None
+        for position, token in enumerate(tokens):
+            best: Dict[Tuple[str, str], int] = {}
+            for word, distance in self._token_matches(token, position == len(tokens) - 1, fuzzy).items():
+                for key in self._word_phrases.get(word, ()):
+                    if distance < best.get(key, distance + 1):
+                        best[key] = distance
+            if scores is None:
+                scores = best
+            else:
+                scores = {key: scores[key] + d for key, d in best.items() if key in scores}
+            if not scores:
+                break
+        return scores or {}
+
+    def suggest(self, query: str, limit: int = None) -> List[Dict[str, Any]]:
+        self._ensure_loaded()
+        start = time.perf_counter()
+        tokens = normalize(query).split()
+        if not tokens:
+            return []
+        limit = limit or self.limit
+        with self._lock:
+            # Typo matching only runs when exact words and prefixes leave slots unfilled
+            scores = self._score(tokens, fuzzy=False)
+            if len(scores) < limit:
+                scores = self._score(tokens, fuzzy=True)
+
+            # Popularity is only looked up for the distance tiers that can make the cut
+            by_distance: Dict[int, list] = {}
+            for key, distance in scores.items():
+                by_distance.setdefault(distance, []).append(key)
+            ranked = []
+            for distance in sorted(by_distance):
+                if len(ranked) >= limit:
+                    break
+                tier = []
+                for key in by_distance[distance]:
+                    popularity = sum(self.popularity(item_id) for item_id in self._phrases[key]['records'])
+                    tier.append((distance, -popularity, len(key[1]), key[1], key))
+                ranked.extend(sorted(tier))
+
+            suggestions = []
+            for distance, neg_popularity, _, _, key in ranked[:limit]:
+                phrase = self._phrases[key]
+                suggestion = {'text': phrase['text'], 'type': phrase['type'], 'distance': distance,
+                              'popularity': -neg_popularity}
+                if phrase['type'] == 'title':
+                    item_id, book_type = next(iter(phrase['records'].items()))
+                    suggestion.update({'id': item_id, 'bookType': book_type})
+                suggestions.append(suggestion)
+        self._latencies.append((time.perf_counter() - start) * 1000)
+        return suggestions
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                'phrases': len(self._phrases),
+                'words': len(self._word_phrases),
+                'trigrams': len(self._trigrams),
+                'avg_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+                'p95_ms': round(latencies[int(0.95 * (len(latencies) - 1))], 3) if latencies else 0.0
+            }
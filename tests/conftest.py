@@ -0,0 +1,41 @@
+import importlib
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app's modules live at the repository root
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app, imported over a copy of the data files so no test touches data/"""
+    data_dir = str(tmp_path_factory.mktemp('data'))
+    for name in os.listdir(os.path.join(ROOT, 'data')):
+        if name.endswith('.json') and not name.startswith('recommendation_blurbs'):
+            shutil.copy(os.path.join(ROOT, 'data', name), data_dir)
+    os.environ.update({
+        'STUDYHUB_DATA_DIR': data_dir,
+        'STUDYHUB_DURABILITY': 'sync',
+        'STUDYHUB_SESSION_BACKEND': 'memory',
+        'STUDYHUB_CACHE_BACKEND': 'memory',
+        'OLLAMA_WARMUP': '0',
+    })
+    return importlib.import_module('app')
+
+
+@pytest.fixture
+def client(app_module):
+    """A test client logged in as a freshly registered user"""
+    client = app_module.app.test_client()
+    username = f'tester{len(app_module.user_store.usernames())}'
+    client.post('/register', data={
+        'username': username, 'password': 'pw', 'confirm_password': 'pw', 'name': 'Tester',
+        'major': 'Computer Science', 'year': '2'
+    })
+    client.username = username
+    return client
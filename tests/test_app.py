@@ -0,0 +1,126 @@
+"""Library routes, run against the app over a copy of the data files"""
+
+
+def test_favourite_of_an_unknown_book_is_not_found(client, app_module):
+    response = client.post('/add_favorite', json={'book_id': 999999})
+    assert response.status_code == 404
+    assert app_module.user_store.get(client.username)['favorites'] == []
+
+
+def test_favourite_toggles(client, app_module):
+    book_id = app_module.get_library_books()[0]['id']
+    assert client.post('/add_favorite', json={'book_id': book_id}).get_json()['added_to_favorites']
+    assert app_module.user_store.get(client.username)['favorites'] == [book_id]
+    assert client.post('/add_favorite', json={'book_id': book_id}).get_json()['removed_from_favorites']
+    assert app_module.user_store.get(client.username)['favorites'] == []
+
+
+def test_semantic_search_falls_back_to_keywords_until_embedded(client, app_module):
+    title = app_module.get_library_books()[0]['title']
+    response = client.get('/api/search/semantic', query_string={'q': title})
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data['mode'] == 'keyword'
+    assert data['results'] and data['pending'] > 0
+
+
+def commit_meanwhile(monkeypatch, store, file_path, edit):
+    """Commit edit to file_path once, just after the code under test first reads it,
+    as another worker would"""
+    done = []
+    load, transact = store.load, store.transact
+
+    def interfere():
+        if not done:
+            done.append(True)
+            transact([file_path], edit)
+
+    def loading(path, default=None):
+        data = load(path, default)
+        if path == file_path:
+            interfere()
+        return data
+
+    def transacting(paths, mutate, *args, **kwargs):
+        def mutating(*documents):
+            if file_path in paths:
+                interfere()
+            return mutate(*documents)
+        return transact(paths, mutating, *args, **kwargs)
+
+    monkeypatch.setattr(store, 'load', loading)
+    monkeypatch.setattr(store, 'transact', transacting)
+    return done
+
+
+def test_favourite_keeps_a_settings_change_made_meanwhile(client, app_module, monkeypatch):
+    username = client.username
+    book_id = app_module.get_library_books()[0]['id']
+    done = commit_meanwhile(monkeypatch, app_module.json_store, app_module.user_store.path_for(username),
+                            lambda users: users[username].update(bio='written elsewhere'))
+    assert client.post('/add_favorite', json={'book_id': book_id}).status_code == 200
+    assert done
+    user = app_module.user_store.get(username)
+    assert (user['favorites'], user['bio']) == ([book_id], 'written elsewhere')
+
+
+def test_settings_keep_a_favourite_added_meanwhile(client, app_module, monkeypatch):
+    username = client.username
+    done = commit_meanwhile(monkeypatch, app_module.json_store, app_module.user_store.path_for(username),
+                            lambda users: users[username]['favorites'].append(42))
+    assert client.post('/api/update-settings', json={'bio': 'hello'}).status_code == 200
+    assert done
+    user = app_module.user_store.get(username)
+    assert (user['favorites'], user['bio']) == ([42], 'hello')
+
+
+def test_password_change_checks_the_current_password(client, app_module):
+    response = client.post('/api/update-password', json={'current_password': 'wrong', 'new_password': 'x'})
+    assert response.status_code == 400
+    response = client.post('/api/update-password', json={'current_password': 'pw', 'new_password': 'pw2'})
+    assert response.get_json()['status'] == 'success'
+    assert app_module.user_store.get(client.username)['password'] == 'pw2'
+
+
+def catalog_from_the_snapshot_only(monkeypatch, app_module):
+    """Build the snapshot, then fail any parse of a catalog file"""
+    app_module.catalog_snapshot.build()
+    load = app_module.json_store.load
+
+    def loading(path, default=None):
+        assert path not in app_module.CATALOG_FILES, f'{path} parsed'
+        return load(path, default)
+
+    monkeypatch.setattr(app_module.json_store, 'load', loading)
+
+
+def test_library_data_is_served_from_the_snapshot(client, app_module, monkeypatch):
+    books = [dict(book) for book in app_module.read_library_books()]
+    borrowed = next(book['id'] for book in books if book.get('availableCopies', 0) > 0)
+    assert client.post('/borrow_book', json={'bookId': borrowed}).status_code == 200
+    catalog_from_the_snapshot_only(monkeypatch, app_module)
+
+    data = client.get('/api/library_data').get_json()['data']
+    assert [book['id'] for book in data['libraryBooks']] == [book['id'] for book in books]
+    assert [book['id'] for book in data['libraryBooks'] if book['isBorrowedByUser']] == [borrowed]
+    assert {book['bookType'] for book in data['ebooks']} <= {'ebook'}
+    # The flags go on copies, never on the shared views
+    assert 'isBorrowedByUser' not in app_module.read_library_books()[0]
+
+
+def test_profile_lists_loans_from_the_snapshot(client, app_module, monkeypatch):
+    book = next(dict(b) for b in app_module.read_library_books() if b.get('availableCopies', 0) > 0)
+    assert client.post('/borrow_book', json={'bookId': book['id']}).status_code == 200
+    catalog_from_the_snapshot_only(monkeypatch, app_module)
+    assert book['title'] in client.get('/profile').get_data(as_text=True)
+
+
+def test_only_books_on_loan_can_be_reserved(client, app_module, monkeypatch):
+    catalog_from_the_snapshot_only(monkeypatch, app_module)
+    books = app_module.read_library_books()
+    on_shelf = next(b['id'] for b in books if b.get('availableCopies', 0) > 0 and b.get('status') != 'unavailable')
+    on_loan = next(b['id'] for b in books if b.get('availableCopies', 0) <= 0)
+    assert client.post('/reserve_book', json={'bookId': on_shelf}).status_code == 400
+    assert client.post('/reserve_book', json={'bookId': on_loan}).get_json()['reserved']
+    assert client.post('/unreserve_book', json={'bookId': on_loan}).status_code == 200
+    assert app_module.user_store.get(client.username)['reserved_books'] == []
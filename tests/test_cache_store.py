@@ -0,0 +1,102 @@
+"""Cache namespaces, and invalidation reaching every process that shares a backend"""
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from cache_store import make_cache
+from tools.fake_cache_server import FakeCacheServer
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def _invalidate(backend, options, name):
+    make_cache(backend, **options).namespace(name, 60).invalidate()
+
+
+def invalidate_in_other_process(backend, options, name):
+    worker = multiprocessing.get_context('fork').Process(target=_invalidate, args=(backend, options, name))
+    worker.start()
+    worker.join(30)
+    assert worker.exitcode == 0
+
+
+@pytest.fixture
+def server():
+    server = FakeCacheServer(port=0).start()
+    yield server
+    server.stop()
+
+
+def test_memory_namespaces_are_separate():
+    cache = make_cache('memory')
+    rankings, search = cache.namespace('rankings', 60), cache.namespace('search', 60)
+    rankings.set('top', [1, 2])
+    search.set('top', ['calculus'])
+    rankings.invalidate()
+    assert rankings.get('top') is None
+    assert search.get('top') == ['calculus']
+
+
+def test_shared_invalidation_reaches_other_processes(tmp_path):
+    options = {'path': os.path.join(str(tmp_path), 'cache.sqlite3')}
+    namespace = make_cache('shared', **options).namespace('rankings', 60)
+    namespace.set('top', [1, 2, 3])
+    assert namespace.get('top') == [1, 2, 3]
+
+    invalidate_in_other_process('shared', options, 'rankings')
+    assert namespace.get('top') is None
+    namespace.set('top', [3, 2, 1])
+    assert make_cache('shared', **options).namespace('rankings', 60).get('top') == [3, 2, 1]
+
+
+def test_kv_invalidation_reaches_other_processes(server):
+    options = {'url': server.url}
+    namespace = make_cache('kv', **options).namespace('rankings', 60)
+    other = make_cache('kv', **options).namespace('rankings', 60)
+    namespace.set('top', [1, 2, 3])
+    # The writer reads its own near copy; the other instance goes to the server, then keeps one too
+    assert namespace.get('top') == [1, 2, 3]
+    assert (namespace.near_hits, namespace.hits) == (1, 0)
+    assert other.get('top') == [1, 2, 3]
+    assert other.get('top') == [1, 2, 3]
+    assert (other.near_hits, other.hits) == (1, 1)
+
+    invalidate_in_other_process('kv', options, 'rankings')
+    # The near copies go when the published generation arrives, well before the periodic check
+    assert wait_for(lambda: namespace.get('top') is None, timeout=2.0)
+    assert wait_for(lambda: other.get('top') is None, timeout=2.0)
+
+
+def test_kv_server_restart_does_not_serve_stale_entries(server):
+    namespace = make_cache('kv', url=server.url).namespace('rankings', 60)
+    namespace.set('top', [1, 2, 3])
+    namespace.invalidate()
+    namespace.set('top', [3, 2, 1])
+    assert namespace.get('top') == [3, 2, 1]
+
+    server.stop()
+    server.store.values.clear()
+    server.start()
+    # The restarted server forgot the generation; the namespace follows it back rather than
+    # keeping near copies filed under the old one
+    assert wait_for(lambda: namespace.get('top') is None, timeout=5.0)
+
+
+def test_kv_errors_count_as_misses(server):
+    namespace = make_cache('kv', url=server.url).namespace('rankings', 60)
+    namespace.set('top', [1])
+    server.stop()
+    namespace._recheck()
+    namespace.near.clear()
+    assert namespace.get('top') is None
+    assert namespace.errors >= 1
+    server.start()
@@ -0,0 +1,67 @@
+"""The mapped catalog snapshot and when it is rebuilt"""
+import json
+import os
+import time
+
+from catalog_snapshot import CatalogSnapshot
+from oplog import LoggedJsonStore
+from storage import JsonStore
+
+BOOKS = [
+    {'id': 3, 'title': 'Data Structures', 'subject': 'Computer Science', 'availableCopies': 2},
+    {'id': 1, 'title': 'Calculus Made Easy', 'subject': 'Mathematics', 'availableCopies': 0, 'tags': ['limits']},
+    {'id': 2, 'title': 'Linear Algebra', 'subject': 'Mathematics', 'availableCopies': 1, 'status': None},
+]
+
+
+def open_snapshot(directory, store):
+    books_file = os.path.join(directory, 'library_books.json')
+    return CatalogSnapshot(os.path.join(directory, 'catalog.snapshot'), {'physical': books_file}, store), books_file
+
+
+def test_views_read_like_the_records(tmp_path):
+    store = JsonStore('sync')
+    snapshot, books_file = open_snapshot(str(tmp_path), store)
+    store.save(books_file, BOOKS)
+    snapshot.warm()
+
+    assert [dict(view) for view in snapshot.records('physical')] == BOOKS
+    assert snapshot.hits == 1
+    assert [view['id'] for view in snapshot.where('physical', {'subject': 'Mathematics'})] == [1, 2]
+    assert [view['id'] for view in snapshot.where('physical', {'availableCopies': lambda n: n > 0})] == [3, 2]
+    assert snapshot.find(1)[1]['tags'] == ['limits']
+    assert sorted(snapshot.lookup([2, 3, 99])) == [2, 3]
+
+
+def test_a_hand_edit_is_picked_up_under_the_files_backend(tmp_path):
+    store = JsonStore('sync')
+    snapshot, books_file = open_snapshot(str(tmp_path), store)
+    store.save(books_file, BOOKS)
+    snapshot.warm()
+
+    time.sleep(0.01)
+    with open(books_file, 'w') as f:
+        json.dump(BOOKS[:1], f)
+    snapshot.warm()
+    assert snapshot.builds == 2
+    assert [view['id'] for view in snapshot.records('physical')] == [3]
+
+
+def test_compaction_does_not_rebuild_under_the_oplog(tmp_path):
+    directory = str(tmp_path)
+    store = LoggedJsonStore(os.path.join(directory, 'oplog.jsonl'), 'sync')
+    snapshot, books_file = open_snapshot(directory, store)
+    store.save(books_file, BOOKS)
+    snapshot.warm()
+    assert snapshot.builds == 1
+
+    # Rewrites library_books.json without a commit
+    time.sleep(0.01)
+    store.compact()
+    snapshot.warm()
+    assert snapshot.builds == 1
+
+    store.transact([books_file], lambda books: books.pop())
+    snapshot.warm()
+    assert snapshot.builds == 2
+    assert [view['id'] for view in snapshot.records('physical')] == [3, 1]
@@ -0,0 +1,77 @@
+"""Chat responses: pinned FAQ answers, the shared cache and coalesced duplicates"""
+import json
+import threading
+import time
+
+from cache_store import make_cache
+from chat_cache import ChatResponseCache, normalize_prompt
+
+
+def make_response_cache():
+    return ChatResponseCache(make_cache('memory').namespace('chat', 60))
+
+
+def answer(text):
+    return lambda: {'success': True, 'response': text}
+
+
+def test_near_identical_prompts_share_an_answer():
+    cache = make_response_cache()
+    assert normalize_prompt('  Where is the CS section?? ') == 'where is the cs section'
+    assert cache.get_or_generate('Where is the CS section?', 'llama3', answer('Floor 1'))['cache'] == 'miss'
+    hit = cache.get_or_generate('where is the cs section', 'llama3', answer('never asked'))
+    assert (hit['cache'], hit['response']) == ('hit', 'Floor 1')
+    # Another model, or other grounding, is another answer
+    assert cache.get_or_generate('Where is the CS section?', 'phi3', answer('Floor 2'))['response'] == 'Floor 2'
+    assert cache.get_or_generate('Where is the CS section?', 'llama3', answer('Floor 3'),
+                                 variant='[1, 2]')['response'] == 'Floor 3'
+
+
+def test_faq_answers_never_reach_the_model(tmp_path):
+    faq_file = tmp_path / 'chat_faq.json'
+    faq_file.write_text(json.dumps([{'questions': ['How do I borrow a book?'], 'answer': 'Click Borrow.'}]))
+    cache = make_response_cache()
+    assert cache.load_faq(str(faq_file)) == 1
+
+    def generate():
+        raise AssertionError('the model was asked')
+
+    result = cache.get_or_generate('how do I borrow a book', 'any-model', generate)
+    assert (result['cache'], result['response']) == ('faq', 'Click Borrow.')
+
+
+def test_failures_are_not_cached():
+    cache = make_response_cache()
+    assert not cache.get_or_generate('hello', 'llama3', lambda: {'success': False, 'message': 'busy'})['success']
+    assert cache.get_or_generate('hello', 'llama3', answer('hi'))['cache'] == 'miss'
+    assert cache.get_or_generate('hello', 'llama3', answer('hi'))['cache'] == 'hit'
+
+
+def test_duplicates_in_flight_wait_for_one_generation():
+    cache = make_response_cache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(10)
+        return {'success': True, 'response': 'Floor 1'}
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(cache.get_or_generate('cs section', 'llama3', slow)))
+    leader.start()
+    assert started.wait(10)
+    followers = [threading.Thread(target=lambda: results.append(cache.get_or_generate('CS section!', 'llama3', slow)))
+                 for _ in range(3)]
+    for follower in followers:
+        follower.start()
+    while cache.stats()['coalesced'] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(10)
+
+    assert len(calls) == 1
+    assert sorted(result['cache'] for result in results) == ['coalesced'] * 3 + ['miss']
+    assert {result['response'] for result in results} == {'Floor 1'}
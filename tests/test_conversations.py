@@ -0,0 +1,53 @@
+"""Per-session conversations: what each turn sends, the token budget and eviction"""
+import time
+
+from conversations import ConversationStore, estimate_tokens
+
+
+def test_sessions_have_their_own_history():
+    store = ConversationStore()
+    ada, bob = store.get('ada'), store.get('bob')
+    assert store.build_request(ada, 'Any calculus books?') == {'prompt': 'Any calculus books?'}
+    store.record(ada, 'Any calculus books?', 'Calculus Made Easy.')
+
+    assert store.build_request(bob, 'And chemistry?') == {'prompt': 'And chemistry?'}
+    prompt = store.build_request(ada, 'Who wrote it?')['prompt']
+    assert prompt.splitlines() == ['User: Any calculus books?', 'Assistant: Calculus Made Easy.',
+                                   'User: Who wrote it?', 'Assistant:']
+
+
+def test_a_backend_context_replaces_the_transcript():
+    store = ConversationStore()
+    conversation = store.get('ada')
+    store.record(conversation, 'Any calculus books?', 'Calculus Made Easy.', context=[1, 2, 3])
+    assert store.build_request(conversation, 'Who wrote it?') == {'prompt': 'Who wrote it?', 'context': [1, 2, 3]}
+    # A reply without context means the next turn has to carry the transcript again
+    store.record(conversation, 'Who wrote it?', 'Silvanus Thompson.')
+    assert 'User: Any calculus books?' in store.build_request(conversation, 'When?')['prompt']
+
+
+def test_old_turns_are_summarized_to_stay_in_budget():
+    store = ConversationStore(token_budget=60)
+    conversation = store.get('ada')
+    for n in range(6):
+        store.record(conversation, f'Question {n} about thermodynamics. More detail here.', 'x' * 40)
+    message = 'What about entropy?'
+    request = store.build_request(conversation, message)
+
+    assert conversation.truncations == 1
+    assert conversation.history_tokens() + estimate_tokens(message) <= 60
+    assert conversation.messages[-2]['content'].startswith('Question 5')    # whole turns only, newest kept
+    # The summary keeps the most recent of the dropped questions
+    assert conversation.summary.endswith('Question 4 about thermodynamics.')
+    assert request['prompt'].startswith('Summary of the earlier conversation:')
+
+
+def test_idle_and_overflowing_conversations_are_evicted():
+    store = ConversationStore(idle_timeout=60, max_conversations=2)
+    for session_id in ('a', 'b', 'c'):
+        store.get(session_id)
+    assert store.peek('a') is None and store.evicted == 1
+
+    store.peek('b').last_active = time.time() - 120
+    assert store.evict_idle() == 1
+    assert store.peek('b') is None and store.peek('c') is not None
@@ -0,0 +1,37 @@
+"""ModelRouter: picking an installed model for each prompt"""
+from model_router import ModelRouter
+
+INSTALLED = [
+    {'name': 'llama3:latest', 'details': {'parameter_size': '8B', 'family': 'llama'}},
+    {'name': 'phi3:mini', 'details': {'parameter_size': '3.8B', 'family': 'phi3'}},
+    {'name': 'nomic-embed-text:latest', 'details': {'parameter_size': '137M', 'family': 'nomic-bert'}},
+]
+
+
+def test_untagged_default_is_the_installed_latest_tag():
+    router = ModelRouter('llama3')
+    router.set_models(INSTALLED)
+    assert router.warmup_model() == 'llama3:latest'
+
+
+def test_requested_model_matches_with_or_without_its_tag():
+    router = ModelRouter('llama3')
+    router.set_models(INSTALLED)
+    assert router.choose('hi', requested='llama3') == 'llama3:latest'
+    assert router.choose('hi', requested='phi3') == 'phi3:mini'
+    assert router.choose('hi', requested='phi3:mini') == 'phi3:mini'
+    # A tag that is not installed is routed like any other prompt
+    assert router.choose('hi', requested='llama3:70b') == 'phi3:mini'
+
+
+def test_tagged_default_finds_an_untagged_listing():
+    router = ModelRouter('llama3:latest')
+    router.set_models([{'name': 'llama3'}])
+    assert router.warmup_model() == 'llama3'
+
+
+def test_embedding_models_are_never_chosen():
+    router = ModelRouter('llama3', embedding_models=['nomic-embed-text'])
+    router.set_models(INSTALLED)
+    assert 'nomic-embed-text:latest' not in router.model_names()
+    assert router.choose('hi') == 'phi3:mini'
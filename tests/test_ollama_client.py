@@ -0,0 +1,62 @@
+"""OllamaSSHClient against tools/fake_ollama.py"""
+import sys
+import time
+
+import pytest
+
+import ollama_client
+from tools.fake_ollama import FakeBackend, FakeOllama
+
+
+def wait_for(predicate, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+@pytest.fixture(scope='module')
+def gateway():
+    fake = FakeOllama(FakeBackend(tokens_per_second=2000, response_tokens=5, load_time=0.05)).start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def client(gateway, monkeypatch):
+    monkeypatch.setitem(ollama_client.SSH_CONFIG, 'hostname', gateway.host)
+    monkeypatch.setitem(ollama_client.SSH_CONFIG, 'port', gateway.ssh_port)
+    client = ollama_client.OllamaSSHClient()
+    client.transport = 'api'
+    yield client
+    client.disconnect()
+
+
+def test_first_chat_connects_on_demand(client):
+    assert client.state == ollama_client.STATE_DISCONNECTED
+    first = client.chat('Which calculus books are there?')
+    assert not first['success']
+    assert first['state'] == ollama_client.STATE_CONNECTING
+    assert wait_for(lambda: client.state == ollama_client.STATE_READY)
+    answer = client.chat('Which calculus books are there?')
+    assert answer['success'], answer
+
+
+def test_chat_after_disconnect_stays_disconnected(client):
+    client.start_background()
+    assert wait_for(lambda: client.state == ollama_client.STATE_READY)
+    client.disconnect()
+    result = client.chat('hello there')
+    assert not result['success']
+    assert client.state == ollama_client.STATE_DISCONNECTED
+
+
+def test_missing_paramiko_is_a_failed_attempt(client, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'paramiko', None)
+    client.start_background()
+    assert wait_for(lambda: client.state == ollama_client.STATE_FAILED)
+    assert 'paramiko' in client.last_error
+    # The supervisor keeps running and will retry
+    assert client._supervisor.is_alive()
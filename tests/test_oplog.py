@@ -0,0 +1,126 @@
+"""The operation log: replay, compaction and what other processes' commits look like here"""
+import json
+import os
+
+from oplog import LoggedJsonStore
+
+
+def open_store(directory, **options):
+    return LoggedJsonStore(os.path.join(directory, 'oplog.jsonl'), 'sync', **options)
+
+
+def read_file(file_path):
+    with open(file_path) as f:
+        return json.load(f)
+
+
+def test_replay_after_compaction(tmp_path):
+    directory = str(tmp_path)
+    books_file = os.path.join(directory, 'library_books.json')
+    workshops_file = os.path.join(directory, 'workshops.json')
+    store = open_store(directory)
+    store.save(books_file, [{'id': 1, 'title': 'Algebra'}, {'id': 2, 'title': 'Biology'}])
+    store.save(workshops_file, {'workshops': [{'id': 'w1', 'seats': 10}]})
+    store.compact()
+
+    # Folded into the snapshots, with an empty log left behind
+    assert read_file(books_file) == [{'id': 1, 'title': 'Algebra'}, {'id': 2, 'title': 'Biology'}]
+    assert read_file(store.versions_path) == {'library_books.json': 1, 'workshops.json': 1}
+    assert os.path.getsize(store.log_path) == 0
+
+    store.transact([books_file], lambda books: books.append({'id': 3, 'title': 'Chemistry'}))
+    store.transact([books_file], lambda books: books.pop(0))
+    store.transact([workshops_file], lambda doc: doc['workshops'][0].update(seats=9))
+
+    # A process started now loads the snapshots and replays only the log tail
+    restarted = open_store(directory)
+    assert restarted.replayed == 3
+    assert restarted.load(books_file) == [{'id': 2, 'title': 'Biology'}, {'id': 3, 'title': 'Chemistry'}]
+    assert restarted.load(workshops_file) == {'workshops': [{'id': 'w1', 'seats': 9}]}
+    assert restarted.version(books_file) == 3
+    assert restarted.version(workshops_file) == 2
+    # ...and folds that tail straight away
+    assert read_file(books_file) == [{'id': 2, 'title': 'Biology'}, {'id': 3, 'title': 'Chemistry'}]
+    assert os.path.getsize(store.log_path) == 0
+
+
+def test_store_follows_another_store_through_its_compaction(tmp_path):
+    directory = str(tmp_path)
+    books_file = os.path.join(directory, 'library_books.json')
+    writer, reader = open_store(directory), open_store(directory)
+    writer.save(books_file, [{'id': 1, 'availableCopies': 2}])
+    assert reader.load(books_file) == [{'id': 1, 'availableCopies': 2}]
+
+    writer.transact([books_file], lambda books: books[0].update(availableCopies=1))
+    writer.compact()
+    writer.transact([books_file], lambda books: books[0].update(availableCopies=0))
+
+    # The log was swapped under the reader: it reloads the snapshot and applies the new tail
+    assert reader.load(books_file) == [{'id': 1, 'availableCopies': 0}]
+    assert reader.version(books_file) == writer.version(books_file) == 3
+
+    # Commits from the reader land on top of the writer's, not over them
+    reader.transact([books_file], lambda books: books[0].update(availableCopies=1))
+    assert writer.load(books_file) == [{'id': 1, 'availableCopies': 1}]
+
+
+def test_listeners_hear_other_processes_commits(tmp_path):
+    directory = str(tmp_path)
+    books_file = os.path.join(directory, 'library_books.json')
+    writer, reader = open_store(directory), open_store(directory)
+    writer.save(books_file, [{'id': 1, 'title': 'Algebra'}, {'id': 2, 'title': 'Biology'}])
+    reader.load(books_file)
+    heard = []
+    reader.listen(lambda path, data, changes: heard.append((path, data, changes)), [books_file])
+
+    writer.transact([books_file], lambda books: books.__setitem__(0, {'id': 1, 'title': 'Linear Algebra'}))
+    writer.transact([books_file], lambda books: books.pop())
+    reader.load(books_file)
+    # Both commits arrive as one set of record changes
+    assert heard == [(books_file, None, {1: {'id': 1, 'title': 'Linear Algebra'}, 2: None})]
+
+    # Across a compaction the reader cannot tell which records moved, so it hands over the document
+    heard.clear()
+    writer.transact([books_file], lambda books: books.append({'id': 3, 'title': 'Chemistry'}))
+    writer.compact()
+    reader.load(books_file)
+    assert heard == [(books_file, [{'id': 1, 'title': 'Linear Algebra'}, {'id': 3, 'title': 'Chemistry'}], None)]
+
+
+def test_torn_last_line_is_not_replayed(tmp_path):
+    directory = str(tmp_path)
+    books_file = os.path.join(directory, 'library_books.json')
+    store = open_store(directory, compact_interval=3600)
+    store.save(books_file, [{'id': 1, 'title': 'Algebra'}])
+    with open(store.log_path, 'a') as f:
+        f.write('{"commits": [{"file": "library_books.json", "vers')
+
+    restarted = open_store(directory)
+    assert restarted.load(books_file) == [{'id': 1, 'title': 'Algebra'}]
+    assert restarted.version(books_file) == 1
+
+
+def test_snapshot_replaced_while_loading_is_read_again(tmp_path):
+    directory = str(tmp_path)
+    books_file = os.path.join(directory, 'library_books.json')
+    writer = open_store(directory)
+    writer.save(books_file, [{'id': 1, 'availableCopies': 3}])
+    writer.compact()
+    reader = open_store(directory)
+    writer.transact([books_file], lambda books: books[0].update(availableCopies=2))
+    writer.transact([books_file], lambda books: books[0].update(availableCopies=1))
+
+    # The writer compacts between the reader's read of the snapshot and of the versions file
+    load_file, compacted = reader._load_file, []
+
+    def loading(file_path):
+        collection = load_file(file_path)
+        if not compacted:
+            compacted.append(True)
+            writer.compact()
+        return collection
+
+    reader._load_file = loading
+    assert reader.load(books_file) == [{'id': 1, 'availableCopies': 1}]
+    assert compacted
+    assert reader.version(books_file) == 3
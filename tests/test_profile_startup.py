@@ -0,0 +1,17 @@
+"""The start-up profiler must leave the real data directory alone"""
+import os
+
+from tools.profile_startup import ROOT, profile
+
+
+def snapshot_of(directory):
+    return {os.path.join(root, name): os.stat(os.path.join(root, name)).st_mtime_ns
+            for root, _, names in os.walk(directory) for name in names}
+
+
+def test_profiling_the_import_does_not_touch_data():
+    data_dir = os.path.join(ROOT, 'data')
+    before = snapshot_of(data_dir)
+    run = profile("import app\nassert app.DATA_DIR != 'data'")
+    assert run['packages']['app'] > 0
+    assert snapshot_of(data_dir) == before
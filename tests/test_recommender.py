@@ -0,0 +1,63 @@
+"""Collaborative filtering: the full build and the incremental updates agree"""
+from recommender import RecommendationEngine
+
+CATALOG = [{'id': n} for n in range(1, 7)]
+
+
+def make_users():
+    return {
+        'ada': {'favorites': [1, 2], 'borrowed_books': [3], 'major': 'CS', 'year': '1'},
+        'bob': {'favorites': [1, 2, 4], 'major': 'CS', 'year': '1'},
+        'cy': {'favorites': [2, 3], 'reserved_books': [5], 'major': 'Math', 'year': '2'},
+        'dee': {'borrowed_books': [4, 6], 'major': 'Math', 'year': '2'},
+    }
+
+
+def make_engine(users, catalog=CATALOG):
+    return RecommendationEngine(lambda: users, lambda: catalog, top_n=5)
+
+
+def rounded(recs):
+    return [(item, anchor, round(score, 6)) for item, anchor, score in recs]
+
+
+def test_updates_match_a_rebuild():
+    users = make_users()
+    engine = make_engine(users)
+    engine.build()
+    assert engine.for_user('ada')
+
+    users['ada']['favorites'].append(4)
+    engine.record('ada', 4, 'favorites', True, 'CS', '1')
+    users['bob']['favorites'].remove(2)
+    engine.record('bob', 2, 'favorites', False, 'CS', '1')
+    engine.flush()
+    assert engine.builds == 1
+
+    rebuilt = make_engine(users)
+    rebuilt.build()
+    for username in users:
+        assert rounded(engine.for_user(username)) == rounded(rebuilt.for_user(username))
+    assert engine.popular() == rebuilt.popular()
+    assert engine.for_cohort('CS', '1') == rebuilt.for_cohort('CS', '1')
+    assert engine.readers(4) == 3
+
+
+def test_interaction_on_an_item_outside_the_catalog_keeps_the_model():
+    users = make_users()
+    engine = make_engine(users)
+    engine.build()
+
+    users['ada']['favorites'].append(999)
+    engine.record('ada', 999, 'favorites', True, 'CS', '1')
+    engine.flush()
+    # One rebuild to look for the item, then the event is dropped rather than the model
+    assert engine._model is not None
+    assert engine.builds == 2
+    assert engine.readers(999) == 0
+
+    engine.record('bob', 5, 'favorites', True, 'CS', '1')
+    engine.flush()
+    assert engine.builds == 2
+    assert engine.readers(5) == 2
+    assert 999 not in [item for item, _, _ in engine.for_user('ada')]
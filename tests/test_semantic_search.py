@@ -0,0 +1,105 @@
+"""Semantic search: one embedding writer per directory, readers following its row map"""
+import json
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+
+from semantic_search import LocalEmbedder, SemanticSearchIndex, embedding_text
+
+BOOKS = [
+    {'id': 1, 'title': 'Calculus Made Easy', 'description': 'limits derivatives integrals'},
+    {'id': 2, 'title': 'Organic Chemistry', 'description': 'reactions of carbon compounds'},
+    {'id': 3, 'title': 'Data Structures', 'description': 'trees graphs hash tables'},
+    {'id': 4, 'title': 'Linear Algebra', 'description': 'matrices vectors eigenvalues'},
+]
+
+
+class CountingEmbedder(LocalEmbedder):
+    def __init__(self):
+        super().__init__()
+        self.texts = 0
+        self.by_thread = {}
+
+    def embed(self, texts):
+        self.texts += len(texts)
+        thread = threading.current_thread()
+        self.by_thread[thread] = self.by_thread.get(thread, 0) + len(texts)
+        return super().embed(texts)
+
+
+def make_index(directory, books=None):
+    books = BOOKS if books is None else books
+    return SemanticSearchIndex({'physical': lambda: list(books)}, CountingEmbedder(), directory)
+
+
+def _embed_in_child(directory):
+    make_index(directory).refresh()
+
+
+def run_child(directory):
+    child = multiprocessing.get_context('fork').Process(target=_embed_in_child, args=(directory,))
+    child.start()
+    child.join(60)
+    assert child.exitcode == 0
+
+
+def test_search_never_embeds_the_catalog(tmp_path):
+    index = make_index(str(tmp_path))
+    results = index.search('calculus')
+    # Left to the background worker, which may already have finished by the time search reads the rows
+    assert results is None or results[0]['id'] == 1
+    assert index.embedder.by_thread.get(threading.current_thread(), 0) == (0 if results is None else 1)
+
+
+def test_only_the_writer_embeds_and_readers_follow(tmp_path):
+    directory = str(tmp_path)
+    writer, reader = make_index(directory), make_index(directory)
+    assert writer.refresh() == len(BOOKS)
+    assert reader.refresh() == 0
+    assert reader.embedder.texts == 0
+    assert (writer.stats()['writer'], reader.stats()['writer']) == (True, False)
+    assert reader.search('calculus derivatives')[0]['id'] == 1
+
+    # A record added in the reader's worker is embedded by the writer and then found by the reader
+    change = {5: {'id': 5, 'title': 'Thermodynamics', 'description': 'heat entropy engines'}}
+    reader.sync('physical', None, change)
+    assert reader.stats()['pending'] == 1
+    writer.sync('physical', None, change)
+    assert writer.refresh() == 1
+    assert reader.search('entropy heat')[0]['id'] == 5
+    assert reader.stats()['pending'] == 0
+    assert reader.embedder.texts == 2   # only the two queries
+
+
+def test_rows_are_handed_out_once_across_processes(tmp_path):
+    directory = str(tmp_path)
+    context = multiprocessing.get_context('fork')
+    children = [context.Process(target=_embed_in_child, args=(directory,)) for _ in range(4)]
+    for child in children:
+        child.start()
+    for child in children:
+        child.join(60)
+        assert child.exitcode == 0
+
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    rows = {item_id: row for item_id, row, _ in meta['rows']}
+    assert len(set(rows.values())) == len(rows)
+    matrix = np.memmap(os.path.join(directory, 'vectors.f32'), dtype=np.float32, mode='r',
+                       shape=(meta['capacity'], meta['dim']))
+    # Every row holds the vector of the record it is mapped to, so no two writers interleaved
+    expected = LocalEmbedder().embed([embedding_text(book) for book in BOOKS])
+    for book, vector in zip(BOOKS, expected):
+        assert np.allclose(matrix[rows[book['id']]], vector, atol=1e-6)
+
+
+def test_writer_role_passes_on_when_the_writer_exits(tmp_path):
+    directory = str(tmp_path)
+    run_child(directory)
+    books = BOOKS + [{'id': 5, 'title': 'Thermodynamics', 'description': 'heat entropy engines'}]
+    index = make_index(directory, books)
+    assert index.refresh() == 1     # the child's rows are reused, only the new record is embedded
+    assert index.stats()['writer']
+    assert index.search('entropy heat')[0]['id'] == 5
@@ -0,0 +1,27 @@
+"""The gunicorn launcher's catalog watcher"""
+import os
+from types import SimpleNamespace
+
+from oplog import LoggedJsonStore
+from serve import CatalogWatcher, catalog_watcher, catalog_mtimes
+from storage import JsonStore
+
+
+def test_catalog_is_watched_only_under_the_files_backend(tmp_path):
+    catalog = [os.path.join(str(tmp_path), 'library_books.json')]
+    files = SimpleNamespace(json_store=JsonStore('sync'), CATALOG_FILES=catalog)
+    logged = SimpleNamespace(json_store=LoggedJsonStore(os.path.join(str(tmp_path), 'oplog.jsonl'), 'sync'),
+                             CATALOG_FILES=catalog)
+    assert isinstance(catalog_watcher(files, 300), CatalogWatcher)
+    assert catalog_watcher(files, 0) is None
+    assert catalog_watcher(logged, 300) is None
+
+
+def test_watcher_sees_a_file_change(tmp_path):
+    file_path = os.path.join(str(tmp_path), 'library_books.json')
+    watcher = CatalogWatcher([file_path], 300)
+    assert catalog_mtimes([file_path]) == watcher._seen == {file_path: 0}
+    JsonStore('sync').save(file_path, [])
+    assert catalog_mtimes([file_path]) != watcher._seen
+    watcher.mark_reloaded()
+    assert catalog_mtimes([file_path]) == watcher._seen
@@ -0,0 +1,87 @@
+"""Server-side sessions: backends shared between workers, and a new id on login"""
+import time
+
+import pytest
+from flask import Flask, session
+
+from session_store import ServerSideSessionInterface, make_session_store, SESSION_ID
+
+
+@pytest.fixture(params=['memory', 'file', 'sqlite'])
+def store(request, tmp_path):
+    return make_session_store(request.param, str(tmp_path))
+
+
+def test_save_get_delete(store):
+    sid = 'a' * 43
+    assert store.get(sid) is None
+    store.save(sid, {'username': 'ada'})
+    assert store.get(sid) == {'username': 'ada'}
+    store.delete(sid)
+    assert store.get(sid) is None
+
+
+def test_expired_sessions_are_gone(tmp_path):
+    store = make_session_store('sqlite', str(tmp_path), ttl=0.05)
+    store.save('b' * 43, {'username': 'ada'})
+    time.sleep(0.1)
+    assert store.get('b' * 43) is None
+
+
+@pytest.mark.parametrize('backend', ['file', 'sqlite'])
+def test_logout_in_one_worker_is_seen_by_another(tmp_path, backend):
+    sid = 'c' * 43
+    first, second = make_session_store(backend, str(tmp_path)), make_session_store(backend, str(tmp_path))
+    first.save(sid, {'username': 'ada'})
+    assert second.get(sid) == {'username': 'ada'}
+    assert second.get(sid) == {'username': 'ada'}    # now from its hot set
+    first.delete(sid)
+    assert second.get(sid) is None
+
+
+def make_app(store):
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    app.session_interface = ServerSideSessionInterface(store)
+
+    @app.route('/visit')
+    def visit():
+        session['visits'] = session.get('visits', 0) + 1
+        return 'ok'
+
+    @app.route('/login')
+    def login():
+        session.regenerate()
+        session['username'] = 'ada'
+        return 'ok'
+
+    @app.route('/whoami')
+    def whoami():
+        return session.get('username', '')
+
+    return app
+
+
+def session_cookie(client):
+    cookie = client.get_cookie('session')
+    return cookie.value if cookie is not None else None
+
+
+def test_login_moves_the_session_to_a_new_id(tmp_path):
+    store = make_session_store('sqlite', str(tmp_path))
+    client = make_app(store).test_client()
+    client.get('/visit')
+    before = session_cookie(client)
+    assert SESSION_ID.fullmatch(before)
+
+    client.get('/login')
+    after = session_cookie(client)
+    assert after != before
+    assert store.get(before) is None
+    assert store.get(after) == {'visits': 1, 'username': 'ada'}
+
+    # Someone holding the id from before the login is not logged in
+    attacker = make_app(store).test_client()
+    attacker.set_cookie('session', before)
+    assert attacker.get('/whoami').get_data(as_text=True) == ''
+    assert client.get('/whoami').get_data(as_text=True) == 'ada'
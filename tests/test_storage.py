@@ -0,0 +1,144 @@
+"""Read-check-write updates through JsonStore.transact and LoggedJsonStore.transact"""
+import json
+import multiprocessing
+import os
+import random
+import threading
+
+import pytest
+
+from oplog import LoggedJsonStore
+from storage import JsonStore, table_changes
+
+COPIES = 3
+USERS = 6
+ROUNDS = 40
+
+
+def write_library(directory):
+    books_file = os.path.join(directory, 'library_books.json')
+    users_file = os.path.join(directory, 'users.json')
+    with open(books_file, 'w') as f:
+        json.dump([{'id': 1, 'title': 'Calculus', 'copies': COPIES, 'availableCopies': COPIES}], f)
+    with open(users_file, 'w') as f:
+        json.dump({f'user{n}': {'borrowed_books': []} for n in range(USERS)}, f)
+    return books_file, users_file
+
+
+def borrow_and_return(store, books_file, users_file, username, rounds=ROUNDS, seed=0):
+    """Borrow the book when a copy is free and return it again, the way the routes do"""
+    rng = random.Random(seed)
+
+    def borrow(books, users):
+        book = books[0]
+        if book['availableCopies'] <= 0 or 1 in users[username]['borrowed_books']:
+            return False
+        book['availableCopies'] -= 1
+        users[username]['borrowed_books'].append(1)
+        return True
+
+    def give_back(books, users):
+        if 1 not in users[username]['borrowed_books']:
+            return False
+        users[username]['borrowed_books'].remove(1)
+        books[0]['availableCopies'] += 1
+        return True
+
+    for _ in range(rounds):
+        store.transact([books_file, users_file], rng.choice([borrow, give_back]))
+
+
+def check_loans(store, books_file, users_file):
+    book = store.load(books_file)[0]
+    loans = sum(1 in user['borrowed_books'] for user in store.load(users_file).values())
+    assert 0 <= book['availableCopies'] <= COPIES
+    assert book['availableCopies'] == COPIES - loans
+
+
+def _logged_worker(directory, books_file, users_file, username, seed):
+    store = LoggedJsonStore(os.path.join(directory, 'oplog.jsonl'), 'sync')
+    borrow_and_return(store, books_file, users_file, username, seed=seed)
+
+
+def test_threads_borrow_and_return_under_transact(tmp_path):
+    books_file, users_file = write_library(str(tmp_path))
+    store = JsonStore('sync')
+    threads = [threading.Thread(target=borrow_and_return, args=(store, books_file, users_file, f'user{n}', ROUNDS, n))
+               for n in range(USERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    check_loans(store, books_file, users_file)
+    check_loans(JsonStore('sync'), books_file, users_file)
+
+
+def test_processes_borrow_and_return_under_logged_transact(tmp_path):
+    directory = str(tmp_path)
+    books_file, users_file = write_library(directory)
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_logged_worker, args=(directory, books_file, users_file, f'user{n}', n))
+               for n in range(USERS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    store = LoggedJsonStore(os.path.join(directory, 'oplog.jsonl'), 'sync')
+    check_loans(store, books_file, users_file)
+    # Every commit bumped the version by one, whichever process made it
+    assert store.version(books_file) == store.version(users_file) > 0
+
+
+def test_transact_retries_when_another_process_committed(tmp_path):
+    directory = str(tmp_path)
+    books_file, users_file = write_library(directory)
+    log_path = os.path.join(directory, 'oplog.jsonl')
+    store, other = LoggedJsonStore(log_path, 'sync'), LoggedJsonStore(log_path, 'sync')
+    calls = []
+
+    def borrow(books):
+        calls.append(books[0]['availableCopies'])
+        if len(calls) == 1:
+            # Someone else takes a copy between this read and the commit
+            other.transact([books_file], lambda theirs: theirs[0].update(availableCopies=theirs[0]['availableCopies'] - 1))
+        books[0]['availableCopies'] -= 1
+
+    store.transact([books_file], borrow)
+    assert calls == [COPIES, COPIES - 1]
+    assert store.load(books_file)[0]['availableCopies'] == COPIES - 2
+    assert store.retries == 1
+
+
+def test_transact_gives_up_with_timeout_error(tmp_path):
+    books_file, _ = write_library(str(tmp_path))
+    log_path = os.path.join(str(tmp_path), 'oplog.jsonl')
+    store, other = LoggedJsonStore(log_path, 'sync'), LoggedJsonStore(log_path, 'sync')
+
+    def borrow(books):
+        other.transact([books_file], lambda theirs: theirs[0].update(title=theirs[0]['title'] + '!'))
+        books[0]['availableCopies'] -= 1
+
+    with pytest.raises(TimeoutError):
+        store.transact([books_file], borrow, retries=2)
+    assert store.load(books_file)[0]['availableCopies'] == COPIES
+
+
+def test_transact_tells_listeners_which_records_changed(tmp_path):
+    books_file, users_file = write_library(str(tmp_path))
+    store = JsonStore('sync')
+    heard = []
+    store.listen(lambda path, data, changes: heard.append((path, data, changes)), [books_file])
+
+    store.transact([books_file, users_file], lambda books, users: books[0].update(availableCopies=0))
+    assert heard == [(books_file, None, {1: {'id': 1, 'title': 'Calculus', 'copies': COPIES, 'availableCopies': 0}})]
+
+    store.save(books_file, [])
+    assert heard[-1] == (books_file, [], None)
+
+
+def test_table_changes():
+    old = [{'id': 1, 'n': 1}, {'id': 2, 'n': 2}]
+    assert table_changes(old, [{'id': 1, 'n': 1}, {'id': 3, 'n': 3}]) == {2: None, 3: {'id': 3, 'n': 3}}
+    assert table_changes({'a': 1}, {'a': 2}) is None
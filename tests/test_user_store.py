@@ -0,0 +1,56 @@
+"""Sharded users over JsonStore and the operation log"""
+import json
+import os
+import threading
+
+import pytest
+
+from oplog import LoggedJsonStore
+from storage import JsonStore
+from user_store import UserStore, bucket_for, migrate_users_file
+
+
+@pytest.fixture(params=['files', 'oplog'])
+def store(request, tmp_path):
+    if request.param == 'oplog':
+        return LoggedJsonStore(os.path.join(str(tmp_path), 'oplog.jsonl'), 'sync')
+    return JsonStore('sync')
+
+
+def test_migration_splits_users_once(store, tmp_path):
+    users_file = os.path.join(str(tmp_path), 'users.json')
+    directory = os.path.join(str(tmp_path), 'users')
+    users = {f'user{n}': {'password': f'pw{n}', 'favorites': [n]} for n in range(50)}
+    with open(users_file, 'w') as f:
+        json.dump(users, f)
+
+    assert migrate_users_file(users_file, store, directory, buckets=8)
+    assert not migrate_users_file(users_file, store, directory, buckets=8)
+    user_store = UserStore(store, directory, buckets=8)
+    assert user_store.all() == users
+    assert sorted(user_store.usernames()) == sorted(users)
+    assert user_store.get('user7') == users['user7']
+    assert user_store.path_for('user7') == user_store.shard_path(bucket_for('user7', 8))
+    assert user_store.get('nobody') is None
+
+
+def test_concurrent_registrations_keep_every_user_once(store, tmp_path):
+    directory = os.path.join(str(tmp_path), 'users')
+    migrate_users_file(os.path.join(str(tmp_path), 'users.json'), store, directory, buckets=4)
+    user_store = UserStore(store, directory, buckets=4)
+    created = []
+
+    def register(n):
+        # Two threads race for each name; exactly one of them gets it
+        created.append(user_store.create(f'user{n // 2}', {'password': str(n)}))
+
+    threads = [threading.Thread(target=register, args=(n,)) for n in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert created.count(True) == 20
+    assert sorted(user_store.usernames()) == sorted(f'user{n}' for n in range(20))
+    index = store.load(user_store.index_path, [])
+    assert len(index) == 20
@@ -0,0 +1,187 @@
+"""Load harness for the /api/ollama/chat path.
+
+Starts tools/fake_ollama.py in-process, runs the Flask app against a scratch
+copy of the data directory, registers N simulated users and has them chat
+concurrently. Each client transport (the shared ``ollama run`` REPL and the
+HTTP API over the SSH tunnel) is measured separately.
+
+/api/ollama/chat returns the whole answer in one response, so time to first
+token is measured as time to the first byte of the response body.
+
+Usage:
+    python -m tools.chat_benchmark --users 20 --messages 5 --transports repl,api
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+from tools.fake_ollama import FakeOllama, add_backend_arguments, backend_from_args
+
+TOPICS = ['databases', 'algorithms', 'calculus', 'machine learning', 'web development',
+          'statistics', 'python programming', 'software engineering']
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class SimulatedUser:
+    def __init__(self, host, port, username):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.cookie = ''
+
+    def _request(self, method, path, body=None, content_type=None):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=300)
+        headers = {'Cookie': self.cookie} if self.cookie else {}
+        if content_type:
+            headers['Content-Type'] = content_type
+        start = time.perf_counter()
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        first = response.read(1)
+        first_byte = time.perf_counter() - start
+        payload = first + response.read()
+        total = time.perf_counter() - start
+        set_cookie = response.getheader('Set-Cookie')
+        if set_cookie:
+            self.cookie = set_cookie.split(';', 1)[0]
+        conn.close()
+        return response.status, payload, first_byte, total
+
+    def register(self):
+        form = urlencode({
+            'username': self.username, 'password': 'bench', 'confirm_password': 'bench',
+            'name': self.username, 'major': 'Bachelor of Computer Science', 'year': 'Year2'
+        })
+        status, _, _, _ = self._request('POST', '/register', form, 'application/x-www-form-urlencoded')
+        return status in (200, 302)
+
+    def chat(self, message):
+        body = json.dumps({'message': message})
+        status, payload, first_byte, total = self._request('POST', '/api/ollama/chat', body, 'application/json')
+        ok = status == 200 and json.loads(payload or b'{}').get('success', False)
+        return ok, first_byte, total
+
+
+def run_load(users, messages, think_time, repeat_prompts):
+    ttft, totals, errors = [], [], []
+    lock = threading.Lock()
+
+    def worker(index, user):
+        for i in range(messages):
+            topic = TOPICS[(index + i) % len(TOPICS)]
+            if repeat_prompts:
+                message = f"Do you have any books about {topic}?"
+            else:
+                message = f"Do you have any books about {topic}? (user {index}, question {i})"
+            ok, first_byte, total = user.chat(message)
+            with lock:
+                if ok:
+                    ttft.append(first_byte)
+                    totals.append(total)
+                else:
+                    errors.append(message)
+            if think_time:
+                time.sleep(think_time)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i, u)) for i, u in enumerate(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+    return {
+        'requests': len(totals),
+        'errors': len(errors),
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(totals) / wall, 3) if wall else 0.0,
+        'ttft_p50': round(percentile(ttft, 50), 3),
+        'ttft_p95': round(percentile(ttft, 95), 3),
+        'ttft_p99': round(percentile(ttft, 99), 3),
+        'total_p50': round(percentile(totals, 50), 3),
+        'total_p95': round(percentile(totals, 95), 3),
+        'total_p99': round(percentile(totals, 99), 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent load test for /api/ollama/chat')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--messages', type=int, default=3, help='messages per user')
+    parser.add_argument('--think-time', type=float, default=0.0, help='seconds between a user\'s messages')
+    parser.add_argument('--transports', default='repl,api', help='comma separated: repl, api')
+    parser.add_argument('--repeat-prompts', action='store_true', help='reuse prompts to exercise the response cache')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    fake = FakeOllama(backend_from_args(args)).start()
+    data_dir = tempfile.mkdtemp(prefix='studyhub-bench-')
+    shutil.copytree('data', data_dir, dirs_exist_ok=True)
+    os.environ['OLLAMA_SSH_HOST'] = fake.host
+    os.environ['OLLAMA_SSH_PORT'] = str(fake.ssh_port)
+    os.environ['STUDYHUB_DATA_DIR'] = data_dir
+
+    # Imported late so the app picks up the stand-in host and scratch data directory
+    from werkzeug.serving import make_server
+    import app as studyhub
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, studyhub.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = studyhub.get_ollama_client()
+    client.start_background()
+    deadline = time.time() + 60
+    while client.state != 'ready' and time.time() < deadline:
+        time.sleep(0.1)
+    if client.state != 'ready':
+        raise SystemExit(f"Fake Ollama never became ready: {client.get_status()}")
+
+    results = {}
+    try:
+        for transport in [t for t in args.transports.split(',') if t]:
+            client.transport = transport
+            client.response_cache.clear()
+            users = [SimulatedUser('127.0.0.1', server.server_port, f'bench_{transport}_{i}') for i in range(args.users)]
+            for user in users:
+                user.register()
+            results[transport] = run_load(users, args.messages, args.think_time, args.repeat_prompts)
+        results['cache'] = client.response_cache.stats()
+    finally:
+        client.disconnect()
+        server.shutdown()
+        fake.stop()
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    header = f"{'transport':<10}{'reqs':>6}{'errs':>6}{'rps':>8}" \
+             f"{'ttft p50':>10}{'p95':>8}{'p99':>8}{'total p50':>11}{'p95':>8}{'p99':>8}"
+    print(header)
+    for transport, r in results.items():
+        if transport == 'cache':
+            continue
+        print(f"{transport:<10}{r['requests']:>6}{r['errors']:>6}{r['throughput_rps']:>8}"
+              f"{r['ttft_p50']:>10}{r['ttft_p95']:>8}{r['ttft_p99']:>8}"
+              f"{r['total_p50']:>11}{r['total_p95']:>8}{r['total_p99']:>8}")
+    print(f"cache: {results['cache']}")
+
+
+if __name__ == '__main__':
+    main()
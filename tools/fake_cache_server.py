@@ -0,0 +1,229 @@
+"""Local stand-in for the key-value server behind STUDYHUB_CACHE_BACKEND=kv.
+
+Speaks the subset of the Redis protocol that cache_store uses (GET, SET with
+EX/PX, DEL, INCR, PUBLISH, SUBSCRIBE, plus PING, AUTH, SELECT, DBSIZE and
+FLUSHALL) with everything held in one dict. Latency can be added to every
+reply to see how the app copes with a cache across the network, and stop()
+followed by start() on the same port plays a server restart.
+
+Usage:
+    python -m tools.fake_cache_server --port 6380 --latency-ms 1
+
+then start each node with STUDYHUB_CACHE_BACKEND=kv STUDYHUB_CACHE_URL=redis://127.0.0.1:6380.
+"""
+import argparse
+import socket
+import socketserver
+import threading
+import time
+
+
+def _bulk(value) -> bytes:
+    if value is None:
+        return b'$-1\r\n'
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def _array(items) -> bytes:
+    return b'*%d\r\n' % len(items) + b''.join(
+        b':%d\r\n' % item if isinstance(item, int) else _bulk(item) for item in items)
+
+
+def _read_command(reader):
+    line = reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b'*'):
+        # Inline command, e.g. typed into telnet
+        return line.split()
+    args = []
+    for _ in range(int(line[1:])):
+        length = int(reader.readline()[1:])
+        args.append(reader.read(length + 2)[:-2])
+    return args
+
+
+class FakeKeyValueStore:
+    """Values with optional expiry, and the subscribers of each channel"""
+
+    def __init__(self):
+        self.values = {}          # key -> (value, expires or None)
+        self.subscribers = {}     # channel -> set of handlers
+        self.lock = threading.Lock()
+        self.commands = 0
+
+    def _live(self, key):
+        entry = self.values.get(key)
+        if entry is not None and entry[1] is not None and entry[1] < time.time():
+            del self.values[key]
+            return None
+        return entry
+
+    def execute(self, name: bytes, args):
+        with self.lock:
+            self.commands += 1
+            if name == b'PING':
+                return b'+PONG\r\n'
+            if name in (b'AUTH', b'SELECT'):
+                return b'+OK\r\n'
+            if name == b'GET':
+                entry = self._live(args[0])
+                return _bulk(entry[0] if entry else None)
+            if name == b'SET':
+                expires = None
+                options = [arg.upper() for arg in args[2:]]
+                if b'PX' in options:
+                    expires = time.time() + int(args[2 + options.index(b'PX') + 1]) / 1000
+                elif b'EX' in options:
+                    expires = time.time() + int(args[2 + options.index(b'EX') + 1])
+                self.values[args[0]] = (args[1], expires)
+                return b'+OK\r\n'
+            if name == b'DEL':
+                return b':%d\r\n' % sum(self.values.pop(key, None) is not None for key in args)
+            if name == b'INCR':
+                entry = self._live(args[0])
+                try:
+                    value = int(entry[0]) + 1 if entry else 1
+                except ValueError:
+                    return b'-ERR value is not an integer or out of range\r\n'
+                self.values[args[0]] = (str(value).encode(), entry[1] if entry else None)
+                return b':%d\r\n' % value
+            if name == b'PUBLISH':
+                handlers = list(self.subscribers.get(args[0], ()))
+            elif name == b'DBSIZE':
+                return b':%d\r\n' % len(self.values)
+            elif name == b'FLUSHALL':
+                self.values.clear()
+                return b'+OK\r\n'
+            else:
+                return b"-ERR unknown command '%s'\r\n" % name
+        # Delivered outside the lock so a slow subscriber holds up only its publisher
+        delivered = 0
+        for handler in handlers:
+            if handler(args[0], args[1]):
+                delivered += 1
+        return b':%d\r\n' % delivered
+
+
+def make_handler(store: FakeKeyValueStore, latency: float):
+    class Handler(socketserver.StreamRequestHandler):
+        def setup(self):
+            super().setup()
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.server.connections.add(self.request)
+
+        def finish(self):
+            self.server.connections.discard(self.request)
+            try:
+                super().finish()
+            except OSError:
+                pass
+
+        def handle(self):
+            while True:
+                try:
+                    command = _read_command(self.rfile)
+                except (OSError, ValueError):
+                    return
+                if not command:
+                    return
+                name, args = command[0].upper(), command[1:]
+                if latency:
+                    time.sleep(latency)
+                if name == b'SUBSCRIBE':
+                    self.subscribe(args)
+                    return
+                try:
+                    self.wfile.write(store.execute(name, args))
+                except OSError:
+                    return
+
+        def subscribe(self, channels):
+            write_lock = threading.Lock()
+
+            def deliver(channel, message):
+                try:
+                    with write_lock:
+                        self.wfile.write(_array([b'message', channel, message]))
+                    return True
+                except OSError:
+                    return False
+
+            with store.lock:
+                for channel in channels:
+                    store.subscribers.setdefault(channel, set()).add(deliver)
+            with write_lock:
+                for count, channel in enumerate(channels, 1):
+                    self.wfile.write(_array([b'subscribe', channel, count]))
+            try:
+                # A subscribed connection only listens; wait for the client to hang up
+                while self.rfile.readline():
+                    pass
+            except OSError:
+                pass
+            finally:
+                with store.lock:
+                    for channel in channels:
+                        store.subscribers.get(channel, set()).discard(deliver)
+
+    return Handler
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, handler):
+        super().__init__(address, handler)
+        self.connections = set()
+
+
+class FakeCacheServer:
+    """Runs the server on a background thread; url is what STUDYHUB_CACHE_URL should be"""
+
+    def __init__(self, port=0, host='127.0.0.1', latency_ms=0.0, store=None):
+        self.host = host
+        self.port = port
+        self.latency = latency_ms / 1000
+        self.store = store or FakeKeyValueStore()
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        return f'redis://{self.host}:{self.port}'
+
+    def start(self):
+        self.server = _Server((self.host, self.port), make_handler(self.store, self.latency))
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop listening and drop every connection, subscribers included; the data is kept"""
+        self.server.shutdown()
+        self.server.server_close()
+        for connection in list(self.server.connections):
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Redis-compatible cache server')
+    parser.add_argument('--port', type=int, default=6380)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='delay added to every reply')
+    args = parser.parse_args()
+
+    server = FakeCacheServer(port=args.port, latency_ms=args.latency_ms).start()
+    print(f"Fake cache server on {server.url}")
+    print(f"Run each node with STUDYHUB_CACHE_BACKEND=kv STUDYHUB_CACHE_URL={server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
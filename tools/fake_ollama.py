@@ -0,0 +1,428 @@
+"""Local stand-in for the Ollama gateway used by ollama_client.
+
+Emulates both ways the client talks to the real host:
+
+* an SSH server whose interactive shell behaves like ``ollama run`` (prompt
+  markers, ANSI spinner codes, terminal echo), and which forwards
+  ``direct-tcpip`` channels to
+* an Ollama-compatible HTTP API (/api/generate, /api/chat, /api/embed,
+  /api/tags).
+
+Tokens are produced at a configurable rate with jitter, and a semaphore caps
+parallel generations the way OLLAMA_NUM_PARALLEL does on a real server.
+
+Usage:
+    python -m tools.fake_ollama --ssh-port 2222 --http-port 11434
+
+then start the app with OLLAMA_SSH_HOST=127.0.0.1 OLLAMA_SSH_PORT=2222.
+"""
+import argparse
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import paramiko
+
+PROMPT_MARKER = '>>> \x1b[38;5;245mSend a message (/? for help)\x1b[28D\x1b[0m'
+SPINNER = ['⠋', '⠙', '⠹', '⠸', '⠼', '⠴']
+DEFAULT_MODELS = ['llama3', 'llama3.2:1b', 'llama3.2:3b', 'llama3.1:8b']
+# Served by /api/embed only, but listed by /api/tags like every other installed model:
+# name -> (parameter size, family) as a real server reports them
+EMBEDDING_MODELS = {'nomic-embed-text': ('137M', 'nomic-bert')}
+EMBEDDING_DIM = 768
+FILLER = ('the library catalog lists several titles that match your question and '
+          'you can check availability on the library page before you visit').split()
+
+
+class FakeBackend:
+    """Token generator shared by the terminal and HTTP front ends"""
+
+    def __init__(self, models=None, tokens_per_second=30.0, jitter=0.2,
+                 prompt_tokens_per_second=600.0, response_tokens=40, parallel=1, load_time=0.5):
+        self.models = models or list(DEFAULT_MODELS)
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.response_tokens = response_tokens
+        self.load_time = load_time
+        self._slots = threading.Semaphore(parallel)
+
+    def _delay(self, rate):
+        base = 1.0 / rate
+        return max(0.0, base * (1 + random.uniform(-self.jitter, self.jitter)))
+
+    def tokenize(self, text):
+        return re.findall(r'\S+', text)
+
+    def generate(self, model, prompt, context=None):
+        """Yield response tokens; prompt evaluation cost scales with the new prompt only"""
+        words = [w for w in self.tokenize(prompt) if w.isalpha() and len(w) > 3][-8:]
+        with self._slots:
+            time.sleep(len(self.tokenize(prompt)) / self.prompt_tokens_per_second)
+            yield f'[{model}]'
+            for i in range(self.response_tokens - 1):
+                time.sleep(self._delay(self.tokens_per_second))
+                pool = words if words and i % 3 == 0 else FILLER
+                yield pool[i % len(pool)]
+
+    def embed(self, text):
+        """Deterministic unit vector: the sum of a fixed random direction per word"""
+        vector = [0.0] * EMBEDDING_DIM
+        for word in re.findall(r'[a-z0-9]+', text.lower()):
+            rng = random.Random(zlib.crc32(word.encode('utf-8')))
+            for i in range(EMBEDDING_DIM):
+                vector[i] += rng.gauss(0.0, 1.0)
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def context_after(self, context, prompt, response):
+        context = list(context or [])
+        start = len(context)
+        count = len(self.tokenize(prompt)) + len(self.tokenize(response))
+        return context + list(range(start, start + count))
+
+
+# HTTP API --------------------------------------------------------------------
+
+def make_http_handler(backend):
+    class OllamaAPIHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _read_json(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            return json.loads(self.rfile.read(length) or b'{}')
+
+        def _send_json(self, payload, status=200):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _stream(self, chunks):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-ndjson')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            for chunk in chunks:
+                self.wfile.write((json.dumps(chunk) + '\n').encode('utf-8'))
+                self.wfile.flush()
+
+        def do_GET(self):
+            if self.path == '/api/tags':
+                models = []
+                for name in backend.models:
+                    match = re.search(r':(\d+(?:\.\d+)?)b$', name)
+                    size = float(match.group(1)) if match else 8.0
+                    models.append({
+                        'name': name,
+                        'size': int(size * 6e8),
+                        'details': {'parameter_size': f'{size}B', 'family': 'llama', 'families': ['llama']}
+                    })
+                for name, (parameter_size, family) in EMBEDDING_MODELS.items():
+                    models.append({
+                        'name': f'{name}:latest',
+                        'size': 274302450,
+                        'details': {'parameter_size': parameter_size, 'family': family, 'families': [family]}
+                    })
+                return self._send_json({'models': models})
+            self._send_json({'error': 'not found'}, 404)
+
+        def do_POST(self):
+            payload = self._read_json()
+            model = payload.get('model', '')
+            if self.path == '/api/embed':
+                if model.split(':')[0] not in EMBEDDING_MODELS:
+                    return self._send_json({'error': f"model '{model}' not found"}, 404)
+                texts = payload.get('input', [])
+                texts = [texts] if isinstance(texts, str) else texts
+                return self._send_json({'model': model, 'embeddings': [backend.embed(t) for t in texts]})
+            if self.path not in ('/api/generate', '/api/chat'):
+                return self._send_json({'error': 'not found'}, 404)
+            if model not in backend.models:
+                return self._send_json({'error': f"model '{model}' not found"}, 404)
+
+            if self.path == '/api/chat':
+                prompt = '\n'.join(m.get('content', '') for m in payload.get('messages', []))
+            else:
+                prompt = payload.get('prompt', '')
+            tokens = backend.generate(model, prompt, payload.get('context'))
+
+            def finish(text):
+                if self.path == '/api/chat':
+                    return {'model': model, 'message': {'role': 'assistant', 'content': text}, 'done': True}
+                return {
+                    'model': model,
+                    'response': text,
+                    'done': True,
+                    'context': backend.context_after(payload.get('context'), prompt, text),
+                    'prompt_eval_count': len(backend.tokenize(prompt)),
+                    'eval_count': len(backend.tokenize(text))
+                }
+
+            if payload.get('stream', True):
+                def chunks():
+                    parts = []
+                    for token in tokens:
+                        parts.append(token)
+                        if self.path == '/api/chat':
+                            yield {'model': model, 'message': {'role': 'assistant', 'content': token + ' '}, 'done': False}
+                        else:
+                            yield {'model': model, 'response': token + ' ', 'done': False}
+                    # The closing chunk carries the stats and context but no new text
+                    final = finish(' '.join(parts))
+                    if self.path == '/api/chat':
+                        final['message']['content'] = ''
+                    else:
+                        final['response'] = ''
+                    yield final
+                return self._stream(chunks())
+            self._send_json(finish(' '.join(tokens)))
+
+    return OllamaAPIHandler
+
+
+# SSH front end -----------------------------------------------------------------
+
+class FakeSSHServer(paramiko.ServerInterface):
+    def __init__(self, backend, http_port):
+        self.backend = backend
+        self.http_port = http_port
+        self.forward_channels = set()
+
+    def get_allowed_auths(self, username):
+        return 'publickey,password'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        # Whatever host:port was asked for, forward to our HTTP API
+        self.forward_channels.add(chanid)
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        threading.Thread(target=TerminalSession(channel, self.backend).run, daemon=True).start()
+        return True
+
+
+class TerminalSession:
+    """Line-oriented emulation of a login shell running ``ollama run``"""
+
+    SHELL_PROMPT = 'student@fake-gateway:~$ '
+
+    def __init__(self, channel, backend):
+        self.channel = channel
+        self.backend = backend
+        self.model = None
+
+    def send(self, text):
+        self.channel.sendall(text.encode('utf-8'))
+
+    def run(self):
+        try:
+            self.send('Welcome to the fake Ollama gateway\r\n' + self.SHELL_PROMPT)
+            pending = ''
+            while True:
+                data = self.channel.recv(1024)
+                if not data:
+                    break
+                text = data.decode('utf-8', errors='ignore')
+                # Terminals echo what is typed
+                self.send(text.replace('\n', '\r\n'))
+                pending += text
+                while '\n' in pending or '\r' in pending:
+                    line, pending = re.split(r'\r\n|\n|\r', pending, maxsplit=1)
+                    self.handle_line(line.strip())
+        except (OSError, EOFError):
+            pass
+        finally:
+            self.channel.close()
+
+    def handle_line(self, line):
+        if self.model is None:
+            if line.startswith('ollama run '):
+                model = line.split()[2]
+                if model not in self.backend.models:
+                    self.send(f"Error: pull model manifest: file does not exist: '{model}' not found\r\n" + self.SHELL_PROMPT)
+                    return
+                end = time.time() + self.backend.load_time
+                i = 0
+                while time.time() < end:
+                    self.send(f'\x1b[?25l{SPINNER[i % len(SPINNER)]} \x1b[?25h\x1b[2K\r')
+                    i += 1
+                    time.sleep(0.1)
+                self.model = model
+                self.send(PROMPT_MARKER)
+            elif line:
+                self.send(f'bash: {line.split()[0]}: command not found\r\n' + self.SHELL_PROMPT)
+            else:
+                self.send(self.SHELL_PROMPT)
+            return
+
+        if line == '/bye':
+            self.model = None
+            self.send('\r\n' + self.SHELL_PROMPT)
+            return
+        if not line:
+            self.send(PROMPT_MARKER)
+            return
+
+        self.send('\x1b[?25l\x1b[?25h')
+        for token in self.backend.generate(self.model, line):
+            self.send(token + ' ')
+        # The prompt marker arrives in one write so the client can detect the end of the answer
+        self.send('\r\n\r\n' + PROMPT_MARKER)
+
+
+def _pump(source_recv, sink_send, on_close):
+    try:
+        while True:
+            data = source_recv(65536)
+            if not data:
+                break
+            sink_send(data)
+    except (OSError, EOFError):
+        pass
+    finally:
+        on_close()
+
+
+def _forward(channel, http_port):
+    upstream = socket.create_connection(('127.0.0.1', http_port))
+
+    def close_both():
+        for closer in (channel.close, upstream.close):
+            try:
+                closer()
+            except OSError:
+                pass
+
+    def half_close():
+        # The client finished sending its request; let the HTTP server see EOF
+        try:
+            upstream.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    threading.Thread(target=_pump, args=(channel.recv, upstream.sendall, half_close), daemon=True).start()
+    threading.Thread(target=_pump, args=(upstream.recv, channel.sendall, close_both), daemon=True).start()
+
+
+def _serve_ssh_client(client_socket, host_key, backend, http_port):
+    transport = paramiko.Transport(client_socket)
+    transport.add_server_key(host_key)
+    server = FakeSSHServer(backend, http_port)
+    try:
+        transport.start_server(server=server)
+    except (paramiko.SSHException, EOFError):
+        return
+    while transport.is_active():
+        channel = transport.accept(1)
+        if channel is None:
+            continue
+        if channel.get_id() in server.forward_channels:
+            _forward(channel, http_port)
+
+
+class FakeOllama:
+    """Runs the HTTP API and the SSH front end on background threads"""
+
+    def __init__(self, backend=None, ssh_port=0, http_port=0, host='127.0.0.1'):
+        self.backend = backend or FakeBackend()
+        self.host = host
+        self.http_server = ThreadingHTTPServer((host, http_port), make_http_handler(self.backend))
+        self.http_server.daemon_threads = True
+        self.http_port = self.http_server.server_address[1]
+        self.ssh_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.ssh_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.ssh_socket.bind((host, ssh_port))
+        self.ssh_socket.listen(100)
+        self.ssh_port = self.ssh_socket.getsockname()[1]
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self._running = True
+
+    def start(self):
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._accept_ssh, daemon=True).start()
+        return self
+
+    def _accept_ssh(self):
+        while self._running:
+            try:
+                client_socket, _ = self.ssh_socket.accept()
+            except OSError:
+                break
+            threading.Thread(
+                target=_serve_ssh_client,
+                args=(client_socket, self.host_key, self.backend, self.http_port),
+                daemon=True
+            ).start()
+
+    def stop(self):
+        self._running = False
+        self.http_server.shutdown()
+        self.ssh_socket.close()
+
+
+def add_backend_arguments(parser):
+    parser.add_argument('--models', default=','.join(DEFAULT_MODELS), help='comma separated model names')
+    parser.add_argument('--tokens-per-second', type=float, default=30.0)
+    parser.add_argument('--jitter', type=float, default=0.2, help='relative jitter on each token delay')
+    parser.add_argument('--prompt-tokens-per-second', type=float, default=600.0)
+    parser.add_argument('--response-tokens', type=int, default=40)
+    parser.add_argument('--parallel', type=int, default=1, help='concurrent generations, like OLLAMA_NUM_PARALLEL')
+    parser.add_argument('--load-time', type=float, default=0.5, help='seconds `ollama run` takes to load a model')
+
+
+def backend_from_args(args):
+    return FakeBackend(
+        models=[m for m in args.models.split(',') if m],
+        tokens_per_second=args.tokens_per_second,
+        jitter=args.jitter,
+        prompt_tokens_per_second=args.prompt_tokens_per_second,
+        response_tokens=args.response_tokens,
+        parallel=args.parallel,
+        load_time=args.load_time
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake Ollama SSH gateway and HTTP API')
+    parser.add_argument('--ssh-port', type=int, default=2222)
+    parser.add_argument('--http-port', type=int, default=11434)
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    fake = FakeOllama(backend_from_args(args), ssh_port=args.ssh_port, http_port=args.http_port).start()
+    print(f"Fake Ollama SSH on 127.0.0.1:{fake.ssh_port}, HTTP API on 127.0.0.1:{fake.http_port}")
+    print(f"Run the app with OLLAMA_SSH_HOST=127.0.0.1 OLLAMA_SSH_PORT={fake.ssh_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
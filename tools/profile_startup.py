@@ -0,0 +1,86 @@
+"""Import-time cost of starting the app, per top-level module.
+
+Runs ``import app`` in a fresh interpreter under ``python -X importtime`` and
+adds up each module's own import time by top-level package, so a dependency
+shows up as one line however many submodules it has. The chat path (building
+the Ollama client and importing paramiko on first use) is measured on top.
+Also reports wall time and the peak memory of each run.
+
+Importing app migrates and writes its data files, so every run imports it
+over a scratch copy of data/ and the real one is never touched.
+
+Usage:
+    python -m tools.profile_startup --top 15
+    python serve.py --profile-startup
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Dict, Any
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_PATHS = {
+    'app': 'import app',
+    'app + chat': 'import app\napp.get_ollama_client()\nimport paramiko'
+}
+
+MEASURE = '''import resource, time
+start = time.perf_counter()
+{statement}
+print('STARTUP', time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def profile(statement: str) -> Dict[str, Any]:
+    """Per-package import time (ms), wall time (ms) and peak RSS (MB) of running statement"""
+    with tempfile.TemporaryDirectory(prefix='studyhub-profile-') as scratch:
+        data_dir = os.path.join(scratch, 'data')
+        shutil.copytree(os.path.join(ROOT, 'data'), data_dir, ignore=shutil.ignore_patterns('.locks'))
+        env = dict(os.environ, STUDYHUB_DATA_DIR=data_dir)
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', MEASURE.format(statement=statement)],
+                                cwd=ROOT, env=env, capture_output=True, text=True)
+    marker = [line for line in result.stdout.splitlines() if line.startswith('STARTUP ')]
+    if result.returncode != 0 or not marker:
+        raise RuntimeError(f"Profiling {statement!r} failed:\n{result.stderr[-2000:]}")
+    packages: Dict[str, float] = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0.0) + int(self_us) / 1000
+    _, seconds, maxrss = marker[-1].split()
+    return {
+        'packages': packages,
+        'wall_ms': float(seconds) * 1000,
+        'peak_rss_mb': int(maxrss) / 1024
+    }
+
+
+def report(top: int = 15):
+    runs = {label: profile(statement) for label, statement in STARTUP_PATHS.items()}
+    for label, run in runs.items():
+        print(f"{label}: {run['wall_ms']:.0f} ms, peak RSS {run['peak_rss_mb']:.1f} MB")
+    base, chat = runs['app']['packages'], runs['app + chat']['packages']
+    print("\nImported at start-up (ms):")
+    for package in sorted(base, key=lambda p: -base[p])[:top]:
+        print(f"  {package:<28}{base[package]:>8.1f}")
+    deferred = {package: ms for package, ms in chat.items() if package not in base}
+    print("\nDeferred to first chat use (ms):")
+    for package in sorted(deferred, key=lambda p: -deferred[p])[:top]:
+        print(f"  {package:<28}{deferred[package]:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report import-time cost of starting the app')
+    parser.add_argument('--top', type=int, default=15, help='modules to list')
+    args = parser.parse_args()
+    report(args.top)
+
+
+if __name__ == '__main__':
+    main()
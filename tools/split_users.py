@@ -0,0 +1,47 @@
+"""Split data/users.json into the sharded layout of user_store.py.
+
+The app does this itself on first start; run it by hand to migrate ahead of
+a deploy or to pick a different shard count. Stop the app first. Commits
+still in the operation log are folded into users.json before it is split.
+users.json is left in place as a backup.
+
+Usage:
+    python -m tools.split_users --data-dir data --buckets 64
+"""
+import argparse
+import os
+
+from oplog import LoggedJsonStore
+from storage import JsonStore
+from user_store import USER_BUCKETS, UserStore, split_users
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Split users.json into per-user shards')
+    parser.add_argument('--data-dir', default=os.environ.get('STUDYHUB_DATA_DIR', 'data'))
+    parser.add_argument('--buckets', type=int, default=USER_BUCKETS, help='number of shard files')
+    parser.add_argument('--storage', choices=['oplog', 'files'],
+                        default=os.environ.get('STUDYHUB_STORAGE', 'oplog'))
+    args = parser.parse_args()
+
+    if args.storage == 'files':
+        store = JsonStore('sync')
+    else:
+        store = LoggedJsonStore(os.path.join(args.data_dir, 'oplog.jsonl'), 'sync')
+    users_dir = os.path.join(args.data_dir, 'users')
+    users_file = os.path.join(args.data_dir, 'users.json')
+    if UserStore(store, users_dir, args.buckets).migrated():
+        raise SystemExit(f"{users_dir} is already sharded, nothing to do")
+    if not os.path.exists(users_file):
+        raise SystemExit(f"No {users_file} to split")
+
+    users = store.load(users_file)
+    counts = split_users(users, store, users_dir, args.buckets)
+    store.flush()
+    sizes = counts.values()
+    print(f"Split {len(users)} users into {len(counts)} shards in {users_dir} "
+          f"({min(sizes, default=0)}-{max(sizes, default=0)} users each)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""User records sharded into hash buckets.
+
+users.json held every user, so each login, favourite toggle or settings
+change read and rewrote all of them. Users now live in data/users/ in
+USER_BUCKETS shard files (``shard-07.json``), each a ``{username: record}``
+object like the old file, so route code is unchanged apart from which file
+it loads. A small index (``index.json``, one ``{"id": username, "bucket": n}``
+row per user) says which shard holds whom; new users go to the shard their
+name hashes to. Under the operation log every shard is its own collection
+with its own lock, so users in different shards never wait on each other.
+
+migrate_users_file() splits an existing users.json; the app runs it on
+startup and tools/split_users.py runs it by hand.
+"""
+import os
+import threading
+import time
+import zlib
+from typing import Dict, Any, Optional, List
+
+USER_BUCKETS = 64
+
+# A username missing from the cached index rereads it at most this often
+INDEX_REFRESH_INTERVAL = 1.0
+
+
+def bucket_for(username: str, buckets: int = USER_BUCKETS) -> int:
+    return zlib.crc32(username.encode('utf-8')) % buckets
+
+
+class UserStore:
+    """Per-user access to the sharded users over a JsonStore"""
+
+    def __init__(self, store, directory: str, buckets: int = USER_BUCKETS):
+        self.store = store
+        self.directory = directory
+        self.buckets = buckets
+        self.index_path = os.path.join(directory, 'index.json')
+        self._index: Optional[Dict[str, int]] = None    # username -> bucket
+        self._index_loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def migrated(self) -> bool:
+        # Under the operation log the index may still be only in the log
+        return os.path.exists(self.index_path) or bool(self._load_index())
+
+    def shard_path(self, bucket: int) -> str:
+        return os.path.join(self.directory, f'shard-{bucket:02d}.json')
+
+    def _load_index(self) -> Dict[str, int]:
+        rows = self.store.load(self.index_path, [])
+        return {row['id']: row['bucket'] for row in rows}
+
+    def _bucket(self, username: str) -> Optional[int]:
+        """Shard holding username, or None for an unknown user"""
+        with self._lock:
+            if self._index is None:
+                self._index, self._index_loaded_at = self._load_index(), time.monotonic()
+            bucket = self._index.get(username)
+            if bucket is None and time.monotonic() - self._index_loaded_at >= INDEX_REFRESH_INTERVAL:
+                # Registered by another worker since the index was read
+                self._index, self._index_loaded_at = self._load_index(), time.monotonic()
+                bucket = self._index.get(username)
+            return bucket
+
+    def path_for(self, username: str) -> str:
+        """The shard file for username; unknown users map to the shard they would be created in"""
+        bucket = self._bucket(username)
+        return self.shard_path(bucket_for(username, self.buckets) if bucket is None else bucket)
+
+    def shard(self, username: str) -> Dict[str, Any]:
+        """{username: record, ...} for the shard holding username"""
+        return self.store.load(self.path_for(username))
+
+    def get(self, username: str) -> Optional[Dict[str, Any]]:
+        if self._bucket(username) is None:
+            return None
+        return self.shard(username).get(username)
+
+    def exists(self, username: str) -> bool:
+        return self._bucket(username) is not None
+
+    def create(self, username: str, record: Dict[str, Any]) -> bool:
+        """Add a user to its shard and the index; False if the name is taken"""
+        bucket = bucket_for(username, self.buckets)
+
+        def add(index, shard):
+            if any(row['id'] == username for row in index) or username in shard:
+                return False
+            index.append({'id': username, 'bucket': bucket})
+            shard[username] = record
+            return True
+
+        created, _ = self.store.transact([self.index_path, self.shard_path(bucket)], add)
+        if created:
+            with self._lock:
+                if self._index is not None:
+                    self._index[username] = bucket
+        return created
+
+    def usernames(self) -> List[str]:
+        with self._lock:
+            self._index, self._index_loaded_at = self._load_index(), time.monotonic()
+            return list(self._index)
+
+    def all(self) -> Dict[str, Any]:
+        """Every user, for whole-population consumers such as the recommender"""
+        users = {}
+        buckets = set(self._load_index().values())
+        for bucket in sorted(buckets):
+            users.update(self.store.load(self.shard_path(bucket)))
+        return users
+
+
+def split_users(users: Dict[str, Any], store, directory: str, buckets: int = USER_BUCKETS) -> Dict[int, int]:
+    """Write users into shards and the index; returns users per bucket"""
+    os.makedirs(directory, exist_ok=True)
+    user_store = UserStore(store, directory, buckets)
+    shards: Dict[int, Dict[str, Any]] = {}
+    index = []
+    for username, record in users.items():
+        bucket = bucket_for(username, buckets)
+        shards.setdefault(bucket, {})[username] = record
+        index.append({'id': username, 'bucket': bucket})
+    for bucket, shard in shards.items():
+        store.save(user_store.shard_path(bucket), shard)
+    # The index goes last: its presence is what marks the migration done
+    store.save(user_store.index_path, index)
+    return {bucket: len(shard) for bucket, shard in shards.items()}
+
+
+def migrate_users_file(users_file: str, store, directory: str, buckets: int = USER_BUCKETS) -> bool:
+    """Split users_file into shards unless that was already done; True if it ran.
+
+    Without a users_file an empty index is written, so a fresh data directory
+    starts out sharded.
+    """
+    user_store = UserStore(store, directory, buckets)
+    if user_store.migrated():
+        return False
+    users = store.load(users_file) if os.path.exists(users_file) else {}
+    counts = split_users(users, store, directory, buckets)
+    print(f"Split {len(users)} users from {users_file} into {len(counts)} shards in {directory}")
+    return True